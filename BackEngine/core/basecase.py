@@ -6,8 +6,9 @@
 import re
 import time
 import asyncio
-import requests
+import inspect
 import io
+import httpx
 # 导入内置的测试工具函数
 from requests.structures import CaseInsensitiveDict
 
@@ -16,6 +17,10 @@ from jsonpath import jsonpath
 from BackEngine.core.caselog import CaseLogHandel
 
 from BackEngine.core.dbclient import DBClient
+from BackEngine.core.httpclient import http_pool, build_timeout, HttpSession
+from BackEngine.core.scriptcache import script_cache, uses_name
+from BackEngine.core.template import template_cache
+from common.settings import RESPONSE_CONFIG
 
 import base64
 import json
@@ -47,54 +52,70 @@ db = DBClient()
 class BaseCase(CaseLogHandel):
     """用例执行的基本父类"""
 
-    def __run_script(self, data, env_object):
-        """专门执行前后置脚本的函数"""
-        # 在前后置脚本的执行环境中内置一些变量
-        test = self
-        # global_val = env
-        # global ENV
-        # ENV = env
+    # 运行器提供的环境变量写缓冲，为空时每次修改立即保存
+    env_buffer = None
+    # 前后置脚本中使用的数据库连接对象，运行器会替换为本次运行的连接
+    db = db
+    # 前后置脚本中使用的工具函数模块，运行器会替换为加载了环境global_func的独立模块
+    functools = my_functools
 
-        print = self.print_log
-        # 获取用例的前置脚本
-        setup_script = data.get('setup_script')
-        # 使用执行器函数执行python的脚步代码
-        self.info_log("*****执行前置脚本*****")
-        exec(setup_script)
-        # 接受传进来的响应结果
-        response = yield
-        self.info_log("*****执行后置脚本*****")
-        teardown_script = data.get('teardown_script')
-        exec(teardown_script)
-        yield
+    async def __run_script(self, script, filename):
+        """
+        专门执行前后置脚本的函数，脚本中可以直接使用await(例如await db.local.fetch(sql))
+        :param script: 脚本代码
+        :param filename: 脚本名称
+        :return:
+        """
+        code = script_cache.compile(script, filename)
+        # 前置脚本中定义的变量保存在命名空间中，后置脚本可以继续使用
+        result = eval(code, globals(), self.script_namespace)
+        if inspect.iscoroutine(result):
+            await result
 
-    def __setup_script(self, data, env, env_object):
+    async def __setup_script(self, data, env, env_object):
         """
         脚本执行前
         :param data:
         :return:
         """
-        # 使用脚本执行器函数创建一个生成器对象
         self.env_object = env_object
-        self.script_hook = self.__run_script(data, env_object)
-        # 执行前置脚步（执行生成器中的代码）
-        next(self.script_hook)
+        # 在前后置脚本的执行环境中内置一些变量
+        self.script_namespace = {
+            "self": self,
+            "test": self,
+            "db": self.db,
+            "my_functools": self.functools,
+            "print": self.print_log,
+            "data": data,
+            "env_object": env_object,
+        }
+        # 获取用例的前置脚本
+        setup_script = data.get('setup_script')
+        self.script_namespace['setup_script'] = setup_script
+        # 使用执行器函数执行python的脚步代码
+        self.info_log("*****执行前置脚本*****")
+        await self.__run_script(setup_script, '<setup_script>')
 
-    def __teardown_script(self, response):
+    async def __teardown_script(self, response):
         """
         脚本执行后
         :param data:
         :return:
         """
-        # 执行后置脚本
-        # next(self.script_hook)
-        self.script_hook.send(response)
-        # 删除生成器对象
-        delattr(self, 'script_hook')
-
-
+        teardown_script = self.script_namespace['data'].get('teardown_script')
+        # 响应体被截断时，只有脚本用到response才读取完整内容
+        if getattr(self, 'response_truncated', False) and \
+                uses_name(script_cache.compile(teardown_script, '<teardown_script>'), 'response'):
+            response = self.full_response_body()
+        # 接受传进来的响应结果
+        self.script_namespace['response'] = response
+        self.info_log("*****执行后置脚本*****")
+        self.script_namespace['teardown_script'] = teardown_script
+        await self.__run_script(teardown_script, '<teardown_script>')
+        # 删除脚本的命名空间
+        delattr(self, 'script_namespace')
 
-    def __handler_requests_data(self, data, env):
+    async def __handler_requests_data(self, data, env, client):
         """处理请求数据的方法"""
         # global ENV
         request_data = {}
@@ -148,7 +169,7 @@ class BaseCase(CaseLogHandel):
                                 src = meta[2] if len(meta) > 2 else None
                                 src_str = str(src).strip().strip('`"\'') if src is not None else ''
                                 if src_str.startswith('http'):
-                                    r = requests.get(src_str, stream=True)
+                                    r = await client.get(src_str)
                                     r.raise_for_status()
                                     content = r.content
                                 else:
@@ -173,10 +194,10 @@ class BaseCase(CaseLogHandel):
                             import os
                             temp_dir = tempfile.gettempdir()
                             filename = os.path.join(temp_dir, name)
-                            with requests.get(file_val['url'], stream=True) as r:
+                            async with client.stream('GET', file_val['url']) as r:
                                 r.raise_for_status()
                                 with open(filename, 'wb') as f:
-                                    for chunk in r.iter_content(chunk_size=8192):
+                                    async for chunk in r.aiter_bytes(chunk_size=8192):
                                         f.write(chunk)
                             request_data['files'] = {'file': (os.path.basename(filename), open(filename, 'rb'), mime)}
                             headers.pop('Content-Type', None)
@@ -190,34 +211,18 @@ class BaseCase(CaseLogHandel):
         return request_data
 
     def replace_data(self, data, env):
-        pattern = re.compile(r'\${{(.+?)}}')
-        def repl_in_str(s):
-            def _r(m):
-                key = m.group(1)
-                value = env.get('ENV').get(key)
-                return '' if value is None else str(value)
-            return pattern.sub(_r, s)
-        def walk(obj):
-            if isinstance(obj, str):
-                return repl_in_str(obj)
-            if isinstance(obj, dict):
-                out = {}
-                for k, v in obj.items():
-                    if k == 'files':
-                        out[k] = v
-                    else:
-                        out[k] = walk(v)
-                return out
-            if isinstance(obj, list):
-                return [walk(v) for v in obj]
-            if isinstance(obj, tuple):
-                return tuple(walk(v) for v in obj)
-            return obj
-        return walk(data)
+        """替换请求数据中的${{var}}变量，只替换预编译模板中记录的位置"""
+        case = getattr(self, 'data', {})
+        key = None
+        if case.get('request_hash'):
+            # 执行计划中预先计算了用例的哈希，只需加上来自环境的url和请求头
+            key = (case['request_hash'], data['url'],
+                   json.dumps(data.get('headers'), ensure_ascii=False, sort_keys=True, default=str))
+        return template_cache.get(data, case.get('id'), key).render(data, env.get('ENV'))
 
     def convert_to_dict(self, obj):
         """Recursively converts a CaseInsensitiveDict to a regular dict."""
-        if isinstance(obj, CaseInsensitiveDict):
+        if isinstance(obj, (CaseInsensitiveDict, httpx.Headers)):
             return dict(obj)
         elif isinstance(obj, dict):
             return {k: self.convert_to_dict(v) for k, v in obj.items()}
@@ -228,21 +233,24 @@ class BaseCase(CaseLogHandel):
         else:
             return obj
 
-    def __send_request(self, data, env):
+    async def __send_request(self, data, env):
         """
         发送请求的方法
         :param data:
         :return:
         """
-        # 处理用例的请求数据(替换请求参数中的变量，将数据转换为requests发送请求所需要的格式)
-        request_data = self.__handler_requests_data(data, env)
-        start_time = time.time()
-        timeout_cfg = env.get('ENV').get('timeout', (5, 30))
-        if isinstance(timeout_cfg, (int, float)):
-            timeout_cfg = (5, timeout_cfg)
+        timeout_cfg = build_timeout(env.get('ENV').get('timeout', (5, 30)))
         verify_cfg = env.get('ENV').get('verify', True)
+        # 同一次运行的用例共用一个会话(keep-alive连接池)
+        session = getattr(self, 'session', None)
+        if session is None:
+            session = HttpSession(http_pool, getattr(self.env_object, 'id', None))
+        # 处理用例的请求数据(替换请求参数中的变量，将数据转换为发送请求所需要的格式)
+        request_data = await self.__handler_requests_data(data, env, session.client(verify_cfg))
+        start_time = time.time()
         try:
-            response = requests.request(**request_data, timeout=timeout_cfg, verify=verify_cfg)
+            response, body = await session.capture(**request_data, verify=verify_cfg, timeout=timeout_cfg,
+                                                   **self.__body_limits(data, env))
         except Exception as e:
             self.status = "错误"
             self.status_code = 0
@@ -252,7 +260,12 @@ class BaseCase(CaseLogHandel):
             return self.response_body
         self.requests_header = self.convert_to_dict(response.request.headers)
         self.response_header = self.convert_to_dict(response.headers)
-        self.response_body = response.text
+        # 超过上限的响应体只保存预览，完整内容在需要时从body中读取
+        self.response_capture = body
+        self.response_size = body.size
+        self.response_sha256 = body.sha256
+        self.response_truncated = body.truncated
+        self.response_body = body.summary(RESPONSE_CONFIG['preview_size'])
         # 解密
         # decrypt_py = ENV.get('decrypt_py')
         decrypt_py = env.get('decrypt_py')
@@ -261,10 +274,10 @@ class BaseCase(CaseLogHandel):
             decrypt_py = decrypt_py.strip()
             if decrypt_py != '[]':
                 self.info_log("*****执行解密脚本*****")
-                text = response.text
+                text = body.text()
                 # 定义一个命名空间字典用于存储 exec 执行后的变量
                 namespace = {'text': text}
-                exec(decrypt_py, globals(), namespace)
+                exec(script_cache.compile(decrypt_py, '<decrypt_py>'), globals(), namespace)
                 # 从命名空间中获取 json_data
                 json_data_result = namespace.get('json_data', None)
                 # 输出结果
@@ -278,24 +291,64 @@ class BaseCase(CaseLogHandel):
         # 返回响应对象
         return self.response_body
 
-    def perform(self, data, env, env_object):
+    @staticmethod
+    def __body_limits(data, env):
+        """响应体的保存上限，用例请求参数中的配置优先于环境配置"""
+        limits = {}
+        request = data.get('request') or {}
+        for key in ('body_limit', 'max_body_size'):
+            value = request.get(key, env.get('ENV').get(key))
+            if value is not None:
+                limits[key] = int(value)
+        return limits
+
+    def full_response_body(self):
+        """
+        获取完整的响应体，响应体超过保存上限时从临时文件中读取
+        :return:
+        """
+        capture = getattr(self, 'response_capture', None)
+        if capture is None or not self.response_truncated:
+            return getattr(self, 'response_body', '')
+        return capture.text()
+
+    async def perform(self, data, env, env_object):
         """
         执行单条用例的入口方法
         :param data:
         :return:
         """
         self.title = data.get('title')
+        self.case_id = data.get('id')
         self.data = data
         self.info_log('===开始执行用例：', self.title, '===')
         # 执行前置脚本
-        self.__setup_script(data, env, env_object)
+        await self.__setup_script(data, env, env_object)
         # 发送请求
-        response = self.__send_request(data, env)
+        response = await self.__send_request(data, env)
         # 执行后置脚本
-        self.__teardown_script(response)
+        try:
+            await self.__teardown_script(response)
+        finally:
+            capture = getattr(self, 'response_capture', None)
+            if capture is not None:
+                capture.close()
+                self.response_capture = None
 
     def async_io_operation(self):
         # 同步执行异步保存操作
+        owner_loop = getattr(self, 'owner_loop', None)
+        if owner_loop is not None and owner_loop.is_running():
+            # 用例在工作线程中执行时，数据库连接属于web服务的事件循环，需要回到该循环中保存
+            try:
+                current_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                current_loop = None
+            if current_loop is owner_loop:
+                owner_loop.create_task(self.env_object.save())
+            else:
+                asyncio.run_coroutine_threadsafe(self.env_object.save(), owner_loop)
+            return
         try:
             # 尝试获取当前事件循环
             loop = asyncio.get_event_loop()
@@ -316,6 +369,20 @@ class BaseCase(CaseLogHandel):
             # 如果没有事件循环，创建新的
             asyncio.run(self.env_object.save())
 
+    def __update_variable(self, field, name, value=None, delete=False):
+        """修改环境对象中的变量，有写缓冲时由缓冲统一保存"""
+        if self.env_buffer is not None:
+            if delete:
+                self.env_buffer.delete(field, name)
+            else:
+                self.env_buffer.set(field, name, value)
+            return
+        if delete:
+            del getattr(self.env_object, field)[name]
+        else:
+            getattr(self.env_object, field)[name] = value
+        self.async_io_operation()
+
     def save_env_variable(self, name, value):
         """
         保存环境变量
@@ -324,8 +391,7 @@ class BaseCase(CaseLogHandel):
         :return:
         """
         self.info_log(f"设置局部变量{name}:", value)
-        self.env_object.debug_global_variable[name] = value
-        self.async_io_operation()
+        self.__update_variable('debug_global_variable', name, value)
 
     def save_global_variable(self, name, value):
         """
@@ -335,8 +401,7 @@ class BaseCase(CaseLogHandel):
         """
         self.info_log(f"设置全局变量{name}:", value)
         # self.info_log(f"{ENV['ENV']['host']}")
-        self.env_object.global_variable[name] = value
-        self.async_io_operation()
+        self.__update_variable('global_variable', name, value)
         # 同步执行异步保存操作
         #
         # try:
@@ -364,8 +429,7 @@ class BaseCase(CaseLogHandel):
         :return:
         """
         self.info_log("删除环境变量:", name)
-        del self.env_object.debug_global_variable[name]
-        self.async_io_operation()
+        self.__update_variable('debug_global_variable', name, delete=True)
         pass
 
     def del_global_variable(self, name):
@@ -375,8 +439,7 @@ class BaseCase(CaseLogHandel):
         :return:
         """
         self.info_log("删除全局变量:", name)
-        del self.env_object.global_variable[name]
-        self.async_io_operation()
+        self.__update_variable('global_variable', name, delete=True)
         pass
 
     def json_extract(self, obj, ext):
@@ -1,6 +1,94 @@
+import reprlib
+
+from common.settings import CASE_LOG_CONFIG
+
+# 日志级别，低于配置级别的日志直接丢弃，不会格式化
+LOG_LEVELS = {'DEBUG': 10, 'PRINT': 20, 'INFO': 20, 'WARN': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+
+class CaseLogBuffer:
+    """单条用例的日志缓冲，限制单条日志和日志总量的大小"""
+
+    def __init__(self, max_message=4096, max_size=262144):
+        """
+        :param max_message: 单条日志的最大字符数，超过后截断
+        :param max_size: 一条用例日志的最大字符数，超过后丢弃后续日志
+        """
+        self.max_message = max_message
+        self.max_size = max_size
+        self.records = []
+        self.size = 0
+        self.dropped = 0
+        # 容器类型的参数限制展开的层数和元素数，不会把整个对象转换成字符串
+        self._repr = reprlib.Repr()
+        self._repr.maxlevel = 6
+        self._repr.maxdict = self._repr.maxlist = self._repr.maxtuple = self._repr.maxset = 200
+        self._repr.maxstring = self._repr.maxother = max_message
+
+    @property
+    def full(self):
+        """日志总量已达上限，之后的日志全部丢弃"""
+        return self.dropped > 0 or self.size >= self.max_size
+
+    def format(self, prefix, args):
+        """
+        拼接日志内容，每个参数只转换max_message以内的部分
+        :param prefix: 日志前缀
+        :param args: 日志参数
+        :return: 不超过max_message的日志内容
+        """
+        parts = [prefix]
+        remaining = self.max_message - len(prefix)
+        truncated = False
+        for arg in args:
+            if remaining <= 0:
+                truncated = True
+                break
+            if isinstance(arg, str):
+                text = arg[:remaining]
+                truncated = truncated or len(arg) > remaining
+            elif isinstance(arg, (bytes, bytearray)):
+                text = str(arg[:remaining])
+                truncated = truncated or len(arg) > remaining
+            elif isinstance(arg, (dict, list, tuple, set, frozenset)):
+                text = self._repr.repr(arg)
+            else:
+                text = str(arg)
+            if len(text) > remaining:
+                text = text[:remaining]
+                truncated = True
+            parts.append(text)
+            remaining -= len(text)
+        message = ''.join(parts)
+        if truncated:
+            suffix = f'...[已截断，超过{self.max_message}字符]'
+            message = message[:max(self.max_message - len(suffix), 0)] + suffix
+        return message
+
+    def append(self, level, message):
+        if len(message) > self.max_message:
+            message = f'{message[:self.max_message]}...[已截断，共{len(message)}字符]'
+        if self.full or self.size + len(message) > self.max_size:
+            self.dropped += 1
+            return
+        self.size += len(message)
+        self.records.append((level, message))
+
+    def to_list(self):
+        if not self.dropped:
+            return self.records
+        return self.records + [('WARN', f'【WARN】｜ 日志超过{self.max_size}字符，已丢弃{self.dropped}条')]
+
+
 class CaseLogHandel:
     """日志处理的类"""
 
+    @property
+    def log_data(self):
+        """用例的日志列表[(级别, 内容), ...]"""
+        buffer = self.__dict__.get('_log_buffer')
+        return buffer.to_list() if buffer is not None else []
+
     def save_log(self, massage, level):
         """
         保存日志的方法
@@ -8,36 +96,51 @@ class CaseLogHandel:
         :param level: 日志级别
         :return:
         """
-        if not hasattr(self, 'log_data'):
-            setattr(self, 'log_data', [])
+        if not self.log_enabled(level):
+            return
         # 将日志保存到用来的log_data中
-        getattr(self, 'log_data').append((level, massage))
-        print((level, massage))
+        self._get_log_buffer().append(level, massage)
+        if CASE_LOG_CONFIG['echo']:
+            print((level, massage))
+
+    def _get_log_buffer(self):
+        buffer = self.__dict__.get('_log_buffer')
+        if buffer is None:
+            buffer = CaseLogBuffer(CASE_LOG_CONFIG['max_message'], CASE_LOG_CONFIG['max_size'])
+            self._log_buffer = buffer
+        return buffer
+
+    def _log(self, level, prefix, args):
+        """格式化并保存日志，日志总量已满时直接丢弃，不再格式化"""
+        if not self.log_enabled(level):
+            return
+        buffer = self._get_log_buffer()
+        if buffer.full:
+            buffer.dropped += 1
+            return
+        self.save_log(buffer.format(prefix, args), level)
+
+    @staticmethod
+    def log_enabled(level):
+        return LOG_LEVELS.get(level, 20) >= LOG_LEVELS.get(CASE_LOG_CONFIG['level'], 10)
 
     def print_log(self, *args):
-        msg = '【PRINT】｜ '+''.join([str(i) for i in args])
-        self.save_log(msg, 'PRINT')
+        self._log('PRINT', '【PRINT】｜ ', args)
 
     def debug_log(self, *args):
-        msg = '【DEBUG】｜'+''.join([str(i) for i in args])
-        self.save_log(msg, 'DEBUG')
+        self._log('DEBUG', '【DEBUG】｜', args)
 
     def info_log(self, *args):
-        msg = '【INFO】｜ ' + ''.join([str(i) for i in args])
-        self.save_log(msg, 'INFO')
+        self._log('INFO', '【INFO】｜ ', args)
 
     def error_log(self, *args):
-        msg = '【ERROR】｜ '+''.join([str(i) for i in args])
-        self.save_log(msg, 'ERROR')
+        self._log('ERROR', '【ERROR】｜ ', args)
 
     def warning_log(self, *args):
-        msg = '【WARN】｜ '+''.join([str(i) for i in args])
-        self.save_log(msg, 'WARN')
+        self._log('WARN', '【WARN】｜ ', args)
 
     def critical_log(self, *args):
-        msg = '【CRITICAL】｜ '+''.join([str(i) for i in args])
-        self.save_log(msg, 'CRITICAL')
-
+        self._log('CRITICAL', '【CRITICAL】｜ ', args)
 
 if __name__ == '__main__':
     log = CaseLogHandel()
@@ -2,13 +2,184 @@
 # @Author : John
 # @Time : 2024/10/31
 # @File : dbclient.py
-import pymssql as pymssql
+import asyncio
+import json
+import threading
+import time
+import weakref
+from collections import deque
+
+import asyncmy
 import pymysql
+from asyncmy.cursors import DictCursor as AsyncDictCursor
+
+try:
+    import pymssql
+except ImportError:
+    # 未安装时不支持sqlserver
+    pymssql = None
+
+from common.settings import DB_POOL_CONFIG
+
+
+class ConnectionPool:
+    """单个数据库配置的连接池，多个执行线程共用"""
+
+    def __init__(self, factory, max_size=5, idle_timeout=300, health_check_interval=30, acquire_timeout=30):
+        """
+        :param factory: 创建连接的函数
+        :param max_size: 最大连接数
+        :param idle_timeout: 空闲超过该时间(秒)的连接会被关闭
+        :param health_check_interval: 空闲超过该时间(秒)的连接取出时先检查是否可用
+        :param acquire_timeout: 连接池已满时等待的最长时间(秒)
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """从连接池中取出一个连接"""
+        with self._cond:
+            self._reap()
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                if not self._cond.wait(self.acquire_timeout):
+                    raise TimeoutError(f"获取数据库连接超时，连接池已满({self.max_size})")
+        try:
+            if conn is None:
+                return self.factory()
+            if time.time() - last_used > self.health_check_interval and not self._is_alive(conn):
+                self._close(conn)
+                return self.factory()
+            return conn
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, broken=False):
+        """归还连接，出错的连接直接关闭"""
+        with self._cond:
+            if broken:
+                self._size -= 1
+                self._close(conn)
+            else:
+                self._idle.append((conn, time.time()))
+            self._reap()
+            self._cond.notify()
+
+    def _reap(self):
+        """关闭空闲太久的连接，需持有锁调用"""
+        now = time.time()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._size -= 1
+            self._close(conn)
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            conn.ping()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """关闭所有空闲连接"""
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.popleft()
+                self._size -= 1
+                self._close(conn)
+
+
+class PoolRegistry:
+    """按数据库类型和连接配置维护的连接池"""
+
+    def __init__(self, **pool_config):
+        self.pool_config = pool_config
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get_pool(self, db_type, db_config, factory):
+        key = (db_type, json.dumps(db_config, sort_keys=True, default=str))
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = ConnectionPool(factory, **self.pool_config)
+                self._pools[key] = pool
+            return pool
+
+    def close_all(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.close_all()
+
+
+class AsyncPoolRegistry:
+    """asyncmy连接池，连接池绑定创建它的事件循环，所以按事件循环分别保存"""
+
+    def __init__(self, max_size=5):
+        self.max_size = max_size
+        self._pools = weakref.WeakKeyDictionary()
+
+    async def get_pool(self, db_config):
+        loop = asyncio.get_running_loop()
+        pools = self._pools.setdefault(loop, {})
+        key = json.dumps(db_config, sort_keys=True, default=str)
+        future = pools.get(key)
+        if future is None:
+            config = dict(db_config)
+            if config.get('port'):
+                config['port'] = int(config['port'])
+            # 保存创建连接池的任务，同时获取的协程等待同一个连接池
+            future = asyncio.ensure_future(asyncmy.create_pool(minsize=0, maxsize=self.max_size,
+                                                               autocommit=True, **config))
+            pools[key] = future
+        try:
+            return await asyncio.shield(future)
+        except Exception:
+            pools.pop(key, None)
+            raise
+
+    async def aclose(self):
+        """关闭当前事件循环中的所有连接池"""
+        pools = self._pools.pop(asyncio.get_running_loop(), {})
+        for future in pools.values():
+            if future.done() and not future.exception():
+                pool = future.result()
+                pool.close()
+                await pool.wait_closed()
+
+
+# 进程内共享的数据库连接池
+db_pools = PoolRegistry(**DB_POOL_CONFIG)
+async_db_pools = AsyncPoolRegistry(DB_POOL_CONFIG['max_size'])
 
 
 class DBBase:
     cursor = None
     conn = None
+    pool = None
 
     def execute(self, sql, args=None):
         """执行sql语句,返回单条数据"""
@@ -26,28 +197,80 @@ class DBBase:
         except Exception as e:
             raise e
 
+    async def fetch(self, sql, args=None):
+        """异步执行sql语句,返回单条数据，默认在线程中执行同步查询"""
+        return await asyncio.to_thread(self.execute, sql, args)
+
+    async def fetch_all(self, sql, args=None):
+        """异步执行sql语句,返回所有数据，默认在线程中执行同步查询"""
+        return await asyncio.to_thread(self.execute_all, sql, args)
+
     def close(self):
-        """关闭数据库连接"""
+        """关闭数据库连接，来自连接池的连接归还到连接池"""
+        if self.conn is None:
+            return
         self.cursor.close()
-        self.conn.close()
+        if self.pool is not None:
+            self.pool.release(self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
 
 
 class MySqlDB(DBBase):
     """mysql数据库操作类"""
 
-    def __init__(self, db_config):
+    def __init__(self, db_config, pool=None):
         """初始化数据库连接"""
-        self.conn = pymysql.connect(**db_config, autocommit=True)
+        self.db_config = db_config
+        self.pool = pool
+        if pool is not None:
+            self.conn = pool.acquire()
+        else:
+            self.conn = pymysql.connect(**db_config, autocommit=True)
         self.cursor = self.conn.cursor(pymysql.cursors.DictCursor)
 
+    async def _query(self, sql, args, fetch_all):
+        pool = await async_db_pools.get_pool(self.db_config)
+        async with pool.acquire() as conn:
+            async with conn.cursor(AsyncDictCursor) as cursor:
+                await cursor.execute(sql, args)
+                return await (cursor.fetchall() if fetch_all else cursor.fetchone())
+
+    async def fetch(self, sql, args=None):
+        """通过asyncmy异步执行sql语句,返回单条数据"""
+        return await self._query(sql, args, False)
+
+    async def fetch_all(self, sql, args=None):
+        """通过asyncmy异步执行sql语句,返回所有数据"""
+        return await self._query(sql, args, True)
+
 
 class SqlServerDB(DBBase):
     """sqlserver数据库操作类"""
 
-    def __init__(self, db_config):
+    def __init__(self, db_config, pool=None):
         """初始化数据库连接"""
-        self.conn = pymssql.connect(**db_config, autocommit=True)
-        self.cursor = self.conn.cursor(pymysql.cursors.DictCursor)
+        self.pool = pool
+        if pool is not None:
+            self.conn = pool.acquire()
+        else:
+            self.conn = self.connect(db_config)
+        self.cursor = self.conn.cursor(as_dict=True)
+
+    @staticmethod
+    def connect(db_config):
+        """创建sqlserver连接，兼容mysql风格的配置(host/database)"""
+        if pymssql is None:
+            raise ValueError("未安装pymssql，不支持sqlserver数据库")
+        config = dict(db_config)
+        if 'host' in config:
+            config['server'] = config.pop('host')
+        if 'db' in config:
+            config['database'] = config.pop('db')
+        if config.get('port'):
+            config['port'] = str(config['port'])
+        return pymssql.connect(**config, autocommit=True)
 
 
 class OracleDB(DBBase):
@@ -79,13 +302,18 @@ class DBClient:
             raise TypeError("数据库配置格式错误")
 
         if db.get('type') == 'mysql':
-            # 连接mysql数据库
-            obj = MySqlDB(db.get('config'))
+            # 从连接池中获取mysql连接
+            config = db.get('config')
+            pool = db_pools.get_pool('mysql', config, lambda: pymysql.connect(**config, autocommit=True))
+            obj = MySqlDB(config, pool=pool)
             setattr(self, db.get('name'), obj)
 
         elif db.get('type') == 'sqlserver':
-            # 连接sqlserver数据库
-            pass
+            # 从连接池中获取sqlserver连接
+            config = db.get('config')
+            pool = db_pools.get_pool('sqlserver', config, lambda: SqlServerDB.connect(config))
+            obj = SqlServerDB(config, pool=pool)
+            setattr(self, db.get('name'), obj)
         elif db.get('type') == 'oracle':
             # 连接oracle数据库
             pass
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : dependency.py
+"""
+套件内用例的依赖分析
+用例读取的${{var}}变量如果由前面用例的前后置脚本写入，则必须等写入的用例执行完成；
+脚本中变量名无法静态确定的用例作为屏障，前后用例都按顺序执行
+"""
+import ast
+import json
+import re
+
+PLACEHOLDER = re.compile(r'\${{(.+?)}}')
+# 写入变量的方法
+WRITE_METHODS = {'save_global_variable', 'save_env_variable', 'del_global_variable', 'del_env_variable'}
+# 读取变量的方法
+READ_METHODS = {'get_env_variable'}
+
+
+class CaseAccess:
+    """单条用例读写的变量"""
+
+    def __init__(self, reads=(), writes=(), barrier=False):
+        self.reads = set(reads)
+        self.writes = set(writes)
+        self.barrier = barrier
+
+
+def analyse_script(script):
+    """
+    分析前后置脚本中读写的变量
+    :param script: 脚本代码
+    :return: (reads, writes, barrier)
+    """
+    reads, writes = set(), set()
+    if not script or not script.strip():
+        return reads, writes, False
+    try:
+        tree = ast.parse(script)
+    except SyntaxError:
+        return reads, writes, True
+    for node in ast.walk(tree):
+        # 直接操作环境对象的脚本无法分析
+        if isinstance(node, (ast.Name, ast.Attribute)) and getattr(node, 'id', getattr(node, 'attr', None)) == 'env_object':
+            return reads, writes, True
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+            continue
+        method = node.func.attr
+        if method not in WRITE_METHODS and method not in READ_METHODS:
+            continue
+        if not (node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+            return reads, writes, True
+        (writes if method in WRITE_METHODS else reads).add(node.args[0].value)
+    return reads, writes, False
+
+
+def analyse_case(case):
+    """
+    分析单条用例读写的变量
+    :param case: 用例数据
+    :return:
+    """
+    request_text = json.dumps([case.get('interface'), case.get('headers'), case.get('request')],
+                              ensure_ascii=False, default=str)
+    reads = set(PLACEHOLDER.findall(request_text))
+    barrier = False
+    writes = set()
+    for key in ('setup_script', 'teardown_script'):
+        s_reads, s_writes, s_barrier = analyse_script(case.get(key))
+        reads |= s_reads
+        writes |= s_writes
+        barrier = barrier or s_barrier
+    return CaseAccess(reads, writes, barrier)
+
+
+def build_dependencies(cases):
+    """
+    计算每条用例需要等待的前置用例下标
+    :param cases: 按执行顺序排列的用例
+    :return: [set(前置用例下标), ...]
+    """
+    depends = []
+    last_barrier = None
+    since_barrier = []
+    last_writer = {}
+    readers = {}
+    for index, case in enumerate(cases):
+        access = analyse_case(case)
+        deps = set()
+        if last_barrier is not None:
+            deps.add(last_barrier)
+        if access.barrier:
+            deps.update(since_barrier)
+            last_barrier = index
+            since_barrier = []
+            last_writer.clear()
+            readers.clear()
+        else:
+            for name in access.reads | access.writes:
+                if name in last_writer:
+                    deps.add(last_writer[name])
+            # 写入变量前，需要等读取旧值的用例执行完
+            for name in access.writes:
+                deps.update(readers.pop(name, ()))
+            for name in access.reads:
+                readers.setdefault(name, []).append(index)
+            for name in access.writes:
+                last_writer[name] = index
+            since_barrier.append(index)
+        deps.discard(index)
+        depends.append(deps)
+    return depends
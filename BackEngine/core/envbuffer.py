@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : envbuffer.py
+"""
+环境变量的写缓冲
+用例中设置/删除变量只修改内存并记录修改过的字段，在套件结束或定时器触发时
+合并为一条只更新修改字段的UPDATE语句
+"""
+import asyncio
+import threading
+
+
+class EnvWriteBuffer:
+    """环境变量写缓冲，一次运行创建一个"""
+
+    def __init__(self, env_object, owner_loop=None, interval=0):
+        """
+        :param env_object: 环境对象(Env模型实例)
+        :param owner_loop: 数据库连接所在的事件循环，写入操作在该循环中执行
+        :param interval: 定时写入的间隔(秒)，0表示只在套件结束时写入
+        """
+        self.env_object = env_object
+        self.owner_loop = owner_loop
+        self.interval = interval
+        self.flush_count = 0
+        self._dirty = set()
+        # 用例线程修改变量、web服务线程生成快照，需要加锁
+        self._lock = threading.Lock()
+        # 保证写入按顺序执行，后一次写入的快照总是包含前一次的修改
+        self._flush_lock = None
+
+    def set(self, field, name, value):
+        """设置变量"""
+        with self._lock:
+            getattr(self.env_object, field)[name] = value
+            self._dirty.add(field)
+
+    def delete(self, field, name):
+        """删除变量"""
+        with self._lock:
+            del getattr(self.env_object, field)[name]
+            self._dirty.add(field)
+
+    def discard(self, field):
+        """只清空内存中的变量，不写入数据库"""
+        with self._lock:
+            getattr(self.env_object, field).clear()
+
+    @property
+    def dirty(self):
+        return bool(self._dirty)
+
+    async def flush(self):
+        """将修改过的字段写入数据库"""
+        try:
+            current_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            current_loop = None
+        if self.owner_loop is not None and self.owner_loop is not current_loop and self.owner_loop.is_running():
+            future = asyncio.run_coroutine_threadsafe(self._flush(), self.owner_loop)
+            return await asyncio.wrap_future(future)
+        return await self._flush()
+
+    async def _flush(self):
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                fields = self._dirty
+                self._dirty = set()
+                snapshot = {field: dict(getattr(self.env_object, field)) for field in fields}
+            try:
+                # 只更新修改过的json字段，不再整行保存
+                await type(self.env_object).filter(pk=self.env_object.pk).update(**snapshot)
+            except Exception:
+                with self._lock:
+                    self._dirty |= fields
+                raise
+            self.flush_count += 1
+
+    async def run_timer(self):
+        """定时写入，随运行结束取消"""
+        while self.interval:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"环境变量写入失败: {str(e)}")
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : executor.py
+"""
+用例执行的工作线程池
+每个工作线程运行独立的事件循环，套件在线程中执行，前后置脚本、数据库操作等同步代码不会阻塞web服务
+"""
+import asyncio
+import threading
+
+from BackEngine.core.dbclient import async_db_pools
+from BackEngine.core.httpclient import http_pool
+from common.settings import RUNNER_CONFIG
+
+
+class RunnerBusyError(Exception):
+    """执行队列已满"""
+    pass
+
+
+class RunnerExecutor:
+    """有界的套件执行线程池"""
+
+    def __init__(self, workers=4, queue_size=64, suite_timeout=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.suite_timeout = suite_timeout
+        self._loops = []
+        self._threads = []
+        self._idle = None
+        self._waiting = 0
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        """首次使用时启动工作线程"""
+        with self._start_lock:
+            if self._loops:
+                return
+            for i in range(self.workers):
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._worker, args=(loop,), name=f'runner-{i}', daemon=True)
+                thread.start()
+                self._loops.append(loop)
+                self._threads.append(thread)
+            self._idle = asyncio.Queue()
+            for i in range(self.workers):
+                self._idle.put_nowait(i)
+
+    @staticmethod
+    def _worker(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def _release(self, owner, index):
+        """执行结束后归还工作线程"""
+        try:
+            owner.call_soon_threadsafe(self._idle.put_nowait, index)
+        except RuntimeError:
+            # 调用方的事件循环已经关闭
+            pass
+
+    async def _call(self, owner, index, func, args):
+        """
+        在工作线程的事件循环中执行，协程完全结束(包括超时、取消后的清理)后才归还工作线程，
+        避免下一个套件调度到仍在清理的线程上
+        """
+        try:
+            return await func(*args)
+        finally:
+            self._release(owner, index)
+
+    @property
+    def waiting(self):
+        """等待空闲线程的套件数"""
+        return self._waiting
+
+    async def run(self, func, *args, timeout=None):
+        """
+        在工作线程中执行协程函数，超时或调用方取消时会取消线程中的执行
+        :param func: 协程函数，例如TestRunner(...).run
+        :param args:
+        :param timeout: 超时时间(秒)，默认使用suite_timeout
+        :return:
+        """
+        if not self._loops:
+            self._start()
+        if self._waiting >= self.queue_size:
+            raise RunnerBusyError(f"执行队列已满({self.queue_size})，请稍后重试")
+        self._waiting += 1
+        try:
+            index = await self._idle.get()
+        finally:
+            self._waiting -= 1
+        owner = asyncio.get_running_loop()
+        future = asyncio.run_coroutine_threadsafe(self._call(owner, index, func, args), self._loops[index])
+        timeout = self.suite_timeout if timeout is None else timeout
+        # 取消wrap_future会一并取消工作线程中的任务，中断正在等待的请求
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    async def shutdown(self):
+        """关闭工作线程及其中的请求、数据库连接池"""
+        for loop, thread in zip(self._loops, self._threads):
+            try:
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(http_pool.aclose(), loop))
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(async_db_pools.aclose(), loop))
+            finally:
+                loop.call_soon_threadsafe(loop.stop)
+            await asyncio.to_thread(thread.join)
+            loop.close()
+        self._loops.clear()
+        self._threads.clear()
+
+
+# 进程内共享的执行线程池
+runner_executor = RunnerExecutor(workers=RUNNER_CONFIG['workers'],
+                                 queue_size=RUNNER_CONFIG['queue_size'],
+                                 suite_timeout=RUNNER_CONFIG['suite_timeout'])
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : httpclient.py
+"""
+用例请求的异步HTTP引擎
+按测试环境复用httpx.AsyncClient，保持keep-alive连接，请求不再阻塞事件循环
+"""
+import asyncio
+import hashlib
+import tempfile
+import weakref
+
+import httpx
+
+from common.settings import HTTP_CONFIG, RESPONSE_CONFIG
+
+
+class HttpClientPool:
+    """按环境维护的异步连接池"""
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0, max_retries=1):
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive_connections,
+                                   keepalive_expiry=keepalive_expiry)
+        # 会话默认的建连失败重试次数
+        self.max_retries = max_retries
+        # AsyncClient绑定创建它的事件循环，所以按事件循环分别保存
+        self._clients = weakref.WeakKeyDictionary()
+
+    def get_client(self, env_key, verify=True, pool_size=None) -> httpx.AsyncClient:
+        """
+        获取环境对应的客户端，不存在则创建
+        :param env_key: 环境标识(环境id)
+        :param verify: 是否校验证书
+        :param pool_size: 环境单独指定的最大连接数
+        :return:
+        """
+        loop = asyncio.get_running_loop()
+        clients = self._clients.setdefault(loop, {})
+        key = (env_key, bool(verify), pool_size)
+        client = clients.get(key)
+        if client is None or client.is_closed:
+            limits = self.limits
+            if pool_size:
+                limits = httpx.Limits(max_connections=pool_size,
+                                      max_keepalive_connections=min(pool_size, self.limits.max_keepalive_connections),
+                                      keepalive_expiry=self.limits.keepalive_expiry)
+            client = httpx.AsyncClient(limits=limits, verify=verify, follow_redirects=True)
+            clients[key] = client
+        return client
+
+    async def aclose(self):
+        """关闭当前事件循环中的所有客户端"""
+        loop = asyncio.get_running_loop()
+        clients = self._clients.pop(loop, {})
+        for client in clients.values():
+            await client.aclose()
+
+
+class HttpSession:
+    """一次运行内所有用例共用的请求会话，记录连接复用情况"""
+
+    # 请求还未发出的错误，重试不会导致重复提交
+    RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+    def __init__(self, pool: HttpClientPool, env_key, pool_size=None, max_retries=None):
+        self.pool = pool
+        self.env_key = env_key
+        self.pool_size = pool_size
+        self.max_retries = pool.max_retries if max_retries is None else max_retries
+        self.requests = 0
+        self.new_connections = 0
+        self.retries = 0
+
+    def client(self, verify=True) -> httpx.AsyncClient:
+        return self.pool.get_client(self.env_key, verify, self.pool_size)
+
+    async def _trace(self, event_name, info):
+        """httpcore的trace回调，每次新建tcp连接时计数"""
+        if event_name == 'connection.connect_tcp.complete':
+            self.new_connections += 1
+
+    async def request(self, method, url, verify=True, stream=False, **kwargs) -> httpx.Response:
+        """
+        发送请求，建连失败时按max_retries重试
+        :param method:
+        :param url:
+        :param verify: 是否校验证书
+        :param stream: 为True时不读取响应体，由调用方读取并关闭响应
+        :param kwargs: 透传给httpx的参数
+        :return:
+        """
+        client = self.client(verify)
+        attempt = 0
+        while True:
+            try:
+                request = client.build_request(method, url, extensions={'trace': self._trace}, **kwargs)
+                response = await client.send(request, stream=stream)
+                self.requests += 1
+                return response
+            except self.RETRY_ERRORS:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retries += 1
+
+    async def capture(self, method, url, verify=True, body_limit=None, max_body_size=None, **kwargs):
+        """
+        发送请求并流式读取响应体，超过body_limit的部分写入临时文件
+        :param method:
+        :param url:
+        :param verify: 是否校验证书
+        :param body_limit: 内存中保存的响应体上限(字节)
+        :param max_body_size: 最多读取的响应体大小(字节)，0表示不限制
+        :param kwargs: 透传给httpx的参数
+        :return: (响应对象, ResponseBody)
+        """
+        response = await self.request(method, url, verify=verify, stream=True, **kwargs)
+        body = ResponseBody(RESPONSE_CONFIG['body_limit'] if body_limit is None else body_limit,
+                            RESPONSE_CONFIG['max_body_size'] if max_body_size is None else max_body_size)
+        try:
+            await body.read_from(response)
+        except BaseException:
+            body.close()
+            raise
+        finally:
+            await response.aclose()
+        return response, body
+
+    def get_stats(self):
+        """会话的连接复用统计"""
+        return {
+            "requests": self.requests,
+            "new_connections": self.new_connections,
+            "reused_connections": max(self.requests - self.new_connections, 0),
+            "retries": self.retries,
+        }
+
+
+class ResponseBody:
+    """流式读取的响应体，只在内存中保留body_limit以内的数据，同时计算大小和sha256"""
+
+    def __init__(self, limit, max_size=0):
+        self.limit = limit
+        self.max_size = max_size
+        self.size = 0
+        # 超过max_size后停止读取，响应体不完整
+        self.complete = True
+        self.encoding = 'utf-8'
+        self._hash = hashlib.sha256()
+        # max_size为0时不会写入磁盘，body_limit为0表示响应体全部写入临时文件
+        self._file = tempfile.SpooledTemporaryFile(max_size=max(limit, 1))
+
+    async def read_from(self, response: httpx.Response):
+        """从未读取的响应中按块读取响应体"""
+        self.encoding = response.encoding or 'utf-8'
+        async for chunk in response.aiter_bytes():
+            if self.max_size and self.size + len(chunk) > self.max_size:
+                chunk = chunk[:self.max_size - self.size]
+                self.complete = False
+            self._file.write(chunk)
+            self._hash.update(chunk)
+            self.size += len(chunk)
+            if not self.complete:
+                break
+
+    @property
+    def truncated(self):
+        """响应体是否超过了保存上限"""
+        return self.size > self.limit or not self.complete
+
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+
+    def read(self, size=-1) -> bytes:
+        self._file.seek(0)
+        return self._file.read(size)
+
+    def text(self, size=-1) -> str:
+        """解码后的响应体，size指定时只读取前size字节"""
+        return self.read(size).decode(self.encoding, errors='replace')
+
+    def summary(self, preview_size):
+        """结果中保存的内容: 未超过上限时为完整响应体，否则为预览和截断说明"""
+        if not self.truncated:
+            return self.text()
+        size = f'{self.size}字节' if self.complete else f'超过{self.max_size}字节'
+        return f'{self.text(min(preview_size, self.limit))}...[响应体共{size}，已截断，sha256={self.sha256}]'
+
+    def close(self):
+        self._file.close()
+
+
+# 进程内共享的连接池
+http_pool = HttpClientPool(**HTTP_CONFIG)
+
+
+def build_timeout(timeout_cfg):
+    """
+    兼容requests风格的超时配置: None表示不超时，数字表示读取超时，(connect, read)元组分别指定
+    :param timeout_cfg:
+    :return:
+    """
+    if timeout_cfg is None:
+        return httpx.Timeout(None)
+    if isinstance(timeout_cfg, (int, float)):
+        return httpx.Timeout(timeout_cfg, connect=5)
+    if isinstance(timeout_cfg, (list, tuple)) and len(timeout_cfg) == 2:
+        connect, read = timeout_cfg
+        return httpx.Timeout(read, connect=connect)
+    raise ValueError(f"超时配置格式错误: {timeout_cfg!r}，应为None、数字或[连接超时, 读取超时]")
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : plancache.py
+"""
+套件执行计划的缓存
+执行计划是套件中按顺序排列的用例数据、用例之间的依赖关系，前后置脚本在生成计划时预先编译；
+用例、接口、套件用例顺序修改时按套件失效，未修改的套件重复执行时不再查询数据库
+多个进程部署时每次失效同时增加redis中的共享版本号，其他进程取计划前发现版本号变化后清空本进程的缓存
+"""
+import copy
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from BackEngine.core.dependency import build_dependencies
+from BackEngine.core.scriptcache import script_cache, uses_name
+from BackEngine.core.template import content_hash
+from common.settings import PLAN_CACHE_CONFIG
+
+# 与任务管理器共用日志，redis不可用时的错误不会直接输出到控制台
+logger = logging.getLogger('apps.TestTask.task_manager')
+
+
+class SuitePlan:
+    """编译后的套件执行计划"""
+
+    __slots__ = ('suite_id', 'name', 'cases', 'depends', 'version', 'created', 'case_ids', 'interface_ids')
+
+    def __init__(self, suite_id, name, cases, interface_ids=(), version=0):
+        """
+        :param suite_id: 套件id
+        :param name: 套件名称
+        :param cases: 按执行顺序排列的用例数据
+        :param interface_ids: 用例所属的接口id
+        :param version: 生成计划时缓存的版本号
+        """
+        self.suite_id = suite_id
+        self.name = name
+        self.cases = cases
+        self.depends = build_dependencies(cases)
+        self.version = version
+        self.created = time.monotonic()
+        self.case_ids = frozenset(case['id'] for case in cases)
+        self.interface_ids = frozenset(interface_ids)
+        for case in cases:
+            codes = {}
+            for key in ('setup_script', 'teardown_script'):
+                try:
+                    codes[key] = script_cache.compile(case.get(key), f'<{key}>')
+                except SyntaxError:
+                    # 语法错误在执行用例时报出
+                    pass
+            # 用例请求数据的哈希，渲染请求模板时不再序列化请求体；前置脚本可能修改data时不预先计算
+            setup = codes.get('setup_script')
+            if setup is not None and not uses_name(setup, 'data'):
+                case['request_hash'] = content_hash({key: case[key] for key in ('interface', 'headers', 'request')})
+
+    def to_suite(self):
+        """
+        生成运行器使用的套件数据，前后置脚本可以修改data，每次执行使用独立的用例副本
+        :return:
+        """
+        return {
+            "name": self.name,
+            "Cases": copy.deepcopy(self.cases),
+            "depends": self.depends,
+        }
+
+
+class PlanCache:
+    """按套件id缓存执行计划"""
+
+    def __init__(self, max_size=256, ttl=300, client=None, version_key='fa_api:plan:version'):
+        """
+        :param max_size: 最多缓存的套件数
+        :param ttl: 计划的最长有效时间(秒)，0表示不过期
+        :param client: 共享失效版本号的异步redis客户端，为空时只在本进程内失效
+        :param version_key: 共享版本号的键名
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.client = client
+        self.version_key = version_key
+        # 本进程最近一次看到的共享版本号，None表示还没有读取过
+        self._shared_version = None
+        self.hits = 0
+        self.misses = 0
+        # 每次失效加1，加载期间发生过失效的计划不会写入缓存
+        self.version = 0
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def refresh(self):
+        """取计划前调用，其他进程失效过缓存时清空本进程的缓存；redis不可用时同样清空，直接查询数据库"""
+        if self.client is None:
+            return
+        try:
+            shared = await self.client.get(self.version_key) or '0'
+        except Exception as e:
+            logger.error(f"读取执行计划版本号失败: {str(e)}")
+            self.clear()
+            return
+        if shared != self._shared_version:
+            self._shared_version = shared
+            self.clear()
+
+    async def _publish(self):
+        """增加共享版本号，通知其他进程"""
+        if self.client is None:
+            return
+        try:
+            shared = await self.client.incr(self.version_key)
+        except Exception as e:
+            logger.error(f"更新执行计划版本号失败: {str(e)}")
+            return
+        # 中间没有其他进程的失效时，本进程已经按套件失效，不需要再清空
+        if self._shared_version is not None and shared == int(self._shared_version) + 1:
+            self._shared_version = str(shared)
+
+    def get(self, suite_id):
+        """
+        获取套件的执行计划，不存在或已过期返回None，调用前先执行refresh
+        :param suite_id: 套件id
+        :return:
+        """
+        with self._lock:
+            plan = self._plans.get(suite_id)
+            if plan is not None and self.ttl and time.monotonic() - plan.created > self.ttl:
+                del self._plans[suite_id]
+                plan = None
+            if plan is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(suite_id)
+            self.hits += 1
+            return plan
+
+    def put(self, plan: SuitePlan):
+        """
+        保存执行计划，计划生成后缓存被失效过则丢弃
+        :param plan: 执行计划
+        :return:
+        """
+        with self._lock:
+            if plan.version != self.version:
+                return
+            self._plans[plan.suite_id] = plan
+            self._plans.move_to_end(plan.suite_id)
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+
+    def _invalidate(self, match):
+        with self._lock:
+            self.version += 1
+            for suite_id in [suite_id for suite_id, plan in self._plans.items() if match(plan)]:
+                del self._plans[suite_id]
+
+    async def invalidate_suites(self, *suite_ids):
+        """套件名称、用例顺序修改或套件删除"""
+        suite_ids = set(suite_ids)
+        self._invalidate(lambda plan: plan.suite_id in suite_ids)
+        await self._publish()
+
+    async def invalidate_cases(self, *case_ids):
+        """用例修改或删除"""
+        case_ids = set(case_ids)
+        self._invalidate(lambda plan: not plan.case_ids.isdisjoint(case_ids))
+        await self._publish()
+
+    async def invalidate_interfaces(self, *interface_ids):
+        """接口修改或删除"""
+        interface_ids = set(interface_ids)
+        self._invalidate(lambda plan: not plan.interface_ids.isdisjoint(interface_ids))
+        await self._publish()
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._plans.clear()
+
+    def get_stats(self):
+        """缓存命中统计"""
+        return {
+            "size": len(self._plans),
+            "max_size": self.max_size,
+            "version": self.version,
+            "shared_version": self._shared_version,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def create_plan_cache(config=PLAN_CACHE_CONFIG):
+    """按配置创建执行计划缓存"""
+    client = None
+    if config['backend'] == 'redis':
+        from common.redis_client import redis_client
+        client = redis_client
+    return PlanCache(max_size=config['max_size'], ttl=config['ttl'], client=client,
+                     version_key=config['version_key'])
+
+
+# 进程内共享的执行计划缓存
+plan_cache = create_plan_cache()
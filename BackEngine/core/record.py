@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : record.py
+"""
+单条用例的执行结果记录
+用slots数据类代替每条用例一个字典，字段提取和序列化只在这里实现一次
+"""
+from dataclasses import dataclass, fields
+from typing import Any
+
+from common.settings import RESULT_CONFIG
+
+
+@dataclass(slots=True)
+class CaseRecord:
+    """用例执行结果"""
+    name: str = ''
+    case_id: Any = None
+    method: str = ''
+    url: str = ''
+    status_code: Any = ''
+    status: str = '成功'
+    requests_header: Any = ''
+    requests_body: Any = ''
+    run_time: str = ''
+    response_header: Any = ''
+    response_body: Any = ''
+    response_size: int = 0
+    response_sha256: str = ''
+    response_truncated: bool = False
+    log_data: Any = ''
+
+    @classmethod
+    def from_case(cls, test, exclude=()):
+        """
+        从用例对象中提取结果
+        :param test: 用例对象
+        :param exclude: 不保存的字段，保留默认值
+        :return:
+        """
+        record = cls()
+        for name, attr in CASE_ATTRS:
+            if name not in exclude:
+                value = getattr(test, attr, _MISSING)
+                if value is not _MISSING:
+                    setattr(record, name, value)
+        return record
+
+    def to_dict(self):
+        """转换为报告中保存的字典"""
+        return {name: getattr(self, name) for name in FIELD_NAMES}
+
+
+_MISSING = object()
+FIELD_NAMES = tuple(f.name for f in fields(CaseRecord))
+# 结果字段对应的用例属性
+CASE_ATTRS = tuple((name, {'name': 'title', 'requests_body': 'request_body'}.get(name, name)) for name in FIELD_NAMES)
+
+
+def build_record(test, passed=False):
+    """
+    生成用例结果，通过的用例按配置去掉不需要保存的字段
+    :param test: 用例对象
+    :param passed: 用例是否通过
+    :return:
+    """
+    return CaseRecord.from_case(test, RESULT_CONFIG['success_exclude'] if passed else ())
+
+
+if __name__ == '__main__':
+    import tracemalloc
+
+    class FakeCase:
+        def __init__(self, i):
+            self.title = f'用例{i}'
+            self.method = 'post'
+            self.url = f'http://127.0.0.1/api/orders/{i}'
+            self.status_code = 200
+            self.status = '成功'
+            self.requests_header = {'Content-Type': 'application/json', 'token': f'token-{i}'}
+            self.request_body = {'id': i}
+            self.run_time = '0.01s'
+            self.response_header = {'content-type': 'application/json', 'content-length': '20', 'server': 'nginx'}
+            self.response_body = f'{{"code": 0, "id": {i}}}'
+            self.log_data = [('INFO', f'【INFO】｜ ===开始执行用例：用例{i}===')]
+
+    def legacy(test):
+        """原TestResult.add_success中的实现，用来对比"""
+        return {
+            "name": getattr(test, 'title', ''),
+            'method': getattr(test, 'method', ''),
+            "url": getattr(test, 'url', ''),
+            "status_code": getattr(test, 'status_code', ''),
+            "status": getattr(test, 'status', '成功'),
+            "requests_header": getattr(test, 'requests_header', ''),
+            "requests_body": getattr(test, 'request_body', ''),
+            "run_time": getattr(test, 'run_time', ''),
+            "response_header": getattr(test, 'response_header', ''),
+            "response_body": getattr(test, 'response_body', ''),
+            "response_size": getattr(test, 'response_size', 0),
+            "response_sha256": getattr(test, 'response_sha256', ''),
+            "response_truncated": getattr(test, 'response_truncated', False),
+            "log_data": getattr(test, 'log_data', ''),
+        }
+
+    def measure(make):
+        tracemalloc.start()
+        tests = [FakeCase(i) for i in range(5000)]
+        results = [make(t) for t in tests]
+        # 用例对象执行结束后释放，只保留结果
+        del tests
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size, results
+
+    legacy_size, _ = measure(legacy)
+    record_size, _ = measure(CaseRecord.from_case)
+    header_fields = ('requests_header', 'response_header')
+    projected_size, _ = measure(lambda t: CaseRecord.from_case(t, header_fields))
+    print(f"5000条用例 原字典: {legacy_size / 1024:.0f}KB  CaseRecord: {record_size / 1024:.0f}KB  "
+          f"通过用例去掉请求头: {projected_size / 1024:.0f}KB")
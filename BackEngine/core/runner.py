@@ -2,21 +2,39 @@
 # @Author : John
 # @Time : 2024/11/01
 # @File : runner.py
+import asyncio
+import types
 
 from BackEngine.core.basecase import db, BaseCase, my_functools
 from BackEngine.core.dbclient import DBClient
+from BackEngine.core.dependency import build_dependencies
+from BackEngine.core.envbuffer import EnvWriteBuffer
+from BackEngine.core.httpclient import http_pool, HttpSession
+from BackEngine.core.record import build_record
+from BackEngine.core.scriptcache import script_cache
+from common.settings import RUNNER_CONFIG
 
 
 class TestResult:
     """测试结果记录器,一个测试套件生成一个记录器"""
 
-    def __init__(self, name, all):
+    def __init__(self, name, all, on_case=None):
+        """
+        :param name: 套件名称
+        :param all: 用例总数
+        :param on_case: 用例执行完成的回调on_case(套件名称, 用例下标, 结果状态, CaseRecord)，
+                        指定后用例结果交给回调保存，记录器中只保留统计数据
+        """
         self.name = name
         self.all = all
         self.success = 0
         self.fail = 0
         self.error = 0
+        self.on_case = on_case
+        # 用例结果CaseRecord列表
         self.cases = []
+        # 请求会话的连接复用统计
+        self.session = {}
         # self.run_time = 0
 
     def add_success(self, test: BaseCase):
@@ -26,40 +44,12 @@ class TestResult:
         """
         # """执行成功"""
         self.success += 1
-        info = {
-            "name": getattr(test, 'title', ''),
-            'method': getattr(test, 'method', ''),
-            "url": getattr(test, 'url', ''),
-            "status_code": getattr(test, 'status_code', ''),
-            "status": getattr(test, 'status', '成功'),
-            "requests_header": getattr(test, 'requests_header', ''),
-            "requests_body": getattr(test, 'request_body', ''),
-            "run_time": getattr(test, 'run_time', ''),
-            "response_header": getattr(test, 'response_header', ''),
-            "response_body": getattr(test, 'response_body', ''),
-            "log_data": getattr(test, 'log_data', ''),
-
-        }
-        self.cases.append(info)
+        self.add_record(test, '成功', build_record(test, passed=True))
 
     def add_fail(self, test):
         # """执行失败"""
         self.fail += 1
-        info = {
-            "name": getattr(test, 'title', ''),
-            'method': getattr(test, 'method', ''),
-            "url": getattr(test, 'url', ''),
-            "status_code": getattr(test, 'status_code', ''),
-            "status": getattr(test, 'status', '成功'),
-            "requests_header": getattr(test, 'requests_header', ''),
-            "requests_body": getattr(test, 'request_body', ''),
-            "run_time": getattr(test, 'run_time', ''),
-            "response_header": getattr(test, 'response_header', ''),
-            "response_body": getattr(test, 'response_body', ''),
-            "log_data": getattr(test, 'log_data', ''),
-
-        }
-        self.cases.append(info)
+        self.add_record(test, '失败', build_record(test))
 
     def add_error(self, test: BaseCase, error):
         """
@@ -72,22 +62,13 @@ class TestResult:
         test.error_log(error)
         # 执行出错
         self.error += 1
-        info = {
-            "name": getattr(test, 'title', ''),
-            'method': getattr(test, 'method', ''),
-            "url": getattr(test, 'url', ''),
-            "status_code": getattr(test, 'status_code', ''),
-            "status": getattr(test, 'status', '成功'),
-            "requests_header": getattr(test, 'requests_header', ''),
-            "requests_body": getattr(test, 'request_body', ''),
-            "run_time": getattr(test, 'run_time', ''),
-            "response_header": getattr(test, 'response_header', ''),
-            "response_body": getattr(test, 'response_body', ''),
-            "log_data": getattr(test, 'log_data', ''),
-
-        }
+        self.add_record(test, '错误', build_record(test))
 
-        self.cases.append(info)
+    def add_record(self, test, state, record):
+        if self.on_case is None:
+            self.cases.append(record)
+        else:
+            self.on_case(self.name, getattr(test, 'case_index', None), state, record)
 
     def get_result_info(self):
         return {
@@ -96,13 +77,14 @@ class TestResult:
             "success": self.success,
             "fail": self.fail,
             "error": self.error,
-            "cases": self.cases,
+            "cases": [case.to_dict() for case in self.cases],
             "status": '成功' if self.success == self.all else ('失败' if self.fail > 0 else '错误'),
+            "session": self.session,
         }
 
 
 class TestRunner:
-    def __init__(self, cases, env, env_object):
+    def __init__(self, cases, env, env_object, parallel=False, concurrency=None, on_case=None):
         """
 
         :param cases: 要执行的测试用例
@@ -136,13 +118,26 @@ class TestRunner:
             }
         ]
         :param env: 测试环境
+        :param parallel: 是否并行执行套件内互不依赖的用例
+        :param concurrency: 并行执行时同时运行的最大用例数
+        :param on_case: 用例执行完成的回调，在执行线程中调用，用于边执行边保存结果
         """
         self.cases = cases
         self.env_data = env
         self.result = []
         self.env_object = env_object
+        self.parallel = parallel
+        self.concurrency = concurrency or RUNNER_CONFIG['case_concurrency']
+        self.on_case = on_case
+        # 本次运行的工具函数模块，run时加载环境的global_func
+        self.functools = my_functools
+        # 创建执行器的事件循环(web服务的事件循环)，环境变量需要回到该循环中保存
+        try:
+            self.owner_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.owner_loop = None
 
-    def run(self):
+    async def run(self):
         """
         执行测试用例，优化数据库连接管理
         避免长时间占用连接资源
@@ -157,13 +152,20 @@ class TestRunner:
                 "config": config
             }]
         
-        # 初始数据库连接
-        db.init_connect(db_config)
+        # 初始数据库连接，每次运行使用独立的连接对象，连接从连接池中获取
+        run_db = DBClient()
+        # 环境变量的修改先写入缓冲，套件结束或定时合并保存
+        env_buffer = EnvWriteBuffer(self.env_object, self.owner_loop, RUNNER_CONFIG['env_flush_interval'])
+        flush_timer = asyncio.ensure_future(env_buffer.run_timer())
         
         try:
+            run_db.init_connect(db_config)
             ENV = {}
-            # 通过exec将字符串中的python变量加载到functools这个模块的命名空间中
-            exec(self.env_data["global_func"], my_functools.__dict__)
+            # 通过exec将字符串中的python变量加载到本次运行独立的functools模块中，
+            # 多个套件在不同线程中同时执行时不会互相覆盖环境的工具函数
+            self.functools = types.ModuleType(my_functools.__name__, my_functools.__doc__)
+            self.functools.__dict__.update(my_functools.__dict__)
+            exec(script_cache.compile(self.env_data["global_func"], '<global_func>'), self.functools.__dict__)
 
             # 遍历所有测试用例
             for items in self.cases:
@@ -173,39 +175,106 @@ class TestRunner:
                 print(f"开始执行测试套件: {name}")
                 
                 # 创建测试结果记录器
-                result = TestResult(name=name, all=len(items["Cases"]))
+                result = TestResult(name=name, all=len(items["Cases"]), on_case=self.on_case)
+                # 套件内所有用例共用一个请求会话
+                session = HttpSession(http_pool, getattr(self.env_object, 'id', None),
+                                      pool_size=ENV['ENV'].get('pool_size'),
+                                      max_retries=ENV['ENV'].get('max_retries'))
                 
-                # 遍历测试集执行用例
-                for i, testcase in enumerate(items["Cases"]):
-                    try:
-                        self.perform(testcase, result, ENV)
-                    except Exception as e:
-                        print(f"用例执行失败: {testcase.get('title', '未知用例')} - {str(e)}")
-                        # 继续执行下一个用例，而不是中断整个套件
-                        continue
+                if self.parallel:
+                    await self.run_parallel(items["Cases"], result, ENV, session, env_buffer, run_db,
+                                            depends=items.get("depends"))
+                else:
+                    # 遍历测试集执行用例
+                    for i, testcase in enumerate(items["Cases"]):
+                        try:
+                            await self.perform(testcase, result, ENV, session, env_buffer, run_db, i)
+                        except Exception as e:
+                            print(f"用例执行失败: {testcase.get('title', '未知用例')} - {str(e)}")
+                            # 继续执行下一个用例，而不是中断整个套件
+                            continue
+                result.session = session.get_stats()
                 
                 # 获取每条记录器的结果,保存起来
                 self.result.append(result.get_result_info())
+                # 套件结束，保存本套件中修改的环境变量
+                await env_buffer.flush()
                 
                 # 每执行完一个套件，释放一些资源
                 if hasattr(self, 'env_object') and self.env_object:
                     # 清理环境变量，避免内存累积
                     if hasattr(self.env_object, 'debug_global_variable'):
-                        self.env_object.debug_global_variable.clear()
+                        env_buffer.discard('debug_global_variable')
         
         finally:
+            flush_timer.cancel()
+            # 运行中断时也保存已经修改的环境变量
+            if env_buffer.dirty:
+                try:
+                    await env_buffer.flush()
+                except Exception as e:
+                    print(f"保存环境变量时出错: {str(e)}")
             # 确保数据库连接被关闭
             try:
-                db.close_db_connection()
+                run_db.close_db_connection()
             except Exception as e:
                 print(f"关闭数据库连接时出错: {str(e)}")
         
         return self.result[0] if self.result else {"name": "空结果", "all": 0, "success": 0, "fail": 0, "error": 0, "cases": []}
 
-    def perform(self, case, result, env):
+    async def run_parallel(self, cases, result, env, session, env_buffer=None, run_db=None, depends=None):
+        """
+        并行执行套件中的用例，依赖前面用例写入变量的用例等待其执行完成后再执行
+        :param cases: 按执行顺序排列的用例
+        :param result: 测试结果记录器
+        :param env: 测试环境
+        :param session: 请求会话
+        :param env_buffer: 环境变量写缓冲
+        :param run_db: 本次运行的数据库连接对象
+        :param depends: 执行计划中预先计算的用例依赖，为空时重新分析
+        :return:
+        """
+        if depends is None:
+            depends = build_dependencies(cases)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = []
+        # 用例结果在result.cases中的位置，执行完后按用例顺序重新排列
+        positions = [None] * len(cases)
+
+        async def run_case(index, testcase):
+            if depends[index]:
+                await asyncio.gather(*(tasks[i] for i in depends[index]))
+            # 每条用例使用独立的请求头，避免并行用例之间互相修改
+            case_env = {**env, 'ENV': {**env['ENV'], 'headers': dict(env['ENV'].get('headers') or {})}}
+            async with semaphore:
+                try:
+                    await self.perform(testcase, result, case_env, session, env_buffer, run_db, index)
+                except Exception as e:
+                    print(f"用例执行失败: {testcase.get('title', '未知用例')} - {str(e)}")
+                    return
+                if result.on_case is None:
+                    positions[index] = len(result.cases) - 1
+
+        try:
+            for index, testcase in enumerate(cases):
+                tasks.append(asyncio.ensure_future(run_case(index, testcase)))
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        result.cases = [result.cases[pos] for pos in positions if pos is not None]
+
+    async def perform(self, case, result, env, session=None, env_buffer=None, run_db=None, index=None):
         c = BaseCase()
+        c.case_index = index
+        if run_db is not None:
+            c.db = run_db
+        c.owner_loop = self.owner_loop
+        c.session = session
+        c.env_buffer = env_buffer
+        c.functools = self.functools
         try:
-            c.perform(case, env, self.env_object)
+            await c.perform(case, env, self.env_object)
         except AssertionError as e:
             # print('用例断言失败')
             result.add_fail(c)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : scriptcache.py
+"""
+前后置脚本、全局工具函数、解密脚本的编译缓存
+相同的脚本在进程内只编译一次，之后直接exec编译好的代码对象
+脚本编译时允许顶层await，包含await的脚本eval后得到协程，由调用方等待执行
+"""
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+
+from common.settings import SCRIPT_CACHE_SIZE
+
+
+class ScriptCache:
+    """按脚本内容哈希缓存代码对象的LRU缓存"""
+
+    def __init__(self, max_size=512):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._codes = OrderedDict()
+        # 多个执行线程共用同一个缓存
+        self._lock = threading.Lock()
+
+    def compile(self, source, filename='<script>'):
+        """
+        获取脚本编译后的代码对象
+        :param source: 脚本代码
+        :param filename: 报错信息中显示的文件名
+        :return:
+        """
+        source = source or ''
+        key = (filename, hashlib.sha1(source.encode('utf-8')).hexdigest())
+        with self._lock:
+            code = self._codes.get(key)
+            if code is not None:
+                self._codes.move_to_end(key)
+                self.hits += 1
+                return code
+        code = compile(source, filename, 'exec', flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
+        with self._lock:
+            self.misses += 1
+            self._codes[key] = code
+            while len(self._codes) > self.max_size:
+                self._codes.popitem(last=False)
+        return code
+
+    def get_stats(self):
+        """缓存命中统计"""
+        return {
+            "size": len(self._codes),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._codes.clear()
+
+
+def uses_name(code, name):
+    """
+    判断代码对象(包括其中定义的函数)是否使用了某个变量名
+    :param code: 编译后的代码对象
+    :param name: 变量名
+    :return:
+    """
+    if name in code.co_names or name in code.co_varnames or name in code.co_freevars:
+        return True
+    return any(isinstance(const, type(code)) and uses_name(const, name) for const in code.co_consts)
+
+
+# 进程内共享的脚本缓存
+script_cache = ScriptCache(SCRIPT_CACHE_SIZE)
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : template.py
+"""
+请求数据的模板编译
+预先解析请求数据中包含${{var}}占位符的位置，渲染时只替换这些位置，
+不含占位符的部分(例如大的json请求体)直接复用，不再逐层重建
+"""
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from common.settings import TEMPLATE_CACHE_SIZE
+
+PLACEHOLDER = re.compile(r'\${{(.+?)}}')
+
+
+class Template:
+    """编译后的请求数据模板"""
+
+    __slots__ = ('slots',)
+
+    def __init__(self, slots):
+        # [(路径, 按占位符切分后的片段), ...]，片段中奇数位是变量名
+        self.slots = slots
+
+    def render(self, data, variables):
+        """
+        使用变量渲染请求数据，返回新的数据，原数据不会被修改
+        :param data: 编译模板时使用的请求数据
+        :param variables: 变量字典
+        :return:
+        """
+        if not self.slots:
+            return data
+        root = _copy(data)
+        copied = {(): root}
+        tuples = []
+        for path, parts in self.slots:
+            parent = root
+            for depth in range(1, len(path)):
+                prefix = path[:depth]
+                node = copied.get(prefix)
+                if node is None:
+                    node = _copy(parent[path[depth - 1]])
+                    parent[path[depth - 1]] = node
+                    copied[prefix] = node
+                    if isinstance(data_at(data, prefix), tuple):
+                        tuples.append(prefix)
+                parent = node
+            parent[path[-1]] = _join(parts, variables)
+        if isinstance(data, tuple):
+            tuples.append(())
+        # 元组在渲染时临时转成列表，最后由内向外还原
+        for prefix in sorted(tuples, key=len, reverse=True):
+            node = tuple(copied[prefix])
+            if prefix:
+                data_parent = copied[prefix[:-1]]
+                data_parent[prefix[-1]] = node
+            else:
+                root = node
+        return root
+
+
+def data_at(data, path):
+    for key in path:
+        data = data[key]
+    return data
+
+
+def _copy(obj):
+    if isinstance(obj, dict):
+        return dict(obj)
+    return list(obj)
+
+
+def _join(parts, variables):
+    out = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            value = variables.get(part)
+            out.append('' if value is None else str(value))
+        else:
+            out.append(part)
+    return ''.join(out)
+
+
+def compile_template(data):
+    """
+    编译请求数据，记录所有包含占位符的字符串位置，dict中的files不做替换
+    :param data: 请求数据
+    :return:
+    """
+    slots = []
+
+    def walk(obj, path):
+        if isinstance(obj, str):
+            if '${{' in obj:
+                parts = PLACEHOLDER.split(obj)
+                if len(parts) > 1:
+                    slots.append((path, parts))
+        elif isinstance(obj, dict):
+            for k, v in obj.items():
+                if k != 'files':
+                    walk(v, path + (k,))
+        elif isinstance(obj, (list, tuple)):
+            for i, v in enumerate(obj):
+                walk(v, path + (i,))
+
+    walk(data, ())
+    return Template(slots)
+
+
+def content_hash(data):
+    """请求数据的内容哈希，files不参与计算"""
+    content = json.dumps({k: v for k, v in data.items() if k != 'files'}, ensure_ascii=False, default=str)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class TemplateCache:
+    """按用例id和请求数据哈希缓存编译后的模板"""
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, data, case_id=None, key=None) -> Template:
+        """
+        获取请求数据对应的模板，不存在则编译
+        :param data: 请求数据
+        :param case_id: 用例id
+        :param key: 调用方预先计算的内容标识(例如执行计划中的用例哈希)，为空时按请求数据计算哈希
+        :return:
+        """
+        key = (case_id, content_hash(data) if key is None else key)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                self.hits += 1
+                return template
+        template = compile_template(data)
+        with self._lock:
+            self.misses += 1
+            self._templates[key] = template
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+        return template
+
+    def get_stats(self):
+        """缓存命中统计"""
+        return {
+            "size": len(self._templates),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# 进程内共享的模板缓存
+template_cache = TemplateCache(TEMPLATE_CACHE_SIZE)
+
+
+if __name__ == '__main__':
+    import timeit
+
+    def legacy_replace(data, env):
+        """原BaseCase.replace_data的实现，用来对比"""
+        pattern = re.compile(r'\${{(.+?)}}')
+
+        def repl_in_str(s):
+            def _r(m):
+                value = env.get(m.group(1))
+                return '' if value is None else str(value)
+            return pattern.sub(_r, s)
+
+        def walk(obj):
+            if isinstance(obj, str):
+                return repl_in_str(obj)
+            if isinstance(obj, dict):
+                return {k: (v if k == 'files' else walk(v)) for k, v in obj.items()}
+            if isinstance(obj, list):
+                return [walk(v) for v in obj]
+            if isinstance(obj, tuple):
+                return tuple(walk(v) for v in obj)
+            return obj
+        return walk(data)
+
+    variables = {"token": "abc", "user": "john"}
+    request_data = {
+        "method": "post",
+        "url": "http://127.0.0.1/api/${{user}}/orders",
+        "headers": {"Content-Type": "application/json", "token": "${{token}}"},
+        "json": {"items": [{"id": i, "name": f"item-{i}", "tags": ["a", "b"], "price": i * 1.5}
+                           for i in range(5000)]},
+    }
+    assert legacy_replace(request_data, variables) == template_cache.get(request_data).render(request_data, variables)
+    # 执行计划中预先计算的哈希
+    request_hash = content_hash(request_data)
+    legacy = timeit.timeit(lambda: legacy_replace(request_data, variables), number=20) / 20
+    hashed = timeit.timeit(lambda: template_cache.get(request_data).render(request_data, variables), number=20) / 20
+    cached = timeit.timeit(lambda: template_cache.get(request_data, key=request_hash).render(
+        request_data, variables), number=20) / 20
+    print(f"原实现: {legacy * 1000:.2f}ms  每次计算哈希: {hashed * 1000:.2f}ms  预先计算哈希: {cached * 1000:.2f}ms")
@@ -3,11 +3,18 @@
 # @Time : 2024/12/11
 # @File : api.py
 import json
+from typing import Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, UploadFile, Query
+from fastapi.responses import StreamingResponse
+
+from .importer import CaseImporter, iter_lines, parse_document, iter_openapi, iter_har, export_cases
 from .models import InterFace, InterFaceCase
 from .schemas import AddInterFaceForm, UpdateInterFaceForm, AddInterFaceCaseForm, UpdateInterFaceCaseForm, RunCaseForm
 from apps.projects.models import Project, Env
+from apps.Suite.models import Suite
+from BackEngine.core.executor import runner_executor, RunnerBusyError
+from BackEngine.core.plancache import plan_cache
 from BackEngine.core.runner import TestRunner
 
 router = APIRouter(prefix='/api/TestInterFace', tags=['接口/用例管理'])
@@ -65,6 +72,7 @@ async def update_interface(_id: int, item: UpdateInterFaceForm):
     project = await Project.get_or_none(id=item.project)
     item.project = project
     await interface.update_from_dict(item.dict(exclude_unset=True)).save()
+    await plan_cache.invalidate_interfaces(_id)
     return interface
 
 
@@ -78,9 +86,56 @@ async def del_interface(_id: int):
     if not interface:
         raise HTTPException(status_code=422, detail="接口不存在")
     await interface.delete()
+    await plan_cache.invalidate_interfaces(_id)
 
 
 # ############################################# 用例相关 #############################################
+# 批量导入用例
+@router.post("/cases/import", summary="批量导入用例", status_code=201)
+async def import_cases(file: UploadFile, project: int,
+                       format: str = Query('ndjson', description='文件格式: ndjson/openapi/har'),
+                       suite: Optional[int] = Query(None, description='导入的用例添加到该套件')):
+    """
+    ndjson文件每行一条用例，格式与导出的文件相同，可以通过suite字段(套件名称)指定添加到的套件
+    """
+    if not await Project.exists(id=project):
+        raise HTTPException(status_code=422, detail="项目不存在")
+    if suite is not None and not await Suite.exists(id=suite, project_id=project):
+        raise HTTPException(status_code=422, detail="业务流不存在")
+    importer = CaseImporter(project, suite)
+    if format == 'ndjson':
+        async for lineno, line in iter_lines(file):
+            try:
+                item = json.loads(line)
+            except ValueError:
+                importer.error(lineno, "json格式错误")
+                continue
+            await importer.add(item, lineno)
+    elif format in ('openapi', 'har'):
+        try:
+            doc = parse_document(await file.read())
+        except Exception:
+            raise HTTPException(status_code=422, detail="文件格式错误")
+        if not isinstance(doc, dict):
+            raise HTTPException(status_code=422, detail="文件格式错误")
+        items = iter_openapi(doc) if format == 'openapi' else iter_har(doc)
+        for index, item in enumerate(items, start=1):
+            await importer.add(item, index)
+    else:
+        raise HTTPException(status_code=422, detail="不支持的文件格式")
+    return await importer.finish()
+
+
+# 导出用例
+@router.get("/cases/export", summary="导出用例(NDJSON)")
+async def export_case(project: int, suite: Optional[int] = Query(None, description='只导出该套件中的用例')):
+    if suite is not None and not await Suite.exists(id=suite, project_id=project):
+        raise HTTPException(status_code=422, detail="业务流不存在")
+    filename = f'cases-{project}-{suite}.ndjson' if suite else f'cases-{project}.ndjson'
+    return StreamingResponse(export_cases(project, suite), media_type='application/x-ndjson',
+                             headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
 # 添加测试用例
 @router.post("/cases", summary="添加测试用例", status_code=201)
 async def add_case(item: AddInterFaceCaseForm):
@@ -123,6 +178,7 @@ async def edit_case(case_id: int, item: UpdateInterFaceCaseForm):
     if not case:
         raise HTTPException(status_code=422, detail="用例不存在")
     await case.update_from_dict(item.dict(exclude_unset=True)).save()
+    await plan_cache.invalidate_cases(case_id)
     return case
 
 
@@ -133,6 +189,7 @@ async def del_case(case_id: int):
     if not case:
         raise HTTPException(status_code=422, detail="用例不存在")
     await case.delete()
+    await plan_cache.invalidate_cases(case_id)
 
 
 # 运行用例
@@ -186,7 +243,10 @@ async def run_case(item: RunCaseForm):
             "Cases": [cases]
         }
     ]
-    runner = TestRunner(case_datas, env_config, env).run()
+    try:
+        runner = await runner_executor.run(TestRunner(case_datas, env_config, env).run)
+    except RunnerBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
     # env.headers = headers
     # # 创建一个不包含指定键的新字典
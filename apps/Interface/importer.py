@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : importer.py
+"""
+用例的批量导入导出
+支持NDJSON(每行一条用例，与导出格式相同)、OpenAPI/Swagger和HAR文件，
+导入的数据按块使用bulk_create创建接口、用例和套件用例，导出按块查询并逐行输出NDJSON
+"""
+import json
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, parse_qsl
+
+from tortoise.transactions import in_transaction
+
+from apps.Interface.models import InterFace, InterFaceCase
+from apps.Suite.models import Suite, SuiteToCase
+from BackEngine.core.plancache import plan_cache
+from common.settings import IMPORT_CHUNK_SIZE
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+HTTP_METHODS = {'get', 'post', 'put', 'patch', 'delete', 'head', 'options'}
+# HAR中不需要保存到用例中的请求头，Content-Type根据请求体类型重新设置
+HAR_SKIP_HEADERS = {'host', 'content-length', 'connection', 'accept-encoding', 'content-type'}
+# 上传文件每次读取的大小
+READ_SIZE = 64 * 1024
+# 单个文件最多返回的错误信息条数
+MAX_ERRORS = 100
+
+
+async def iter_lines(file):
+    """
+    分块读取上传的NDJSON文件，逐行返回(行号, 数据)
+    :param file: UploadFile
+    :return:
+    """
+    lineno = 0
+    rest = b''
+    while True:
+        data = await file.read(READ_SIZE)
+        if not data:
+            break
+        lines = (rest + data).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+            lineno += 1
+            if line.strip():
+                yield lineno, line
+    if rest.strip():
+        yield lineno + 1, rest
+
+
+def parse_document(data: bytes):
+    """解析OpenAPI/HAR文件，支持json，安装了pyyaml时支持yaml"""
+    try:
+        return json.loads(data)
+    except ValueError:
+        if yaml is None:
+            raise ValueError("文件不是合法的json")
+        return yaml.safe_load(data)
+
+
+def _example(obj):
+    """获取参数或请求体中的示例值"""
+    if not isinstance(obj, dict):
+        return None
+    if 'example' in obj:
+        return obj['example']
+    if obj.get('examples'):
+        example = next(iter(obj['examples'].values()))
+        return example.get('value') if isinstance(example, dict) else example
+    schema = obj.get('schema') or {}
+    return schema.get('example', schema.get('default'))
+
+
+def iter_openapi(doc):
+    """
+    将OpenAPI 3/Swagger 2文档中的每个操作转换为一条用例
+    :param doc: 文档数据
+    :return:
+    """
+    for path, item in (doc.get('paths') or {}).items():
+        for method, op in item.items():
+            if method.lower() not in HTTP_METHODS or not isinstance(op, dict):
+                continue
+            params, headers, body = {}, {}, None
+            for param in (item.get('parameters') or []) + (op.get('parameters') or []):
+                if param.get('in') == 'query':
+                    params[param['name']] = _example(param)
+                elif param.get('in') == 'header':
+                    headers[param['name']] = _example(param)
+                elif param.get('in') == 'body':
+                    body = _example(param)
+            content = (op.get('requestBody') or {}).get('content') or {}
+            if 'application/json' in content:
+                body = _example(content['application/json'])
+            request = {"params": params}
+            if body is not None or 'application/json' in content:
+                headers['Content-Type'] = 'application/json'
+                request['json'] = body
+            name = op.get('summary') or op.get('operationId') or f'{method.upper()} {path}'
+            yield {
+                "interface": {"name": name, "method": method.upper(), "url": path},
+                "title": name,
+                "headers": headers,
+                "request": request,
+            }
+
+
+def iter_har(doc):
+    """
+    将HAR文件中的每个请求转换为一条用例，接口地址只保存路径，域名由测试环境提供
+    :param doc: HAR数据
+    :return:
+    """
+    for entry in (doc.get('log') or {}).get('entries') or []:
+        req = entry.get('request') or {}
+        url = urlsplit(req.get('url', ''))
+        method = req.get('method', 'GET').upper()
+        headers = {h['name']: h['value'] for h in req.get('headers') or []
+                   if not h['name'].startswith(':') and h['name'].lower() not in HAR_SKIP_HEADERS}
+        request = {"params": {q['name']: q['value'] for q in req.get('queryString') or []}}
+        post = req.get('postData') or {}
+        mime = post.get('mimeType', '')
+        # 执行用例时按Content-Type完全匹配选择请求体参数
+        if 'json' in mime:
+            headers['Content-Type'] = 'application/json'
+            try:
+                request['json'] = json.loads(post.get('text') or 'null')
+            except ValueError:
+                request['json'] = post.get('text')
+        elif 'x-www-form-urlencoded' in mime:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            request['data'] = {p['name']: p.get('value') for p in post.get('params') or []} or \
+                dict(parse_qsl(post.get('text') or ''))
+        name = f'{method} {url.path}'
+        yield {
+            "interface": {"name": name, "method": method, "url": url.path or '/'},
+            "title": name,
+            "headers": headers,
+            "request": request,
+        }
+
+
+def normalize(item):
+    """
+    校验并整理一条导入的用例
+    :param item: 用例数据
+    :return:
+    """
+    if not isinstance(item, dict):
+        raise ValueError("用例数据必须是对象")
+    interface = item.get('interface') or {}
+    method = str(interface.get('method') or 'GET').upper()
+    url = str(interface.get('url') or '')
+    if not url:
+        raise ValueError("接口路径不能为空")
+    if len(url) > 100:
+        raise ValueError("接口路径超过100个字符")
+    if len(method) > 10:
+        raise ValueError("请求方法不正确")
+    title = str(item.get('title') or interface.get('name') or f'{method} {url}')
+    suite = item.get('suite')
+    return {
+        "interface": {"name": str(interface.get('name') or title)[:50], "method": method, "url": url,
+                      "type": str(interface.get('type') or '1')},
+        "title": title[:50],
+        "headers": item.get('headers') or {},
+        "request": item.get('request') or {},
+        "file": item.get('file') or [],
+        "setup_script": item.get('setup_script') or '',
+        "teardown_script": item.get('teardown_script') or '',
+        "suite": str(suite)[:50] if suite else None,
+        "sort": item.get('sort'),
+    }
+
+
+class CaseImporter:
+    """按块批量导入用例"""
+
+    def __init__(self, project_id, suite_id=None, chunk_size=None):
+        """
+        :param project_id: 项目id
+        :param suite_id: 用例默认添加到的套件id，用例数据中的suite(套件名称)优先
+        :param chunk_size: 每块的用例数
+        """
+        self.project_id = project_id
+        self.suite_id = suite_id
+        self.chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+        self.counts = {"interfaces": 0, "cases": 0, "suites": 0, "suite_cases": 0}
+        self.errors = []
+        self._chunk = []
+        # (请求方法, 接口路径) -> 接口id
+        self._interfaces = None
+        # 套件名称 -> 套件id
+        self._suites = {}
+        # 套件id -> 下一个执行顺序
+        self._sorts = {}
+
+    async def add(self, item, lineno=None):
+        """添加一条用例，攒够一块后写入数据库"""
+        try:
+            self._chunk.append(normalize(item))
+        except ValueError as e:
+            self.error(lineno, str(e))
+            return
+        if len(self._chunk) >= self.chunk_size:
+            await self.flush()
+
+    def error(self, lineno, message):
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"line": lineno, "error": message})
+
+    async def flush(self):
+        items, self._chunk = self._chunk, []
+        if not items:
+            return
+        async with in_transaction():
+            interface_ids = await self._create_interfaces(items)
+            case_ids = await self._create_cases(items, interface_ids)
+            suite_ids = await self._create_suite_cases(items, case_ids)
+        # 事务提交后再失效，避免并发执行的套件缓存提交前的用例
+        if suite_ids:
+            await plan_cache.invalidate_suites(*suite_ids)
+
+    async def finish(self):
+        """写入剩余的用例，返回导入结果"""
+        await self.flush()
+        return {**self.counts, "errors": self.errors}
+
+    async def _create_interfaces(self, items):
+        if self._interfaces is None:
+            self._interfaces = {}
+            for pk, method, url in await InterFace.filter(project_id=self.project_id).order_by('id').values_list(
+                    'id', 'method', 'url'):
+                self._interfaces.setdefault((method.upper(), url), pk)
+        new = {}
+        for item in items:
+            key = (item['interface']['method'], item['interface']['url'])
+            if key not in self._interfaces and key not in new:
+                new[key] = InterFace(project_id=self.project_id, **item['interface'])
+        if new:
+            await InterFace.bulk_create(list(new.values()))
+            # MySQL的bulk_create不会回填主键，按(请求方法, 接口路径)重新查询
+            rows = await InterFace.filter(project_id=self.project_id,
+                                          url__in={url for _, url in new}).order_by('id').values_list(
+                'id', 'method', 'url')
+            for pk, method, url in rows:
+                self._interfaces.setdefault((method.upper(), url), pk)
+            self.counts['interfaces'] += len(new)
+        return [self._interfaces[(item['interface']['method'], item['interface']['url'])] for item in items]
+
+    async def _create_cases(self, items, interface_ids):
+        last_id = await InterFaceCase.all().order_by('-id').limit(1).values_list('id', flat=True)
+        last_id = last_id[0] if last_id else 0
+        await InterFaceCase.bulk_create([
+            InterFaceCase(interface_id=interface_id, title=item['title'], headers=item['headers'],
+                          request=item['request'], file=item['file'], setup_script=item['setup_script'],
+                          teardown_script=item['teardown_script'])
+            for item, interface_id in zip(items, interface_ids)])
+        self.counts['cases'] += len(items)
+        # 按(接口id, 标题)和插入顺序找回新建用例的id
+        created = defaultdict(deque)
+        rows = await InterFaceCase.filter(id__gt=last_id, interface_id__in=set(interface_ids)).order_by(
+            'id').values_list('id', 'interface_id', 'title')
+        for pk, interface_id, title in rows:
+            created[(interface_id, title)].append(pk)
+        return [created[(interface_id, item['title'])].popleft() if created[(interface_id, item['title'])] else None
+                for item, interface_id in zip(items, interface_ids)]
+
+    async def _suite_for(self, item):
+        """用例要添加到的套件id"""
+        name = item['suite']
+        if not name:
+            return self.suite_id
+        if name not in self._suites:
+            suite = await Suite.filter(project_id=self.project_id, name=name).first()
+            if suite is None:
+                suite = await Suite.create(project_id=self.project_id, name=name)
+                self.counts['suites'] += 1
+            self._suites[name] = suite.id
+        return self._suites[name]
+
+    async def _next_sort(self, suite_id):
+        if suite_id not in self._sorts:
+            last = await SuiteToCase.filter(suite_id=suite_id).exclude(sort=None).order_by('-sort').limit(
+                1).values_list('sort', flat=True)
+            self._sorts[suite_id] = (last[0] if last else 0) + 1
+        sort = self._sorts[suite_id]
+        self._sorts[suite_id] += 1
+        return sort
+
+    async def _create_suite_cases(self, items, case_ids):
+        rows = []
+        for item, case_id in zip(items, case_ids):
+            suite_id = await self._suite_for(item)
+            if suite_id is None or case_id is None:
+                continue
+            sort = item['sort'] if isinstance(item['sort'], int) else await self._next_sort(suite_id)
+            rows.append(SuiteToCase(suite_id=suite_id, suite_case_id=case_id, sort=sort))
+        if rows:
+            await SuiteToCase.bulk_create(rows)
+            self.counts['suite_cases'] += len(rows)
+        return {row.suite_id for row in rows}
+
+
+def case_line(case, suite=None, sort=None):
+    """将用例转换为一行NDJSON"""
+    data = {
+        "interface": {"name": case['interface__name'], "method": case['interface__method'],
+                      "url": case['interface__url'], "type": case['interface__type']},
+        "title": case['title'],
+        "headers": case['headers'],
+        "request": case['request'],
+        "file": case['file'],
+        "setup_script": case['setup_script'],
+        "teardown_script": case['teardown_script'],
+    }
+    if suite is not None:
+        data['suite'] = suite
+        data['sort'] = sort
+    return json.dumps(data, ensure_ascii=False) + '\n'
+
+
+CASE_FIELDS = ('id', 'title', 'headers', 'request', 'file', 'setup_script', 'teardown_script',
+               'interface__name', 'interface__method', 'interface__url', 'interface__type')
+
+
+async def export_cases(project_id, suite_id=None, chunk_size=None):
+    """
+    按块导出项目或套件中的用例，每条用例一行NDJSON
+    :param project_id: 项目id
+    :param suite_id: 套件id，指定时按套件中的执行顺序导出
+    :param chunk_size: 每次查询的用例数
+    :return:
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    if suite_id is None:
+        last_id = 0
+        while True:
+            cases = await InterFaceCase.filter(interface__project_id=project_id, id__gt=last_id).order_by(
+                'id').limit(chunk_size).values(*CASE_FIELDS)
+            for case in cases:
+                yield case_line(case)
+            if len(cases) < chunk_size:
+                return
+            last_id = cases[-1]['id']
+    suite = await Suite.get(id=suite_id)
+    links = await SuiteToCase.filter(suite_id=suite_id).order_by('sort', 'id').values_list('suite_case_id', 'sort')
+    for start in range(0, len(links), chunk_size):
+        chunk = links[start:start + chunk_size]
+        cases = {case['id']: case for case in
+                 await InterFaceCase.filter(id__in=[case_id for case_id, _ in chunk]).values(*CASE_FIELDS)}
+        for case_id, sort in chunk:
+            if case_id in cases:
+                yield case_line(cases[case_id], suite.name, sort)
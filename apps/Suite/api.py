@@ -4,11 +4,17 @@
 # @File : api.py
 import json
 
+from typing import Union
+
 from fastapi import APIRouter, HTTPException
 from tortoise.query_utils import Prefetch
+from tortoise.transactions import in_transaction
 
+from BackEngine.core.executor import runner_executor, RunnerBusyError
+from BackEngine.core.plancache import plan_cache, SuitePlan
 from BackEngine.core.runner import TestRunner
-from .schemas import AddSuiteForm, AddSuiteToCaseForm, SuiteSchema, UpdateOrder, SuiteRunForm, UpdateSuiteForm
+from .schemas import AddSuiteForm, AddSuiteToCaseForm, SuiteSchema, UpdateOrder, SuiteRunForm, UpdateSuiteForm, \
+    ReorderForm
 from .models import Suite, SuiteToCase
 from apps.projects.models import Project, Env
 from ..Interface.models import InterFaceCase
@@ -51,6 +57,7 @@ async def del_scenes(suite_id: int):
         raise HTTPException(status_code=422, detail="业务流不存在")
     await SuiteToCase.filter(suite=suite).delete()
     await suite.delete()
+    await plan_cache.invalidate_suites(suite_id)
 
 
 @router.patch('/flows/{suite_id}', summary='修改测试业务流')
@@ -60,22 +67,43 @@ async def update_scenes(suite_id: int, item: UpdateSuiteForm):
         raise HTTPException(status_code=422, detail="业务流不存在")
     suite.name = item.name
     await suite.save()
+    await plan_cache.invalidate_suites(suite_id)
     return suite
 
 
 # 修改测试业务流中用例执行顺序
 @router.patch('/cases_order', summary='修改测试业务流中用例执行顺序')
-async def update_scenes(item: list[UpdateOrder]):
-    # suite = await Suite.get_or_none(id=suite_id)
-    # if not suite:
-    #     raise HTTPException(status_code=422, detail="业务流不存在")
-    suitecases = []
-    for _i in item:
-        suite_to_case = await SuiteToCase.get_or_none(id=_i.id)
-        suite_to_case.sort = _i.sort
-        suitecases.append({'id': suite_to_case.id, 'sort': suite_to_case.sort})
-        await suite_to_case.save()
-    return suitecases
+async def update_scenes(item: Union[list[UpdateOrder], ReorderForm]):
+    """
+    支持两种参数:
+    1、[{"id": 套件用例id, "sort": 执行顺序}, ...]，只修改传入的用例
+    2、{"suite": 套件id, "ids": [按执行顺序排列的套件用例id]}，重新排列套件中的所有用例
+    """
+    if isinstance(item, ReorderForm):
+        sorts = {case_id: index for index, case_id in enumerate(item.ids, start=1)}
+    elif not item:
+        return []
+    else:
+        sorts = {_i.id: _i.sort for _i in item}
+    if len(sorts) != (len(item.ids) if isinstance(item, ReorderForm) else len(item)):
+        raise HTTPException(status_code=422, detail="用例id重复")
+    async with in_transaction():
+        # 一次查询出所有用例，一条语句批量更新
+        if isinstance(item, ReorderForm):
+            suite_to_cases = await SuiteToCase.filter(suite_id=item.suite)
+            if {case.id for case in suite_to_cases} != set(sorts):
+                raise HTTPException(status_code=422, detail="用例id与套件中的用例不一致")
+        else:
+            suite_to_cases = await SuiteToCase.filter(id__in=list(sorts))
+            if len(suite_to_cases) != len(sorts):
+                raise HTTPException(status_code=422, detail="部分用例不存在")
+            if len({case.suite_id for case in suite_to_cases}) > 1:
+                raise HTTPException(status_code=422, detail="用例不属于同一个套件")
+        for suite_to_case in suite_to_cases:
+            suite_to_case.sort = sorts[suite_to_case.id]
+        await SuiteToCase.bulk_update(suite_to_cases, fields=['sort'])
+    await plan_cache.invalidate_suites(*{suite_to_case.suite_id for suite_to_case in suite_to_cases})
+    return [{'id': case_id, 'sort': sort} for case_id, sort in sorts.items()]
 
 
 # 获取业务流中所有用例
@@ -107,14 +135,29 @@ async def get_cases(flow: int):
 # 运行测试业务流
 @router.post('/flows/run', summary='运行测试业务流')
 async def run_scenes(item: SuiteRunForm):
+    return await run_suite(item)
+
+
+async def run_suite(item: SuiteRunForm, on_case=None):
+    """
+    运行测试业务流
+    :param item: 运行参数
+    :param on_case: 用例执行完成的回调，指定后结果中不再包含用例详情
+    :return:
+    """
     env_id = item.env
     suite_id = item.flow
     env = await Env.get_or_none(id=env_id)
     if not env:
         raise HTTPException(status_code=422, detail="环境不存在")
-    suite = await Suite.get_or_none(id=suite_id)
-    if not suite:
-        raise HTTPException(status_code=422, detail="业务流不存在")
+    # 未修改的套件直接使用缓存的执行计划，不再查询套件和用例
+    await plan_cache.refresh()
+    plan = plan_cache.get(suite_id)
+    if plan is None:
+        suite = await Suite.get_or_none(id=suite_id)
+        if not suite:
+            raise HTTPException(status_code=422, detail="业务流不存在")
+        plan = await load_suite_plan(suite)
 
     env_config = {
         'ENV': {
@@ -128,12 +171,33 @@ async def run_scenes(item: SuiteRunForm):
         "decrypt_py": env.decrypt_py
     }
 
-    # headers = env_config['ENV']['headers'].copy()
-    cases = await SuiteToCase.filter(suite_id=suite_id).prefetch_related(
+    # 组装测试数据
+    case_datas = [plan.to_suite()]
+    # return case_datas
+    try:
+        # 在执行线程池中运行，超时后会真正取消套件的执行
+        runner = await runner_executor.run(TestRunner(case_datas, env_config, env, parallel=item.parallel,
+                                                      concurrency=item.concurrency, on_case=on_case).run)
+    except RunnerBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return runner
+
+
+async def load_suite_plan(suite: Suite):
+    """
+    查询套件中的用例生成执行计划并缓存
+    :param suite: 套件
+    :return:
+    """
+    # 先记录版本号，查询期间用例被修改时不缓存查询结果
+    version = plan_cache.version
+    cases = await SuiteToCase.filter(suite_id=suite.id).prefetch_related(
         Prefetch('suite_case', queryset=InterFaceCase.all().select_related('interface'))
     ).order_by('sort')
 
-    cases = [{
+    plan = SuitePlan(suite.id, suite.name, [{
+        "id": case.suite_case.id,
         "title": case.suite_case.title,
         "interface": {
             "url": case.suite_case.interface.url,
@@ -143,19 +207,9 @@ async def run_scenes(item: SuiteRunForm):
         "request": case.suite_case.request,
         "setup_script": case.suite_case.setup_script,
         "teardown_script": case.suite_case.teardown_script,
-    } for case in cases]
-
-    # 组装测试数据
-    case_datas = [
-        {
-            "name": suite.name,
-            "Cases": cases
-        }
-    ]
-    # return case_datas
-    runner = TestRunner(case_datas, env_config,env).run()
-
-    return runner
+    } for case in cases], interface_ids=[case.suite_case.interface_id for case in cases], version=version)
+    plan_cache.put(plan)
+    return plan
 
 
 # 向测试业务流中添加测试用例
@@ -167,7 +221,9 @@ async def add_icase(item: AddSuiteToCaseForm):
     suite_case = await InterFaceCase.get_or_none(id=item.icase)
     if not suite_case:
         raise HTTPException(status_code=422, detail="用例不存在")
-    return await SuiteToCase.create(suite=suite, suite_case=suite_case, sort=item.sort)
+    suite_to_case = await SuiteToCase.create(suite=suite, suite_case=suite_case, sort=item.sort)
+    await plan_cache.invalidate_suites(suite.id)
+    return suite_to_case
 
 
 # 删除业务流中的用例
@@ -177,3 +233,4 @@ async def del_icase(case_id: int):
     if not suite_case:
         raise HTTPException(status_code=422, detail="用例不存在")
     await suite_case.delete()
+    await plan_cache.invalidate_suites(suite_case.suite_id)
@@ -3,6 +3,8 @@
 # @Time : 2024/12/13
 # @File : schemas.py
 
+from typing import Optional
+
 from pydantic import BaseModel, Field
 
 
@@ -16,6 +18,11 @@ class UpdateOrder(BaseModel):
     sort: int
 
 
+class ReorderForm(BaseModel):
+    suite: int = Field(description='套件id')
+    ids: list[int] = Field(description='按执行顺序排列的套件用例id，需要包含套件中的所有用例')
+
+
 class AddSuiteToCaseForm(BaseModel):
     flow: int = Field(description='关联套件')
     icase: int = Field(description='关联用例')
@@ -37,3 +44,5 @@ class SuiteSchema(BaseModel):
 class SuiteRunForm(BaseModel):
     env: int = Field(description='环境id')
     flow: int = Field(description='套件id')
+    parallel: bool = Field(description='是否并行执行互不依赖的用例', default=False)
+    concurrency: Optional[int] = Field(description='并行执行的最大用例数', default=None)
@@ -2,18 +2,25 @@
 # @Author : John
 # @Time : 2024/12/13
 # @File : api.py
+import base64
 import json
 import time
+from datetime import date, datetime
 from typing import Optional
 
 import pytz
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from tortoise.expressions import Q, Subquery
+from tortoise.functions import Count
 from tortoise.transactions import in_transaction
 
 from common.sendfeishu import feishu_url, feishu_send_message
-from .models import TestTask, TestReport, TestRecord
+from .models import TestTask, TestReport, TestRecord, TestCaseResult, TestRunDaily
+from .rollup import rebuild_rollups
 from .schemas import AddTaskForm, RunTaskForm, UpdateTaskForm, SendReportForm
-from .task_manager import run_task_async, get_task_status, get_all_running_tasks
+from .task_manager import run_task_async, get_task_status as query_task_status, get_all_running_tasks, \
+    task_manager, TaskQueueFullError, TaskStatus
 from ..Suite.api import run_scenes
 from ..Suite.models import Suite
 from ..Suite.schemas import SuiteRunForm
@@ -45,12 +52,62 @@ async def create_task(item: AddTaskForm):
 # 查询所有测试任务
 @router.get('/tasks', summary='查询所有测试任务')
 async def get_tasks(project: int):
-    tasks = await TestTask.filter(project_id=project)
-    data = []
-    for task in tasks:
-        flows = await task.suite.all()
-        data.append({"id": task.pk, "name": task.name, "flow": [flow.id for flow in flows]})
-    return data
+    # 一次预加载所有任务关联的套件，避免每个任务单独查询
+    tasks = await TestTask.filter(project_id=project).prefetch_related('suite')
+    return [{"id": task.pk, "name": task.name, "flow": [flow.id for flow in task.suite]} for task in tasks]
+
+
+# 订阅任务执行进度
+@router.get('/tasks/progress/{task_uuid}', summary='订阅测试任务执行进度(SSE)')
+async def task_progress(task_uuid: str):
+    """
+    Server-Sent Events推送任务进度，任务可能在其他节点执行
+    事件: status(当前状态) queue(排队位置) start(开始执行) case(用例执行完成) suite(套件执行完成) finish(任务结束)
+    """
+    if not await query_task_status(task_uuid):
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    # Content-Encoding: identity避免被GZipMiddleware缓冲
+    return StreamingResponse(task_manager.stream_progress(task_uuid), media_type='text/event-stream',
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no",
+                                      "Content-Encoding": "identity"})
+
+
+# 获取所有运行中的任务
+@router.get('/tasks/running', summary='获取所有运行中的任务')
+async def get_running_tasks():
+    """获取当前所有正在运行的测试任务"""
+    try:
+        running_tasks = await get_all_running_tasks()
+        
+        return {
+            "result": "success",
+            "count": len(running_tasks),
+            "tasks": [
+                {
+                    "task_uuid": task_uuid,
+                    "task_id": task_info["task_id"],
+                    "tester": task_info["tester"],
+                    "status": task_info["status"],
+                    "progress": task_info["progress"],
+                    "created_at": task_info["created_at"].isoformat() if task_info["created_at"] else None,
+                    "started_at": task_info["started_at"].isoformat() if task_info["started_at"] else None
+                }
+                for task_uuid, task_info in running_tasks.items()
+            ]
+        }
+        
+    except Exception as e:
+        print(f"获取运行中任务失败: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"获取运行中任务失败: {str(e)}")
+
+
+# 获取任务队列
+@router.get('/tasks/queue', summary='获取任务队列和并发槽位占用')
+async def get_task_queue():
+    """等待中的任务及其排队位置、预计等待时间，全局、项目、环境并发槽位的占用"""
+    return await task_manager.get_queue()
 
 
 # 获取单个任务详情
@@ -69,24 +126,31 @@ async def get_task(task_id: int):
 @router.patch('/tasks/{task_id}', summary='向测试任务中添加测试套件')
 async def add_icase(item: UpdateTaskForm):
     task = await TestTask.get_or_none(id=item.id)
+    if not task:
+        raise HTTPException(status_code=422, detail="任务不存在")
     # 更新任务的基本信息
     task.name = item.name
 
     # 获取当前关联的套件ID集合
-    current_suite_ids = {suite.id for suite in await task.suite.all()}
+    current_suite_ids = set(await task.suite.all().values_list('id', flat=True))
     new_suite_ids = set(item.flow)
 
     # 计算需要删除和添加的套件ID
     to_remove = current_suite_ids - new_suite_ids
     to_add = new_suite_ids - current_suite_ids
 
-    # # 删除不再关联的套件
-    for suite_id in to_remove:
-        await task.suite.remove(await Suite.get(id=suite_id))
+    # 一次查询出需要添加的套件
+    suites = await Suite.filter(id__in=to_add) if to_add else []
+    if len(suites) != len(to_add):
+        raise HTTPException(status_code=422, detail="部分套件不存在")
+
+    # 删除不再关联的套件
+    if to_remove:
+        await task.suite.remove(*[Suite(id=suite_id) for suite_id in to_remove])
 
     # 添加新关联的套件
-    for suite_id in to_add:
-        await task.suite.add(await Suite.get(id=suite_id))
+    if suites:
+        await task.suite.add(*suites)
 
     # 保存任务更改
     await task.save()
@@ -151,14 +215,18 @@ async def run_task(item: RunTaskForm):
         if not task:
             raise HTTPException(status_code=404, detail="任务不存在")
         
-        # 使用后台任务管理器异步执行任务
-        task_uuid = await run_task_async(item.task, item.env, item.tester)
+        # 使用后台任务管理器异步执行任务，并发槽位已满时在队列中等待
+        try:
+            task_uuid = await run_task_async(item.task, item.env, item.tester, item.parallel, task.project_id)
+        except TaskQueueFullError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
         
         return {
             "result": "success", 
             "task_uuid": task_uuid,
             "message": "任务已提交到后台执行，请使用任务ID查询执行状态",
-            "query_url": f"/api/TestTask/tasks/status/{task_uuid}"
+            "query_url": f"/api/TestTask/tasks/status/{task_uuid}",
+            **(await task_manager.queue_position(task_uuid) or {"position": 0, "eta_seconds": None})
         }
         
     except HTTPException:
@@ -175,7 +243,8 @@ async def run_task(item: RunTaskForm):
 async def get_task_status(task_uuid: str):
     """查询后台任务的执行状态和进度"""
     try:
-        status_info = get_task_status(task_uuid)
+        # 任务状态保存在redis中，可以查询其他节点执行的任务
+        status_info = await query_task_status(task_uuid)
         
         if not status_info:
             raise HTTPException(status_code=404, detail="任务不存在或已过期")
@@ -190,7 +259,11 @@ async def get_task_status(task_uuid: str):
             "completed_at": status_info["completed_at"].isoformat() if status_info["completed_at"] else None,
             "result": status_info["result"],
             "error": status_info["error"],
-            "record_id": status_info["record_id"]
+            "record_id": status_info["record_id"],
+            # 用例级别的执行统计: done/total/success/fail/error
+            "counts": status_info.get("counts"),
+            # 排队中的任务返回排队位置和预计等待时间
+            **(await task_manager.queue_position(task_uuid) or {"position": 0, "eta_seconds": None})
         }
         
     except HTTPException:
@@ -202,52 +275,143 @@ async def get_task_status(task_uuid: str):
         raise HTTPException(status_code=500, detail=f"查询任务状态失败: {str(e)}")
 
 
-# 获取所有运行中的任务
-@router.get('/tasks/running', summary='获取所有运行中的任务')
-async def get_running_tasks():
-    """获取当前所有正在运行的测试任务"""
-    try:
-        running_tasks = get_all_running_tasks()
-        
-        return {
-            "result": "success",
-            "count": len(running_tasks),
-            "tasks": [
-                {
-                    "task_uuid": task_uuid,
-                    "task_id": task_info["task_id"],
-                    "tester": task_info["tester"],
-                    "status": task_info["status"],
-                    "progress": task_info["progress"],
-                    "created_at": task_info["created_at"].isoformat() if task_info["created_at"] else None,
-                    "started_at": task_info["started_at"].isoformat() if task_info["started_at"] else None
-                }
-                for task_uuid, task_info in running_tasks.items()
-            ]
-        }
-        
-    except Exception as e:
-        print(f"获取运行中任务失败: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"获取运行中任务失败: {str(e)}")
+# 取消测试任务
+@router.post('/tasks/cancel/{task_uuid}', summary='取消测试任务')
+async def cancel_task(task_uuid: str):
+    """
+    取消等待中或执行中的任务，执行中的任务停止调度新的用例并中断正在发送的请求，
+    已执行的用例结果保存到运行记录，运行记录状态为已取消
+    """
+    status = await task_manager.cancel_task(task_uuid)
+    if status is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    if status == TaskStatus.RUNNING:
+        message = "任务正在取消，已执行的用例结果会保存到运行记录"
+    elif status == TaskStatus.CANCELLED:
+        message = "任务已取消"
+    else:
+        raise HTTPException(status_code=422, detail=f"任务已结束，无法取消: {status}")
+    return {
+        "result": "success",
+        "task_uuid": task_uuid,
+        "status": status,
+        "message": message,
+        "query_url": f"/api/TestTask/tasks/status/{task_uuid}"
+    }
 
 
 
-# 获取运行记录，传task就是任务的所有记录，传project，就是项目数据看板
-@router.get('/records', summary='获取单个任务所有运行记录')
-async def get_records(task: Optional[int] = None, project: Optional[int] = None):
+# 运行记录列表返回的字段
+RECORD_FIELDS = ('id', 'task__name', 'env__name', 'tester', 'all', 'success', 'fail', 'error', 'pass_rate',
+                 'run_time', 'status', 'create_time')
+
+
+def records_query(task: Optional[int], project: Optional[int], start: Optional[datetime],
+                  end: Optional[datetime], status: Optional[str]):
+    """按任务或项目、时间范围、运行状态筛选运行记录"""
     if task:
-        records = await TestRecord.filter(task_id=task).select_related('task', 'env').order_by('-create_time')
+        query = TestRecord.filter(task_id=task)
     elif project:
-        records = await TestRecord.filter(task__project=project).select_related('task', 'env').order_by('-create_time')
+        # 先查出项目的任务id，按(task_id, create_time)索引查询，不再关联任务表排序
+        query = TestRecord.filter(task_id__in=Subquery(TestTask.filter(project_id=project).values('id')))
     else:
         raise HTTPException(status_code=422, detail="参数错误,task和project不能都为空")
-    return [{"id": record.pk, "task": record.task.name, "env": record.env.name, "tester": record.tester,
-             "all": record.all, "success": record.success, "fail": record.fail, "error": record.error,
-             "pass_rate": record.pass_rate, "run_time": record.run_time, "status": record.status,
-             "create_time": record.create_time.strftime("%Y-%m-%d %H:%M:%S")
-             } for record in records]
+    if start:
+        query = query.filter(create_time__gte=start)
+    if end:
+        query = query.filter(create_time__lt=end)
+    if status:
+        query = query.filter(status=status)
+    return query
+
+
+def encode_cursor(create_time: datetime, record_id: int):
+    return base64.urlsafe_b64encode(f'{create_time.isoformat()}|{record_id}'.encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        create_time, record_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(create_time), int(record_id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="参数错误,cursor无效")
+
+
+# 获取运行记录，传task就是任务的所有记录，传project，就是项目数据看板
+@router.get('/records', summary='获取单个任务所有运行记录')
+async def get_records(task: Optional[int] = None, project: Optional[int] = None,
+                      start: Optional[datetime] = Query(None, description='开始时间(包含)'),
+                      end: Optional[datetime] = Query(None, description='结束时间(不包含)'),
+                      status: Optional[str] = Query(None, description='运行状态'),
+                      limit: Optional[int] = Query(None, ge=1, le=200, description='每页条数，不传时返回全部记录'),
+                      cursor: Optional[str] = Query(None, description='上一页返回的next_cursor')):
+    query = records_query(task, project, start, end, status)
+    if cursor:
+        # 按(create_time, id)倒序的游标分页，翻页不需要offset扫描
+        create_time, record_id = decode_cursor(cursor)
+        query = query.filter(Q(create_time__lt=create_time) | Q(create_time=create_time, id__lt=record_id))
+    query = query.order_by('-create_time', '-id')
+    if limit:
+        query = query.limit(limit + 1)
+    rows = await query.values(*RECORD_FIELDS)
+    records = [{"id": row['id'], "task": row['task__name'], "env": row['env__name'], "tester": row['tester'],
+                "all": row['all'], "success": row['success'], "fail": row['fail'], "error": row['error'],
+                "pass_rate": row['pass_rate'], "run_time": row['run_time'], "status": row['status'],
+                "create_time": row['create_time'].strftime("%Y-%m-%d %H:%M:%S")
+                } for row in rows[:limit]]
+    if not limit:
+        return records
+    next_cursor = encode_cursor(rows[limit - 1]['create_time'], rows[limit - 1]['id']) if len(rows) > limit else None
+    return {"items": records, "next_cursor": next_cursor}
+
+
+# 统计运行记录数量
+@router.get('/records/count', summary='统计运行记录数量')
+async def count_records(task: Optional[int] = None, project: Optional[int] = None,
+                        start: Optional[datetime] = Query(None, description='开始时间(包含)'),
+                        end: Optional[datetime] = Query(None, description='结束时间(不包含)'),
+                        status: Optional[str] = Query(None, description='运行状态')):
+    query = records_query(task, project, start, end, status)
+    rows = await query.annotate(count=Count('id')).group_by('status').values('status', 'count')
+    return {"count": sum(row['count'] for row in rows), "status": {row['status']: row['count'] for row in rows}}
+
+
+# 项目看板的通过率趋势
+@router.get('/dashboard/trends', summary='获取项目每日通过率趋势')
+async def get_trends(project: int, task: Optional[int] = None, env: Optional[int] = None,
+                     start: Optional[date] = Query(None, description='开始日期(包含)'),
+                     end: Optional[date] = Query(None, description='结束日期(包含)')):
+    query = TestRunDaily.filter(project_id=project)
+    if task:
+        query = query.filter(task_id=task)
+    if env:
+        query = query.filter(env_id=env)
+    if start:
+        query = query.filter(day__gte=start)
+    if end:
+        query = query.filter(day__lte=end)
+    rows = await query.order_by('day').values('day', 'runs', 'cases', 'success', 'fail', 'error',
+                                              'p50_seconds', 'p95_seconds')
+    days = {}
+    for row in rows:
+        item = days.setdefault(row['day'], {"day": row['day'].isoformat(), "runs": 0, "cases": 0, "success": 0,
+                                            "fail": 0, "error": 0, "p50_seconds": 0, "p95_seconds": 0})
+        for key in ('runs', 'cases', 'success', 'fail', 'error'):
+            item[key] += row[key]
+        # 多个任务、环境合并时，中位数按运行次数加权平均，95分位取最大值
+        item['p50_seconds'] += row['p50_seconds'] * row['runs']
+        item['p95_seconds'] = max(item['p95_seconds'], row['p95_seconds'])
+    for item in days.values():
+        item['p50_seconds'] = round(item['p50_seconds'] / item['runs'], 2) if item['runs'] else 0
+        item['pass_rate'] = round(item['success'] / item['cases'] * 100, 2) if item['cases'] else 0
+    return list(days.values())
+
+
+# 根据历史运行记录重建项目看板的日统计
+@router.post('/dashboard/rebuild', summary='重建项目看板的日统计')
+async def rebuild_dashboard(project: int):
+    count = await rebuild_rollups(project)
+    return {"result": "success", "rows": count}
 
 
 # 获取单个测试记录详情
@@ -272,11 +436,91 @@ async def get_recordInfo(record_id: int):
     }
 
 
+# 报告中用例列表返回的字段
+CASE_RESULT_FIELDS = ('id', 'suite_id', 'suite_name', 'case_id', 'sort', 'name', 'status', 'status_code',
+                      'run_time', 'response_size')
+
+
+async def report_summary(record_id: int):
+    """
+    获取报告的套件统计，不包含用例详情
+    :param record_id: 运行记录id
+    :return: (报告对象, 报告信息)，报告不存在且没有用例结果时报告信息为None
+    """
+    report = await TestReport.get_or_none(record_id=record_id)
+    if report is not None:
+        return report, report.info
+    # 任务还在执行或中途退出，使用已经写入的结果统计
+    rows = await TestCaseResult.filter(record_id=record_id).annotate(count=Count('id')).group_by(
+        'suite_id', 'suite_name', 'status').values('suite_id', 'suite_name', 'status', 'count')
+    if not rows:
+        return None, None
+    suites = {}
+    for row in rows:
+        suite = suites.setdefault(row['suite_id'], {"name": row['suite_name'], "all": 0, "success": 0, "fail": 0,
+                                                    "error": 0, "cases": [], "suite_id": row['suite_id']})
+        suite['all'] += row['count']
+        suite[{'成功': 'success', '失败': 'fail'}.get(row['status'], 'error')] += row['count']
+    results = sorted(suites.values(), key=lambda res: res['suite_id'])
+    info = {key: sum(res[key] for res in results) for key in ('all', 'fail', 'error', 'success')}
+    return None, {**info, "results": results}
+
+
 # 获取测试报告
 @router.get('/report/{record_id}', summary='获取测试报告')
 async def get_report(record_id: int):
-    report = await TestReport.get_or_none(record_id=record_id)
-    return report
+    report, info = await report_summary(record_id)
+    if info is None:
+        return report
+    if any(res.get('cases') for res in info.get('results', [])):
+        # 旧的报告或归档的报告，用例结果保存在报告中
+        return report
+    rows = await TestCaseResult.filter(record_id=record_id).order_by('suite_id', 'sort', 'id').values(
+        'suite_id', 'info')
+    # 用例结果按套件分组，填充到报告中
+    cases = {}
+    for row in rows:
+        cases.setdefault(row['suite_id'], []).append(row['info'])
+    results = [{**res, "cases": cases.get(res.get('suite_id'), [])} for res in info.get('results', [])]
+    return {"id": report.pk if report else None, "record_id": record_id, "info": {**info, "results": results}}
+
+
+# 获取测试报告的统计信息
+@router.get('/report/{record_id}/summary', summary='获取测试报告的套件统计')
+async def get_report_summary(record_id: int):
+    report, info = await report_summary(record_id)
+    if info is None:
+        raise HTTPException(status_code=422, detail="报告不存在")
+    results = [{k: v for k, v in res.items() if k != 'cases'} for res in info.get('results', [])]
+    return {"record_id": record_id, **{k: v for k, v in info.items() if k != 'results'}, "results": results}
+
+
+# 分页获取测试报告中的用例结果
+@router.get('/report/{record_id}/cases', summary='分页获取测试报告中的用例结果')
+async def get_report_cases(record_id: int, suite_id: Optional[int] = None, status: Optional[str] = None,
+                           failed: bool = Query(False, description='只返回失败和错误的用例'),
+                           detail: bool = Query(False, description='是否返回请求、响应和日志详情'),
+                           page: int = Query(1, ge=1), size: int = Query(20, ge=1, le=200)):
+    query = TestCaseResult.filter(record_id=record_id)
+    if suite_id is not None:
+        query = query.filter(suite_id=suite_id)
+    if status:
+        query = query.filter(status=status)
+    elif failed:
+        query = query.filter(status__in=['失败', '错误'])
+    total = await query.count()
+    fields = CASE_RESULT_FIELDS + ('info',) if detail else CASE_RESULT_FIELDS
+    items = await query.order_by('suite_id', 'sort', 'id').offset((page - 1) * size).limit(size).values(*fields)
+    return {"total": total, "page": page, "size": size, "items": items}
+
+
+# 获取单条用例结果详情
+@router.get('/report/{record_id}/cases/{result_id}', summary='获取测试报告中单条用例结果详情')
+async def get_report_case(record_id: int, result_id: int):
+    row = await TestCaseResult.filter(id=result_id, record_id=record_id).first().values(*CASE_RESULT_FIELDS, 'info')
+    if not row:
+        raise HTTPException(status_code=422, detail="用例结果不存在")
+    return row
 
 
 # 发送报告到飞书
@@ -284,7 +528,7 @@ async def get_report(record_id: int):
 async def send_report(item: SendReportForm):
     # print(item)
     record_id = int(item.record_id)
-    result = await TestReport.get_or_none(record_id=record_id)
+    report, result = await report_summary(record_id)
     record = await TestRecord.get_or_none(id=record_id).prefetch_related('task', 'env')
     info = {
         "id": record.pk,
@@ -300,4 +544,4 @@ async def send_report(item: SendReportForm):
         "status": record.status,
         "create_time": record.create_time
     }
-    feishu_send_message(result.info, record_id, info, feishu_url)
+    feishu_send_message(result, record_id, info, feishu_url)
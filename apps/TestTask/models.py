@@ -5,6 +5,8 @@
 import tortoise.fields
 from tortoise import models, fields
 
+from common.fields import CompressedJSONField
+
 
 class TestTask(models.Model):
     """测试任务表"""
@@ -18,6 +20,8 @@ class TestTask(models.Model):
     class Meta:
         table = 'TestTask'
         table_description = '测试任务'
+        # 项目看板按项目查出任务id后再查询运行记录
+        indexes = (('project_id', 'id'),)
 
 
 class TestRecord(models.Model):
@@ -35,6 +39,9 @@ class TestRecord(models.Model):
     tester = fields.CharField(max_length=30, description='测试人员')
     run_time = fields.CharField(max_length=10, description='运行时间', default='0')
     status = fields.CharField(max_length=10, description='运行状态', default='执行中')
+    # 数值类型的通过率和运行时间，用于统计
+    pass_rate_value = fields.FloatField(description='通过率(%)', null=True)
+    run_seconds = fields.FloatField(description='运行时间(秒)', null=True)
 
     def __str__(self):
         return str(self.pk)
@@ -42,13 +49,15 @@ class TestRecord(models.Model):
     class Meta:
         table = 'TestRecord'
         table_description = '测试运行记录'
+        # 运行记录按任务、时间倒序分页查询
+        indexes = (('task_id', 'create_time'),)
 
 
 class TestReport(models.Model):
     """测试报告表"""
     record = fields.ForeignKeyField('models.TestRecord', related_name='report', description='关联记录',
                                     on_delete=tortoise.fields.CASCADE)
-    info = fields.JSONField(description='报告信息', default=dict, blank=True)
+    info = CompressedJSONField(description='报告信息', default=dict, blank=True)
 
     def __str__(self):
         return str(self.pk)
@@ -56,3 +65,52 @@ class TestReport(models.Model):
     class Meta:
         table = 'TestReport'
         table_description = '测试报告'
+
+
+class TestCaseResult(models.Model):
+    """用例执行结果表，任务执行过程中分批写入"""
+    record = fields.ForeignKeyField('models.TestRecord', related_name='case_results', description='关联记录',
+                                    on_delete=tortoise.fields.CASCADE)
+    suite_id = fields.IntField(description='套件id')
+    suite_name = fields.CharField(max_length=50, description='套件名称')
+    case_id = fields.IntField(description='用例id', null=True)
+    sort = fields.IntField(description='用例在套件中的顺序', null=True)
+    name = fields.CharField(max_length=50, description='用例名称', default='')
+    status = fields.CharField(max_length=10, description='执行结果')
+    status_code = fields.IntField(description='响应状态码', null=True)
+    run_time = fields.FloatField(description='请求耗时(秒)', default=0)
+    response_size = fields.IntField(description='响应体大小(字节)', default=0)
+    info = CompressedJSONField(description='用例结果详情', default=dict, blank=True)
+
+    def __str__(self):
+        return str(self.pk)
+
+    class Meta:
+        table = 'TestCaseResult'
+        table_description = '用例执行结果'
+        # 报告按套件顺序分页、按执行结果筛选
+        indexes = (('record_id', 'suite_id', 'sort'), ('record_id', 'status'))
+
+
+class TestRunDaily(models.Model):
+    """运行记录按项目、任务、环境、日期汇总的统计表，运行结束时更新"""
+    project_id = fields.IntField(description='项目id')
+    task_id = fields.IntField(description='任务id')
+    env_id = fields.IntField(description='环境id')
+    day = fields.DateField(description='日期')
+    runs = fields.IntField(description='运行次数', default=0)
+    cases = fields.IntField(description='用例总数', default=0)
+    success = fields.IntField(description='成功用例数', default=0)
+    fail = fields.IntField(description='失败用例数', default=0)
+    error = fields.IntField(description='错误用例数', default=0)
+    p50_seconds = fields.FloatField(description='运行时间中位数(秒)', default=0)
+    p95_seconds = fields.FloatField(description='运行时间95分位(秒)', default=0)
+
+    def __str__(self):
+        return str(self.pk)
+
+    class Meta:
+        table = 'TestRunDaily'
+        table_description = '运行记录日统计'
+        unique_together = (('task_id', 'env_id', 'day'),)
+        indexes = (('project_id', 'day'),)
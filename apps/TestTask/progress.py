@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : progress.py
+"""
+任务执行进度的推送
+运行器每执行完一条用例就发布一条进度事件，事件通过redis的发布订阅转发到所有进程，
+客户端通过SSE接口订阅，不再轮询任务状态接口
+"""
+import asyncio
+import json
+import logging
+import time
+
+from apps.TestTask.task_queue import TaskStatus
+
+# 与任务管理器共用日志
+logger = logging.getLogger('apps.TestTask.task_manager')
+
+# 任务结束的状态，收到后关闭推送
+FINISHED = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.TIMEOUT, TaskStatus.CANCELLED)
+
+
+class MemoryProgressBroker:
+    """进程内的事件转发，只用于本地调试"""
+
+    def __init__(self):
+        self._queues = {}
+
+    async def publish(self, task_uuid, event):
+        for queue in self._queues.get(task_uuid, ()):
+            queue.put_nowait(event)
+
+    async def subscribe(self, task_uuid):
+        """
+        订阅任务的进度事件
+        :param task_uuid: 任务uuid
+        :return:
+        """
+        queue = asyncio.Queue()
+        self._queues.setdefault(task_uuid, set()).add(queue)
+        return _MemorySubscription(self, task_uuid, queue)
+
+
+class _MemorySubscription:
+
+    def __init__(self, broker, task_uuid, queue):
+        self.broker = broker
+        self.task_uuid = task_uuid
+        self.queue = queue
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        queues = self.broker._queues.get(self.task_uuid)
+        if queues is not None:
+            queues.discard(self.queue)
+            if not queues:
+                self.broker._queues.pop(self.task_uuid, None)
+
+
+class RedisProgressBroker:
+    """redis发布订阅转发事件，频道为{prefix}:events:uuid"""
+
+    def __init__(self, client, prefix='fa_api:task'):
+        self.client = client
+        self.channel_prefix = f'{prefix}:events:'
+
+    async def publish(self, task_uuid, event):
+        await self.client.publish(self.channel_prefix + task_uuid, json.dumps(event, ensure_ascii=False, default=str))
+
+    async def subscribe(self, task_uuid):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel_prefix + task_uuid)
+        return _RedisSubscription(pubsub)
+
+
+class _RedisSubscription:
+
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    async def get(self, timeout):
+        """等待下一条事件，超时返回None"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message is not None and message['type'] == 'message':
+                return json.loads(message['data'])
+
+    async def close(self):
+        await self.pubsub.unsubscribe()
+        await self.pubsub.aclose()
+
+
+def create_broker(config):
+    """按任务队列的配置创建事件转发"""
+    if config['backend'] == 'memory':
+        return MemoryProgressBroker()
+    from common.redis_client import redis_client
+    return RedisProgressBroker(redis_client, prefix=config['prefix'])
+
+
+class TaskProgress:
+    """一次任务运行的进度统计，用例结果在执行线程中回调，统计和发布在web服务的事件循环中进行"""
+
+    def __init__(self, task_uuid, totals, broker, on_update=None, interval=1):
+        """
+        :param task_uuid: 任务uuid
+        :param totals: {套件id: 用例数}
+        :param broker: 事件转发
+        :param on_update: 定时保存进度的协程函数on_update(progress, counts)
+        :param interval: 保存进度的最短间隔(秒)
+        """
+        self.task_uuid = task_uuid
+        self.totals = totals
+        self.broker = broker
+        self.on_update = on_update
+        self.interval = interval
+        self.owner_loop = asyncio.get_running_loop()
+        self.counts = {"done": 0, "total": sum(totals.values()), "success": 0, "fail": 0, "error": 0}
+        self._suite_done = {}
+        self._last_update = 0
+        # 事件按顺序逐条发布
+        self._events = asyncio.Queue()
+        self._sender = asyncio.ensure_future(self._send())
+
+    @property
+    def progress(self):
+        total = self.counts['total']
+        return min(int(self.counts['done'] * 100 / total), 100) if total else 0
+
+    def case_callback(self, suite_id, callback=None):
+        """
+        生成传给TestRunner的on_case回调
+        :param suite_id: 套件id
+        :param callback: 同时调用的其他回调，例如用例结果写入器的回调
+        :return:
+        """
+        def on_case(suite_name, index, state, record):
+            if callback is not None:
+                callback(suite_name, index, state, record)
+            self.owner_loop.call_soon_threadsafe(self._case_done, suite_id, suite_name, index, state, record)
+        return on_case
+
+    def _case_done(self, suite_id, suite_name, index, state, record):
+        self.counts['done'] += 1
+        self.counts[{'成功': 'success', '失败': 'fail'}.get(state, 'error')] += 1
+        self._suite_done[suite_id] = self._suite_done.get(suite_id, 0) + 1
+        self.emit('case', suite_id=suite_id, suite_name=suite_name, index=index, case_id=record.case_id,
+                  name=record.name, status=state, status_code=record.status_code, run_time=record.run_time)
+
+    def suite_done(self, suite_id, result):
+        """
+        套件执行结束，没有执行的用例(套件超时、出错)计入已完成，保证进度能到100
+        :param suite_id: 套件id
+        :param result: 套件结果
+        :return:
+        """
+        skipped = max(self.totals.get(suite_id, 0) - self._suite_done.get(suite_id, 0), 0)
+        self.counts['done'] += skipped
+        self.emit('suite', suite_id=suite_id, name=result.get('name'), suite_status=result.get('status'),
+                  skipped=skipped)
+
+    def emit(self, event, **data):
+        self._events.put_nowait({"event": event, "task_uuid": self.task_uuid, **data, **self.counts,
+                                 "progress": self.progress})
+
+    async def _send(self):
+        while True:
+            event = await self._events.get()
+            try:
+                await self.broker.publish(self.task_uuid, event)
+                if self.on_update is not None and (event['event'] != 'case' or
+                                                   time.monotonic() - self._last_update >= self.interval):
+                    self._last_update = time.monotonic()
+                    await self.on_update(event['progress'], dict(self.counts))
+            except Exception as e:
+                logger.error(f"发布任务进度失败: uuid={self.task_uuid} {str(e)}")
+            finally:
+                self._events.task_done()
+
+    def abort(self):
+        """丢弃还没发布的事件，不再保存进度"""
+        self._sender.cancel()
+
+    async def close(self):
+        """等待所有事件发布完成，保存最终的进度"""
+        await self._events.join()
+        self._sender.cancel()
+        if self.on_update is not None:
+            try:
+                await self.on_update(self.progress, dict(self.counts))
+            except Exception as e:
+                logger.error(f"保存任务进度失败: uuid={self.task_uuid} {str(e)}")
+
+
+def sse_message(event, data):
+    """格式化一条SSE消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
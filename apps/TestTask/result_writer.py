@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : result_writer.py
+"""
+任务执行时用例结果的分批写入
+用例在执行线程中完成后把结果交给写入器，写入器在web服务的事件循环中批量插入数据库，
+内存中只保留还没写入的一批结果，任务中途异常退出时已写入的结果仍然可以查看
+"""
+import asyncio
+import threading
+
+from apps.TestTask.models import TestCaseResult
+from common.settings import RESULT_CONFIG
+
+
+def parse_run_time(run_time):
+    """将'0.12s'格式的耗时转换为秒数"""
+    try:
+        return float(str(run_time).rstrip('s'))
+    except ValueError:
+        return 0
+
+
+class CaseResultWriter:
+    """一次任务运行的用例结果写入器"""
+
+    def __init__(self, record_id, batch_size=None, interval=None):
+        """
+        :param record_id: 运行记录id
+        :param batch_size: 每批写入的结果数
+        :param interval: 定时写入的间隔(秒)
+        """
+        self.record_id = record_id
+        self.batch_size = batch_size or RESULT_CONFIG['batch_size']
+        self.interval = RESULT_CONFIG['flush_interval'] if interval is None else interval
+        self.written = 0
+        # 数据库连接所在的事件循环
+        self.owner_loop = asyncio.get_running_loop()
+        self._pending = []
+        # 执行线程添加结果、web服务线程取出结果，需要加锁
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flushes = set()
+        self._timer = None
+        # close之后仍然可能收到结果(被取消或超时的套件在执行线程中收尾)，收到后立即写入
+        self.closed = False
+
+    def case_callback(self, suite_id):
+        """生成传给TestRunner的on_case回调"""
+        def on_case(suite_name, index, state, record):
+            self.add(suite_id, suite_name, index, state, record)
+        return on_case
+
+    def add(self, suite_id, suite_name, index, state, record):
+        """
+        添加一条用例结果，可以在任意线程中调用
+        :param suite_id: 套件id
+        :param suite_name: 套件名称
+        :param index: 用例在套件中的顺序
+        :param state: 执行结果(成功/失败/错误)
+        :param record: CaseRecord
+        :return:
+        """
+        row = TestCaseResult(record_id=self.record_id, suite_id=suite_id, suite_name=suite_name[:50],
+                             case_id=record.case_id, sort=index, name=(record.name or '')[:50], status=state,
+                             status_code=record.status_code if isinstance(record.status_code, int) else None,
+                             run_time=parse_run_time(record.run_time), response_size=record.response_size or 0,
+                             info=record.to_dict())
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size or self.closed
+        if full:
+            try:
+                self.owner_loop.call_soon_threadsafe(self._schedule_flush)
+            except RuntimeError:
+                # web服务的事件循环已经关闭
+                print(f"用例结果写入失败: 事件循环已关闭 record_id={self.record_id}")
+
+    def _schedule_flush(self):
+        task = asyncio.ensure_future(self._flush_logged() if self.closed else self.flush())
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def flush(self):
+        """写入还没保存的结果，只能在web服务的事件循环中调用"""
+        async with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+            if not rows:
+                return
+            try:
+                await TestCaseResult.bulk_create(rows)
+            except Exception:
+                with self._lock:
+                    self._pending = rows + self._pending
+                raise
+            self.written += len(rows)
+
+    async def _flush_logged(self):
+        """关闭后收到的结果没有调用方等待，写入失败时只记录"""
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"用例结果写入失败: {str(e)}")
+
+    async def _run_timer(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"用例结果写入失败: {str(e)}")
+
+    def start(self):
+        """开始定时写入"""
+        if self.interval and self._timer is None:
+            self._timer = asyncio.ensure_future(self._run_timer())
+        return self
+
+    async def close(self):
+        """停止定时写入并保存剩余的结果，之后收到的结果逐条写入"""
+        self.closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
+        await self.flush()
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : rollup.py
+"""
+项目看板的日统计
+每次运行结束后重新汇总该任务、环境当天的运行记录，看板直接查询汇总表，不再扫描历史记录
+"""
+import datetime
+
+import pytz
+
+from apps.TestTask.models import TestRecord, TestRunDaily, TestTask
+
+local_timezone = pytz.timezone('Asia/Shanghai')
+# 不计入统计的运行状态，中断(执行节点失联)、取消的运行只执行了部分用例
+UNFINISHED = ('执行中', '中断', '已取消')
+
+
+def parse_pass_rate(pass_rate):
+    """将'93.5'格式的通过率转换为数值"""
+    try:
+        return float(pass_rate)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_run_time(run_time):
+    """将'12.3s'格式的运行时间转换为秒数"""
+    try:
+        return float(str(run_time).rstrip('s'))
+    except ValueError:
+        return None
+
+
+def local_day(create_time):
+    """记录创建时间对应的本地日期"""
+    if create_time.tzinfo is not None:
+        create_time = create_time.astimezone(local_timezone)
+    return create_time.date()
+
+
+def day_range(day):
+    """本地日期对应的时间范围[start, end)，转换为数据库中保存的UTC时间"""
+    start = local_timezone.localize(datetime.datetime.combine(day, datetime.time())).astimezone(datetime.timezone.utc)
+    return start, start + datetime.timedelta(days=1)
+
+
+def percentile(values, percent):
+    """最近秩法计算分位数"""
+    if not values:
+        return 0
+    values = sorted(values)
+    index = max(int(-(-len(values) * percent // 100)) - 1, 0)
+    return values[index]
+
+
+async def update_daily_rollup(task_id, env_id, day, project_id=None):
+    """
+    重新汇总任务、环境某一天已完成的运行记录
+    :param task_id: 任务id
+    :param env_id: 环境id
+    :param day: 本地日期
+    :param project_id: 项目id，不传时从任务中获取
+    :return:
+    """
+    if project_id is None:
+        project_id = (await TestTask.get(id=task_id)).project_id
+    start, end = day_range(day)
+    rows = await TestRecord.filter(task_id=task_id, env_id=env_id, create_time__gte=start,
+                                   create_time__lt=end).exclude(status__in=UNFINISHED).values(
+        'all', 'success', 'fail', 'error', 'run_time', 'run_seconds')
+    seconds = [row['run_seconds'] if row['run_seconds'] is not None else parse_run_time(row['run_time'])
+               for row in rows]
+    seconds = [s for s in seconds if s is not None]
+    await TestRunDaily.update_or_create(
+        task_id=task_id, env_id=env_id, day=day,
+        defaults={
+            "project_id": project_id,
+            "runs": len(rows),
+            "cases": sum(row['all'] for row in rows),
+            "success": sum(row['success'] for row in rows),
+            "fail": sum(row['fail'] for row in rows),
+            "error": sum(row['error'] for row in rows),
+            "p50_seconds": percentile(seconds, 50),
+            "p95_seconds": percentile(seconds, 95),
+        })
+
+
+async def record_finished(record: TestRecord):
+    """运行结束后更新日统计"""
+    await update_daily_rollup(record.task_id, record.env_id, local_day(record.create_time))
+
+
+async def rebuild_rollups(project_id):
+    """
+    根据历史运行记录重建项目的日统计，同时补齐历史记录的数值字段
+    :param project_id: 项目id
+    :return: 重建的统计行数
+    """
+    task_ids = await TestTask.filter(project_id=project_id).values_list('id', flat=True)
+    records = await TestRecord.filter(task_id__in=task_ids).exclude(status__in=UNFINISHED).only(
+        'id', 'task_id', 'env_id', 'create_time', 'pass_rate', 'run_time', 'pass_rate_value', 'run_seconds')
+    groups = set()
+    changed = []
+    for record in records:
+        groups.add((record.task_id, record.env_id, local_day(record.create_time)))
+        if record.pass_rate_value is None or record.run_seconds is None:
+            record.pass_rate_value = parse_pass_rate(record.pass_rate)
+            record.run_seconds = parse_run_time(record.run_time)
+            changed.append(record)
+    if changed:
+        await TestRecord.bulk_update(changed, fields=['pass_rate_value', 'run_seconds'], batch_size=500)
+    await TestRunDaily.filter(project_id=project_id).delete()
+    for task_id, env_id, day in groups:
+        await update_daily_rollup(task_id, env_id, day, project_id)
+    return len(groups)
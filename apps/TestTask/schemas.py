@@ -22,6 +22,7 @@ class RunTaskForm(BaseModel):
     env: int = Field(description='关联环境')
     task: int = Field(description='关联任务')
     tester: str = Field(description="执行人")
+    parallel: bool = Field(description='套件内是否并行执行互不依赖的用例', default=False)
 
 
 class SendReportForm(BaseModel):
@@ -2,36 +2,68 @@
 """
 测试任务后台执行管理器
 解决run_task卡死问题，实现异步执行和状态管理
+任务和状态保存在redis中，任意一个进程都可以领取执行、查询状态，进程重启后任务不会丢失
 """
 import asyncio
+import os
+import socket
 import uuid
 import time
 import traceback
 from datetime import datetime
 from typing import Dict, Optional, Any
 
-from apps.TestTask.models import TestTask, TestRecord, TestReport
-from apps.Suite.api import run_scenes
+from tortoise.functions import Count
+
+from apps.TestTask.models import TestTask, TestRecord, TestReport, TestCaseResult
+from apps.TestTask.progress import TaskProgress, create_broker, sse_message, FINISHED
+from apps.TestTask.result_writer import CaseResultWriter
+from apps.TestTask.rollup import record_finished
+from apps.TestTask.task_queue import TaskStatus, TaskQueueFullError, MemoryTaskStore, RedisTaskStore
+from apps.Suite.api import run_suite
+from apps.Suite.models import SuiteToCase
 from apps.Suite.schemas import SuiteRunForm
+from common.settings import RUNNER_CONFIG, RESULT_CONFIG, TASK_QUEUE_CONFIG
 import logging
 import sys
 
+# 转发取消请求的频道，执行任务的节点收到后中断任务
+CANCEL_CHANNEL = 'cancel'
 
-class TaskStatus:
-    """任务状态常量"""
-    PENDING = "pending"
-    RUNNING = "running"
-    COMPLETED = "completed"
-    FAILED = "failed"
-    TIMEOUT = "timeout"
 
+def create_store(config=TASK_QUEUE_CONFIG):
+    """按配置创建任务存储"""
+    if config['backend'] == 'memory':
+        return MemoryTaskStore(result_ttl=config['result_ttl'])
+    from common.redis_client import redis_client
+    return RedisTaskStore(redis_client, prefix=config['prefix'], result_ttl=config['result_ttl'])
 
-class BackgroundTaskManager:
-    """后台任务管理器（使用当前事件循环，不跨线程）"""
 
-    def __init__(self):
+class BackgroundTaskManager:
+    """后台任务管理器，从任务队列中领取任务，在当前事件循环中执行"""
+
+    def __init__(self, store=None, config=TASK_QUEUE_CONFIG, broker=None):
+        self.store = store if store is not None else create_store(config)
+        # 执行进度事件的转发
+        self.broker = broker if broker is not None else create_broker(config)
+        self.config = config
+        # 当前进程正在执行的任务进度
+        self._progress: Dict[str, TaskProgress] = {}
+        # 当前进程正在执行的任务信息
         self.tasks: Dict[str, Dict[str, Any]] = {}
-        self._lock = asyncio.Lock()
+        # 当前进程正在执行的任务
+        self._running: Dict[str, asyncio.Task] = {}
+        # 被用户取消的任务，区别于进程退出时的取消
+        self._cancelled = set()
+        # 租约已失效(被其他节点接管)的任务，本节点停止执行但不修改任务状态
+        self._lost = set()
+        # 套件已执行完成、正在保存结果的任务，不再响应取消
+        self._finishing = set()
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+        self._poller: Optional[asyncio.Task] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._wakeup: Optional[asyncio.Event] = None
         self.logger = logging.getLogger(__name__)
         handler = logging.StreamHandler(sys.stdout)
         formatter = logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s')
@@ -41,29 +73,230 @@ class BackgroundTaskManager:
         self.logger.setLevel(logging.INFO)
         self.logger.propagate = False
 
-    async def create_task(self, task_id: int, env_id: int, tester: str) -> str:
-        """创建新的后台任务并在当前事件循环中调度"""
+    def start(self):
+        """启动领取任务的协程，服务启动时调用，提交任务时也会自动启动"""
+        if self._poller is None or self._poller.done():
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._poller = asyncio.create_task(self._poll())
+            self._listener = asyncio.create_task(self._listen_cancel())
+            self.logger.info(f'任务执行节点启动: worker={self.worker_id}')
+
+    async def stop(self):
+        """停止领取任务，正在执行的任务放回队列，由其他节点或重启后继续执行"""
+        if self._poller is not None:
+            # 取消可能被正在执行的redis命令吞掉，同时用标记让领取循环退出
+            self._stopping = True
+            self._wakeup.set()
+            self._poller.cancel()
+            self._listener.cancel()
+            await asyncio.gather(self._poller, self._listener, return_exceptions=True)
+            self._poller = self._listener = None
+        running = list(self._running.items())
+        lost = set(self._lost)
+        for _, task in running:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in running), return_exceptions=True)
+        for task_uuid, _ in running:
+            if task_uuid in lost:
+                continue
+            try:
+                await self.store.requeue(task_uuid, status=TaskStatus.PENDING)
+            except Exception as e:
+                self.logger.error(f'任务放回队列失败: uuid={task_uuid} {str(e)}')
+
+    async def create_task(self, task_id: int, env_id: int, tester: str, parallel: bool = False,
+                          project_id: int = None) -> str:
+        """
+        创建新的后台任务，放入任务队列等待执行
+        等待的任务数达到max_pending时抛出TaskQueueFullError
+        """
         task_uuid = str(uuid.uuid4())
-
-        async with self._lock:
-            self.tasks[task_uuid] = {
-                "task_id": task_id,
-                "env_id": env_id,
-                "tester": tester,
-                "status": TaskStatus.PENDING,
-                "progress": 0,
-                "result": None,
-                "error": None,
-                "created_at": datetime.now(),
-                "started_at": None,
-                "completed_at": None,
-                "record_id": None
-            }
-
-        asyncio.create_task(self._run_task_async(task_uuid))
+        await self.store.submit(task_uuid, {
+            "task_id": task_id,
+            "project_id": project_id,
+            "env_id": env_id,
+            "tester": tester,
+            "parallel": parallel,
+            "status": TaskStatus.PENDING,
+            "progress": 0,
+            "result": None,
+            "error": None,
+            "created_at": datetime.now(),
+            "started_at": None,
+            "completed_at": None,
+            "record_id": None
+        }, max_pending=self.config['max_pending'])
+        self.start()
+        self._wakeup.set()
         self.logger.info(f'任务创建: uuid={task_uuid} task_id={task_id} env_id={env_id} tester={tester}')
         return task_uuid
 
+    async def _poll(self):
+        """领取任务，同时处理其他节点租约过期的任务"""
+        last_reap = 0
+        while not self._stopping:
+            try:
+                if time.monotonic() - last_reap >= self.config['heartbeat']:
+                    last_reap = time.monotonic()
+                    for task_uuid in await self.store.reap(self.config['max_attempts'], '执行节点失联，任务已达到最大执行次数'):
+                        self.logger.warning(f'任务租约过期，重新入队: uuid={task_uuid}')
+                task_uuid = None
+                if len(self._running) < self.config['concurrency']:
+                    # 全局、项目、环境的槽位都有空闲时才会领取到任务
+                    task_uuid = await self.store.claim(self.worker_id, self.config['lease'], self.limits)
+                if task_uuid is not None:
+                    self._running[task_uuid] = asyncio.create_task(self._execute(task_uuid))
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(f'领取任务失败: {str(e)}')
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.config['poll_interval'])
+            except asyncio.TimeoutError:
+                pass
+
+    async def _listen_cancel(self):
+        """接收取消请求，中断当前进程正在执行的任务"""
+        subscription = None
+        try:
+            while not self._stopping:
+                try:
+                    if subscription is None:
+                        subscription = await self.broker.subscribe(CANCEL_CHANNEL)
+                    event = await subscription.get(self.config['poll_interval'])
+                    if event is not None:
+                        self._cancel_local(event['task_uuid'])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.logger.error(f'接收取消请求失败: {str(e)}')
+                    subscription = None
+                    await asyncio.sleep(self.config['poll_interval'])
+        finally:
+            if subscription is not None:
+                try:
+                    await subscription.close()
+                except Exception:
+                    pass
+
+    async def _heartbeat(self, task_uuid: str):
+        """定时续期任务租约，同时检查任务是否已被请求取消(取消请求的广播丢失时兜底)"""
+        while True:
+            await asyncio.sleep(self.config['heartbeat'])
+            try:
+                if not await self.store.heartbeat(task_uuid, self.worker_id, self.config['lease']):
+                    # 任务已重新入队，可能正在其他节点执行，继续执行会产生重复的运行记录
+                    self.logger.warning(f'任务租约已失效，停止本节点的执行: uuid={task_uuid}')
+                    self._cancel_local(task_uuid, lost=True)
+                    return
+                if await self.store.cancel_requested(task_uuid):
+                    self._cancel_local(task_uuid)
+            except Exception as e:
+                self.logger.error(f'任务心跳失败: uuid={task_uuid} {str(e)}')
+
+    def _cancel_local(self, task_uuid: str, lost: bool = False) -> bool:
+        """
+        中断当前进程正在执行的任务，任务不在当前进程执行时返回False
+        :param task_uuid: 任务uuid
+        :param lost: 租约已失效，正在保存结果的任务同样中断
+        :return:
+        """
+        task = self._running.get(task_uuid)
+        if task is None or (task_uuid in self._finishing and not lost):
+            return False
+        if task_uuid not in self._cancelled and task_uuid not in self._lost:
+            (self._lost if lost else self._cancelled).add(task_uuid)
+            # 取消等待中的套件，执行线程中的套件随之取消，正在发送的请求被中断
+            task.cancel()
+            self.logger.info(f'任务中断: uuid={task_uuid} lost={lost}')
+        return True
+
+    async def cancel_task(self, task_uuid: str) -> Optional[str]:
+        """
+        取消任务，等待中的任务直接移出队列，执行中的任务通知执行节点中断，已执行的用例结果保存到运行记录
+        :param task_uuid: 任务uuid
+        :return: 取消后的任务状态，执行中的任务返回running，任务不存在返回None
+        """
+        info = await self.store.get(task_uuid)
+        if info is None:
+            return None
+        if info['status'] in FINISHED:
+            return info['status']
+        fields = dict(status=TaskStatus.CANCELLED, error='任务已取消', completed_at=datetime.now())
+        if await self.store.cancel_pending(task_uuid, **fields):
+            self.logger.info(f'任务取消: uuid={task_uuid}')
+            await self.broker.publish(task_uuid, {"event": "finish", "task_uuid": task_uuid, **fields,
+                                                  "progress": 0})
+            return TaskStatus.CANCELLED
+        # 任务已被领取，标记后由执行节点中断
+        await self.store.update(task_uuid, cancel_requested=True)
+        if not self._cancel_local(task_uuid):
+            await self.broker.publish(CANCEL_CHANNEL, {"event": "cancel", "task_uuid": task_uuid})
+        return TaskStatus.RUNNING
+
+    async def _execute(self, task_uuid: str):
+        """执行领取到的任务，结束后释放租约"""
+        heartbeat = asyncio.create_task(self._heartbeat(task_uuid))
+        try:
+            task_info = await self.store.get(task_uuid)
+            if task_info is None:
+                return
+            self.tasks[task_uuid] = task_info
+            if task_info.get('cancel_requested'):
+                # 领取前已被请求取消
+                await self._finish(task_uuid, status=TaskStatus.CANCELLED, error='任务已取消',
+                                   completed_at=datetime.now())
+                return
+            await self._run_task_async(task_uuid)
+        except asyncio.CancelledError:
+            if task_uuid in self._lost:
+                asyncio.current_task().uncancel()
+                await self._abandon(task_uuid)
+            elif task_uuid in self._cancelled:
+                asyncio.current_task().uncancel()
+                await self._finish_cancelled(task_uuid)
+            else:
+                # 进程退出，由stop放回队列
+                raise
+        except Exception as e:
+            self.logger.error(f'任务执行失败: uuid={task_uuid} {str(e)}\n{traceback.format_exc()}')
+            await self._finish(task_uuid, status=TaskStatus.FAILED, error=str(e), completed_at=datetime.now())
+        finally:
+            heartbeat.cancel()
+            self.tasks.pop(task_uuid, None)
+            self._running.pop(task_uuid, None)
+            self._cancelled.discard(task_uuid)
+            self._lost.discard(task_uuid)
+            self._finishing.discard(task_uuid)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def _update(self, task_uuid: str, **fields):
+        """更新任务状态，同时写入任务存储"""
+        if task_uuid in self.tasks:
+            self.tasks[task_uuid].update(fields)
+        await self.store.update(task_uuid, **fields)
+
+    async def _finish(self, task_uuid: str, **fields):
+        """任务结束，释放租约，发布结束事件"""
+        if task_uuid in self.tasks:
+            self.tasks[task_uuid].update(fields)
+        progress = self._progress.pop(task_uuid, None)
+        if progress is not None:
+            await progress.close()
+        await self.store.finish(task_uuid, **fields)
+        try:
+            await self.broker.publish(task_uuid, {
+                "event": "finish", "task_uuid": task_uuid, **fields,
+                **(progress.counts if progress is not None else {}),
+                "progress": fields.get('progress', progress.progress if progress is not None else 0),
+            })
+        except Exception as e:
+            self.logger.error(f'发布任务结束事件失败: uuid={task_uuid} {str(e)}')
+
     async def _run_task_async(self, task_uuid: str):
         """异步执行任务"""
         task_info = self.tasks.get(task_uuid)
@@ -75,8 +308,10 @@ class BackgroundTaskManager:
         if not task:
             raise Exception("任务不存在")
 
-        task_info["status"] = TaskStatus.RUNNING
-        task_info["started_at"] = datetime.now()
+        if task_info.get("record_id"):
+            # 上次执行的节点中断了，之前的记录标记为中断，重新执行
+            await TestRecord.filter(id=task_info["record_id"], status='执行中').update(status='中断')
+        await self._update(task_uuid, status=TaskStatus.RUNNING, started_at=datetime.now(), progress=0)
         self.logger.info(f'任务开始: uuid={task_uuid} task_id={task_info["task_id"]}')
 
         # 创建测试记录
@@ -85,7 +320,9 @@ class BackgroundTaskManager:
             env_id=task_info["env_id"],
             tester=task_info["tester"]
         )
-        task_info["record_id"] = record.id
+        await self._update(task_uuid, record_id=record.id)
+        # 用例结果边执行边分批写入TestCaseResult，报告中只保存套件的统计数据
+        writer = CaseResultWriter(record.id).start()
 
         # 初始化统计
         all_ = 0
@@ -98,18 +335,38 @@ class BackgroundTaskManager:
         suites = await task.suite.all()
         total_suites = len(suites)
         self.logger.info(f'任务套件数: uuid={task_uuid} count={total_suites}')
-
-        # 并发执行测试套件（关键改进）
+        # 每条用例执行完成后推送进度
+        totals = {row['suite_id']: row['count'] for row in await SuiteToCase.filter(
+            suite_id__in=[suite.id for suite in suites]).group_by('suite_id').annotate(
+            count=Count('id')).values('suite_id', 'count')}
+        progress = TaskProgress(task_uuid, totals, self.broker, interval=self.config['progress_interval'],
+                                on_update=lambda value, counts: self._update(task_uuid, progress=value, counts=counts))
+        self._progress[task_uuid] = progress
+        progress.emit('start', record_id=record.id, suites=total_suites)
+
+        # 并发执行测试套件，同时执行的套件数不超过suite_concurrency
         tasks = []
+        semaphore = asyncio.Semaphore(self.config['suite_concurrency'] or max(total_suites, 1))
+
+        async def run_one(i, suite):
+            res = await self._run_suite_with_timeout(
+                suite.id, task_info["env_id"], i, total_suites, task_uuid, task_info["parallel"],
+                progress.case_callback(suite.id, writer.case_callback(suite.id)), semaphore
+            )
+            progress.suite_done(suite.id, res)
+            return res
+
         for i, suite in enumerate(suites):
             # 创建异步任务
-            suite_task = self._run_suite_with_timeout(
-                suite.id, task_info["env_id"], i, total_suites, task_uuid
-            )
-            tasks.append(suite_task)
+            tasks.append(run_one(i, suite))
 
         # 等待所有套件执行完成（带超时）
-        suite_results = await asyncio.gather(*tasks, return_exceptions=True)
+        try:
+            suite_results = await asyncio.gather(*tasks, return_exceptions=True)
+            self._finishing.add(task_uuid)
+        finally:
+            # 任务被取消时同样写入已执行的用例结果
+            await writer.close()
 
         # 处理结果
         for res in suite_results:
@@ -124,14 +381,16 @@ class BackgroundTaskManager:
                 error += res.get('error', 0)
 
         # 计算结果
-        pass_rate = str(round((success / all_) * 100, 2)) if all_ > 0 else '0.0'
+        pass_rate_value = round((success / all_) * 100, 2) if all_ > 0 else 0.0
+        pass_rate = str(pass_rate_value)
         if success == all_:
             status = '成功'
         elif error != 0:
             status = '错误'
         else:
             status = '失败'
-        run_time = str(round(time.time() - start_time, 2)) + 's'
+        run_seconds = round(time.time() - start_time, 2)
+        run_time = str(run_seconds) + 's'
 
         # 更新记录
         record.all = all_
@@ -141,7 +400,14 @@ class BackgroundTaskManager:
         record.pass_rate = pass_rate
         record.run_time = run_time
         record.status = status
+        record.pass_rate_value = pass_rate_value
+        record.run_seconds = run_seconds
         await record.save()
+        try:
+            # 更新项目看板的日统计
+            await record_finished(record)
+        except Exception as e:
+            self.logger.error(f"更新日统计失败: record_id={record.id} {str(e)}")
 
         # 创建测试报告
         info = {
@@ -151,11 +417,13 @@ class BackgroundTaskManager:
             "success": success,
             "results": result,
         }
+        if RESULT_CONFIG['archive']:
+            # 归档模式下报告中同时保存完整的用例结果
+            await self._archive_cases(record.id, result)
         await TestReport.create(record=record, info=info)
 
         # 更新任务状态
-        task_info["status"] = TaskStatus.COMPLETED
-        task_info["result"] = {
+        await self._finish(task_uuid, status=TaskStatus.COMPLETED, result={
             "status": status,
             "pass_rate": pass_rate,
             "run_time": run_time,
@@ -163,25 +431,86 @@ class BackgroundTaskManager:
             "success": success,
             "fail": fail,
             "error": error
-        }
-        task_info["completed_at"] = datetime.now()
-        task_info["progress"] = 100
+        }, completed_at=datetime.now(), progress=100)
+        try:
+            # 用于估算排队任务的等待时间
+            await self.store.record_duration(run_seconds)
+        except Exception as e:
+            self.logger.error(f"记录任务执行时间失败: uuid={task_uuid} {str(e)}")
         self.logger.info(f'任务完成: uuid={task_uuid} status={status} pass_rate={pass_rate} run_time={run_time}')
 
-    async def _run_suite_with_timeout(self, suite_id: int, env_id: int, index: int, total: int, task_uuid: str):
+    async def _abandon(self, task_uuid: str):
+        """租约失效的任务: 本节点的运行记录标记为中断，任务状态、槽位由接管的节点维护"""
+        progress = self._progress.pop(task_uuid, None)
+        if progress is not None:
+            progress.abort()
+        record_id = (self.tasks.get(task_uuid) or {}).get("record_id")
+        if record_id:
+            try:
+                await TestRecord.filter(id=record_id, status='执行中').update(status='中断')
+            except Exception as e:
+                self.logger.error(f"运行记录标记中断失败: record_id={record_id} {str(e)}")
+        self.logger.warning(f'任务已由其他节点接管，本节点停止执行: uuid={task_uuid} record_id={record_id}')
+
+    async def _finish_cancelled(self, task_uuid: str):
+        """被取消的任务: 已执行的用例统计写入运行记录，状态为已取消，释放并发槽位"""
+        task_info = self.tasks.get(task_uuid) or {}
+        progress = self._progress.get(task_uuid)
+        result = None
+        try:
+            if task_info.get("record_id"):
+                counts = progress.counts if progress is not None else {}
+                success, fail, error = counts.get('success', 0), counts.get('fail', 0), counts.get('error', 0)
+                all_ = success + fail + error
+                pass_rate_value = round((success / all_) * 100, 2) if all_ > 0 else 0.0
+                started_at = task_info.get("started_at") or datetime.now()
+                run_seconds = round((datetime.now() - started_at).total_seconds(), 2)
+                result = {
+                    "status": '已取消',
+                    "pass_rate": str(pass_rate_value),
+                    "run_time": str(run_seconds) + 's',
+                    "all": all_,
+                    "success": success,
+                    "fail": fail,
+                    "error": error
+                }
+                await TestRecord.filter(id=task_info["record_id"]).update(
+                    all=all_, success=success, fail=fail, error=error, pass_rate=result["pass_rate"],
+                    run_time=result["run_time"], status='已取消', pass_rate_value=pass_rate_value,
+                    run_seconds=run_seconds)
+        except Exception as e:
+            self.logger.error(f"保存取消的运行记录失败: uuid={task_uuid} {str(e)}")
+        await self._finish(task_uuid, status=TaskStatus.CANCELLED, result=result, error='任务已取消',
+                           completed_at=datetime.now())
+        self.logger.info(f'任务已取消: uuid={task_uuid} result={result}')
+
+    @staticmethod
+    async def _archive_cases(record_id: int, results: list):
+        """将已写入的用例结果填充到套件结果中"""
+        cases = {}
+        rows = await TestCaseResult.filter(record_id=record_id).order_by('suite_id', 'sort', 'id').values(
+            'suite_id', 'info')
+        for row in rows:
+            cases.setdefault(row['suite_id'], []).append(row['info'])
+        for res in results:
+            res['cases'] = cases.get(res.get('suite_id'), [])
+
+    async def _run_suite_with_timeout(self, suite_id: int, env_id: int, index: int, total: int, task_uuid: str,
+                                      parallel: bool = False, on_case=None, semaphore=None):
         """执行单个套件（带超时）"""
+        if semaphore is not None:
+            async with semaphore:
+                return await self._run_suite_with_timeout(suite_id, env_id, index, total, task_uuid, parallel,
+                                                          on_case)
         try:
-            # 更新进度
-            progress = int((index / total) * 100)
-            self.tasks[task_uuid]["progress"] = progress
-
-            # 执行套件（30秒超时）
+            # 执行套件（套件在执行线程池中运行，超时后会取消执行）
             result = await asyncio.wait_for(
-                run_scenes(SuiteRunForm(env=env_id, flow=suite_id)),
-                timeout=30.0
+                run_suite(SuiteRunForm(env=env_id, flow=suite_id, parallel=parallel), on_case=on_case),
+                timeout=RUNNER_CONFIG['suite_timeout']
             )
 
             self.logger.info(f"套件 {suite_id} 执行完成")
+            result["suite_id"] = suite_id
             return result
 
         except asyncio.TimeoutError:
@@ -191,7 +520,8 @@ class BackgroundTaskManager:
                 "success": 0,
                 "fail": 0,
                 "error": 1,
-                "timeout": True
+                "timeout": True,
+                "suite_id": suite_id
             }
         except Exception as e:
             self.logger.error(f"套件 {suite_id} 执行失败: {str(e)}")
@@ -200,48 +530,146 @@ class BackgroundTaskManager:
                 "success": 0,
                 "fail": 0,
                 "error": 1,
-                "error_msg": str(e)
+                "error_msg": str(e),
+                "suite_id": suite_id
             }
     
-    def get_task_status(self, task_uuid: str) -> Optional[Dict[str, Any]]:
-        """获取任务状态"""
-        return self.tasks.get(task_uuid)
-    
-    def get_all_tasks(self) -> Dict[str, Dict[str, Any]]:
-        """获取所有任务"""
-        return self.tasks.copy()
-    
-    def cleanup_completed_tasks(self, max_age_hours: int = 24):
-        """清理已完成的任务"""
-        current_time = datetime.now()
-        completed_tasks = [
-            task_uuid for task_uuid, task_info in self.tasks.items()
-            if task_info["status"] in [TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.TIMEOUT]
-            and task_info.get("completed_at") is not None
-            and (current_time - task_info["completed_at"]).total_seconds() > max_age_hours * 3600
-        ]
-        
-        for task_uuid in completed_tasks:
-            del self.tasks[task_uuid]
+    async def get_task_status(self, task_uuid: str) -> Optional[Dict[str, Any]]:
+        """获取任务状态，任务可能在其他节点执行"""
+        return await self.store.get(task_uuid)
+
+    async def get_all_tasks(self) -> Dict[str, Dict[str, Any]]:
+        """获取所有等待中和执行中的任务，结束的任务状态保留result_ttl秒后自动清理"""
+        return await self.store.active()
+
+    async def stream_progress(self, task_uuid: str):
+        """
+        任务进度的SSE消息流，先推送当前状态，之后推送每条用例的执行结果，任务结束后关闭
+        :param task_uuid: 任务uuid
+        :return:
+        """
+        subscription = await self.broker.subscribe(task_uuid)
+        try:
+            # 先订阅再查询状态，避免漏掉查询期间的事件
+            snapshot = await self._snapshot(task_uuid)
+            if snapshot is None:
+                return
+            yield sse_message('status', snapshot)
+            if snapshot['status'] in FINISHED:
+                return
+            while True:
+                event = await subscription.get(self.config['sse_ping'])
+                if event is not None:
+                    yield sse_message(event['event'], event)
+                    if event['event'] == 'finish':
+                        return
+                    continue
+                # 没有事件时发送心跳，同时检查任务是否已经结束(例如执行节点失联)、排队位置的变化
+                snapshot = await self._snapshot(task_uuid)
+                if snapshot is None or snapshot['status'] in FINISHED:
+                    if snapshot is not None:
+                        yield sse_message('finish', snapshot)
+                    return
+                if snapshot['status'] == TaskStatus.PENDING:
+                    yield sse_message('queue', snapshot)
+                else:
+                    yield ': ping\n\n'
+        finally:
+            await subscription.close()
+
+    async def _snapshot(self, task_uuid: str) -> Optional[Dict[str, Any]]:
+        """任务当前的状态和进度"""
+        info = await self.store.get(task_uuid)
+        if info is None:
+            return None
+        snapshot = {
+            "task_uuid": task_uuid,
+            "status": info["status"],
+            "progress": info["progress"],
+            **(info.get("counts") or {}),
+            "record_id": info["record_id"],
+            "result": info["result"],
+            "error": info["error"],
+        }
+        if info["status"] == TaskStatus.PENDING:
+            snapshot.update(await self.queue_position(task_uuid) or {})
+        return snapshot
+
+    @property
+    def limits(self):
+        """(全局, 单个项目, 单个环境)同时执行的最大任务数"""
+        return self.config['max_running'], self.config['project_limit'], self.config['env_limit']
+
+    async def estimate(self, position: int) -> Optional[float]:
+        """
+        按任务的平均执行时间估算排在position位的任务还需等待的时间(秒)
+        :param position: 排队位置，从1开始
+        :return:
+        """
+        average = await self.store.average_duration()
+        if average is None:
+            return None
+        slots = self.config['max_running'] or self.config['concurrency']
+        return round(((position - 1) // max(slots, 1) + 1) * average, 1)
+
+    async def queue_position(self, task_uuid: str) -> Optional[Dict[str, Any]]:
+        """等待中任务的排队位置和预计等待时间，任务不在队列中返回None"""
+        pending = await self.store.pending()
+        if task_uuid not in pending:
+            return None
+        position = pending.index(task_uuid) + 1
+        return {"position": position, "eta_seconds": await self.estimate(position)}
+
+    async def get_queue(self) -> Dict[str, Any]:
+        """任务队列概况: 各槽位的占用和等待中的任务"""
+        tasks = await self.store.active()
+        pending = await self.store.pending()
+        running = [info for info in tasks.values() if info['status'] == TaskStatus.RUNNING]
+        projects, envs = {}, {}
+        for info in running:
+            projects[info.get('project_id')] = projects.get(info.get('project_id'), 0) + 1
+            envs[info.get('env_id')] = envs.get(info.get('env_id'), 0) + 1
+        waiting = []
+        for position, task_uuid in enumerate(pending, start=1):
+            info = tasks.get(task_uuid)
+            if info is None:
+                continue
+            waiting.append({
+                "task_uuid": task_uuid,
+                "task_id": info["task_id"],
+                "project_id": info.get("project_id"),
+                "env_id": info["env_id"],
+                "tester": info["tester"],
+                "position": position,
+                "eta_seconds": await self.estimate(position),
+                "created_at": info["created_at"].isoformat() if info["created_at"] else None,
+            })
+        return {
+            "limits": dict(zip(('global', 'project', 'env'), self.limits)),
+            "max_pending": self.config['max_pending'],
+            "running": {"global": len(running), "project": projects, "env": envs},
+            "pending": waiting,
+        }
 
 
 # 全局任务管理器实例
 task_manager = BackgroundTaskManager()
 
 
-async def run_task_async(task_id: int, env_id: int, tester: str) -> str:
-    """异步运行测试任务（基于当前事件循环）"""
-    return await task_manager.create_task(task_id, env_id, tester)
+async def run_task_async(task_id: int, env_id: int, tester: str, parallel: bool = False,
+                         project_id: int = None) -> str:
+    """提交测试任务到任务队列"""
+    return await task_manager.create_task(task_id, env_id, tester, parallel, project_id)
 
 
-def get_task_status(task_uuid: str) -> Optional[Dict[str, Any]]:
+async def get_task_status(task_uuid: str) -> Optional[Dict[str, Any]]:
     """获取任务状态"""
-    return task_manager.get_task_status(task_uuid)
+    return await task_manager.get_task_status(task_uuid)
 
 
-def get_all_running_tasks() -> Dict[str, Dict[str, Any]]:
+async def get_all_running_tasks() -> Dict[str, Dict[str, Any]]:
     """获取所有运行中的任务"""
-    all_tasks = task_manager.get_all_tasks()
+    all_tasks = await task_manager.get_all_tasks()
     return {
         task_uuid: task_info for task_uuid, task_info in all_tasks.items()
         if task_info["status"] in [TaskStatus.PENDING, TaskStatus.RUNNING]
@@ -0,0 +1,427 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : task_queue.py
+"""
+测试任务的队列和状态存储
+任务提交后进入队列，由任意一个进程的工作协程领取执行；执行中的任务持有租约并定时续期，
+执行节点重启或失联时租约过期，任务重新入队由其他节点继续执行
+执行中的任务同时占用全局、项目、环境三个并发槽位，槽位已满的任务留在队列中等待
+"""
+import json
+import time
+from collections import deque
+from datetime import datetime
+
+
+class TaskStatus:
+    """任务状态常量"""
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+    CANCELLED = "cancelled"
+
+
+class TaskQueueFullError(Exception):
+    """等待执行的任务数已达上限"""
+    pass
+
+
+# 保存为iso格式字符串的时间字段
+DATETIME_FIELDS = ('created_at', 'started_at', 'completed_at')
+
+# 任务占用的并发槽位，槽位是以租约到期时间为score的有序集合，节点失联后槽位随租约一起过期
+SLOT_FUNCTIONS = """
+local function slot_keys(prefix, info)
+    return {
+        prefix .. 'global',
+        prefix .. 'project:' .. (redis.call('HGET', info, 'project_id') or 'null'),
+        prefix .. 'env:' .. (redis.call('HGET', info, 'env_id') or 'null'),
+    }
+end
+"""
+
+# 入队，等待的任务数达到上限时返回-1
+SUBMIT_SCRIPT = """
+local size = redis.call('LLEN', KEYS[1])
+if tonumber(ARGV[2]) > 0 and size >= tonumber(ARGV[2]) then
+    return -1
+end
+redis.call('HSET', KEYS[2], unpack(ARGV, 3))
+return redis.call('LPUSH', KEYS[1], ARGV[1])
+"""
+
+# 从队列中按提交顺序找到槽位未满的任务，加上租约并占用槽位
+CLAIM_SCRIPT = SLOT_FUNCTIONS + """
+local now = tonumber(ARGV[1])
+local limits = {tonumber(ARGV[6]), tonumber(ARGV[7]), tonumber(ARGV[8])}
+local function full(key, limit)
+    if limit <= 0 then
+        return false
+    end
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+    return redis.call('ZCARD', key) >= limit
+end
+if full(ARGV[5] .. 'global', limits[1]) then
+    return nil
+end
+local scan = math.min(redis.call('LLEN', KEYS[1]), tonumber(ARGV[9]))
+for i = 1, scan do
+    local uuid = redis.call('LINDEX', KEYS[1], -i)
+    local info = ARGV[4] .. uuid
+    if redis.call('EXISTS', info) == 1 then
+        local keys = slot_keys(ARGV[5], info)
+        if not full(keys[2], limits[2]) and not full(keys[3], limits[3]) then
+            redis.call('LREM', KEYS[1], -1, uuid)
+            redis.call('ZADD', KEYS[2], ARGV[2], uuid)
+            for _, key in ipairs(keys) do
+                redis.call('ZADD', key, ARGV[2], uuid)
+            end
+            redis.call('HSET', info, 'worker', ARGV[3])
+            redis.call('HINCRBY', info, 'attempts', 1)
+            return uuid
+        end
+    end
+end
+return nil
+"""
+
+# 只更新仍然存在的任务，避免状态过期后重新创建不完整的记录
+UPDATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+
+# 续期租约和槽位，任务已被其他节点领取时返回0
+HEARTBEAT_SCRIPT = SLOT_FUNCTIONS + """
+local info = ARGV[3] .. ARGV[1]
+if redis.call('HGET', info, 'worker') ~= ARGV[2] then
+    return 0
+end
+for _, key in ipairs(slot_keys(ARGV[5], info)) do
+    redis.call('ZADD', key, ARGV[4], ARGV[1])
+end
+return redis.call('ZADD', KEYS[1], 'XX', 'CH', ARGV[4], ARGV[1])
+"""
+
+# 释放租约和槽位，ARGV[4]为1时放回队列头部
+RELEASE_SCRIPT = SLOT_FUNCTIONS + """
+local info = ARGV[2] .. ARGV[1]
+redis.call('ZREM', KEYS[1], ARGV[1])
+for _, key in ipairs(slot_keys(ARGV[3], info)) do
+    redis.call('ZREM', key, ARGV[1])
+end
+if #ARGV > 5 then
+    redis.call('HSET', info, unpack(ARGV, 6))
+end
+if ARGV[4] == '1' then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+else
+    redis.call('EXPIRE', info, ARGV[5])
+end
+return 1
+"""
+
+# 从队列中移除等待中的任务并标记为结束，任务已被领取时返回0
+CANCEL_SCRIPT = """
+if redis.call('LREM', KEYS[1], 0, ARGV[1]) == 0 then
+    return 0
+end
+local info = ARGV[2] .. ARGV[1]
+redis.call('HSET', info, unpack(ARGV, 4))
+redis.call('EXPIRE', info, ARGV[3])
+return 1
+"""
+
+# 租约过期的任务释放槽位后重新入队，超过最大执行次数的标记为失败
+REAP_SCRIPT = SLOT_FUNCTIONS + """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local requeued = {}
+for _, uuid in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], uuid)
+    local info = ARGV[3] .. uuid
+    if redis.call('EXISTS', info) == 1 then
+        for _, key in ipairs(slot_keys(ARGV[9], info)) do
+            redis.call('ZREM', key, uuid)
+        end
+        local attempts = tonumber(redis.call('HGET', info, 'attempts') or '0')
+        if attempts < tonumber(ARGV[2]) then
+            redis.call('HSET', info, 'status', ARGV[4], 'worker', 'null')
+            redis.call('RPUSH', KEYS[1], uuid)
+            table.insert(requeued, uuid)
+        else
+            redis.call('HSET', info, 'status', ARGV[5], 'error', ARGV[6], 'completed_at', ARGV[7])
+            redis.call('EXPIRE', info, ARGV[8])
+        end
+    end
+end
+return requeued
+"""
+
+
+def encode_info(info: dict) -> dict:
+    """任务信息转换为redis hash，每个字段单独json编码"""
+    return {k: json.dumps(v.isoformat() if isinstance(v, datetime) else v, ensure_ascii=False, default=str)
+            for k, v in info.items()}
+
+
+def decode_info(data: dict) -> dict:
+    info = {k: json.loads(v) for k, v in data.items()}
+    for key in DATETIME_FIELDS:
+        if info.get(key):
+            info[key] = datetime.fromisoformat(info[key])
+    return info
+
+
+def flatten(fields: dict) -> list:
+    """hash字段转换为HSET的参数列表"""
+    return [item for pair in encode_info(fields).items() for item in pair]
+
+
+class MemoryTaskStore:
+    """进程内的任务存储，重启后任务丢失，只用于本地调试"""
+
+    def __init__(self, result_ttl=24 * 60 * 60):
+        self.result_ttl = result_ttl
+        self._tasks = {}
+        self._queue = deque()
+        # 结束的任务及其过期时间
+        self._expires = {}
+        # 执行中的任务uuid
+        self._running = set()
+        # 执行中任务的租约到期时间
+        self._leases = {}
+        self._durations = []
+
+    async def submit(self, task_uuid, info, max_pending=0):
+        if max_pending and len(self._queue) >= max_pending:
+            raise TaskQueueFullError(f"等待执行的任务已达上限({max_pending})，请稍后重试")
+        self._tasks[task_uuid] = dict(info, attempts=0, worker=None)
+        self._queue.appendleft(task_uuid)
+
+    def _slots(self, info):
+        return 'global', ('project', info.get('project_id')), ('env', info.get('env_id'))
+
+    async def claim(self, worker, lease, limits, scan=100):
+        used = {}
+        for task_uuid in self._running:
+            for slot in self._slots(self._tasks[task_uuid]):
+                used[slot] = used.get(slot, 0) + 1
+        if 0 < limits[0] <= used.get('global', 0):
+            return None
+        for task_uuid in list(reversed(self._queue))[:scan]:
+            info = self._tasks.get(task_uuid)
+            if info is None:
+                continue
+            slots = self._slots(info)
+            if any(0 < limit <= used.get(slot, 0) for slot, limit in zip(slots[1:], limits[1:])):
+                continue
+            self._queue.remove(task_uuid)
+            self._running.add(task_uuid)
+            self._leases[task_uuid] = time.time() + lease
+            info.update(worker=worker, attempts=info['attempts'] + 1)
+            return task_uuid
+        return None
+
+    async def heartbeat(self, task_uuid, worker, lease):
+        info = self._tasks.get(task_uuid)
+        if info is None or info['worker'] != worker or task_uuid not in self._leases:
+            return False
+        self._leases[task_uuid] = time.time() + lease
+        return True
+
+    async def reap(self, max_attempts, error):
+        now = time.time()
+        requeued = []
+        for task_uuid in [k for k, v in self._leases.items() if v <= now]:
+            self._leases.pop(task_uuid)
+            self._running.discard(task_uuid)
+            info = self._tasks.get(task_uuid)
+            if info is None:
+                continue
+            if info['attempts'] < max_attempts:
+                info.update(status=TaskStatus.PENDING, worker=None)
+                self._queue.append(task_uuid)
+                requeued.append(task_uuid)
+            else:
+                info.update(status=TaskStatus.FAILED, error=error, completed_at=datetime.now())
+                self._expires[task_uuid] = time.monotonic() + self.result_ttl
+        return requeued
+
+    async def get(self, task_uuid):
+        self._purge()
+        info = self._tasks.get(task_uuid)
+        return dict(info) if info is not None else None
+
+    async def update(self, task_uuid, **fields):
+        if task_uuid in self._tasks:
+            self._tasks[task_uuid].update(fields)
+
+    async def finish(self, task_uuid, **fields):
+        await self.update(task_uuid, **fields)
+        self._running.discard(task_uuid)
+        self._leases.pop(task_uuid, None)
+        self._expires[task_uuid] = time.monotonic() + self.result_ttl
+
+    async def requeue(self, task_uuid, **fields):
+        await self.update(task_uuid, worker=None, **fields)
+        self._running.discard(task_uuid)
+        self._leases.pop(task_uuid, None)
+        self._queue.append(task_uuid)
+
+    async def cancel_pending(self, task_uuid, **fields):
+        if task_uuid not in self._queue:
+            return False
+        self._queue.remove(task_uuid)
+        await self.finish(task_uuid, **fields)
+        return True
+
+    async def cancel_requested(self, task_uuid):
+        return bool((self._tasks.get(task_uuid) or {}).get('cancel_requested'))
+
+    async def active(self):
+        self._purge()
+        return {task_uuid: dict(info) for task_uuid, info in self._tasks.items() if task_uuid not in self._expires}
+
+    async def pending(self):
+        """等待中的任务uuid，按执行顺序排列"""
+        return list(reversed(self._queue))
+
+    async def record_duration(self, seconds):
+        self._durations = (self._durations + [seconds])[-20:]
+
+    async def average_duration(self):
+        return sum(self._durations) / len(self._durations) if self._durations else None
+
+    def _purge(self):
+        now = time.monotonic()
+        for task_uuid in [k for k, v in self._expires.items() if v < now]:
+            self._expires.pop(task_uuid)
+            self._tasks.pop(task_uuid, None)
+
+
+class RedisTaskStore:
+    """
+    redis中的任务存储，多个进程共享
+    {prefix}:queue          等待执行的任务uuid列表，左进右出
+    {prefix}:leases         执行中的任务，score为租约到期的时间戳
+    {prefix}:info:uuid      任务信息hash，任务结束后保留result_ttl秒
+    {prefix}:slots:global   占用全局槽位的任务，project:id、env:id分别为项目、环境的槽位
+    {prefix}:stats          任务平均执行时间，用于估算等待时间
+    """
+
+    def __init__(self, client, prefix='fa_api:task', result_ttl=24 * 60 * 60):
+        self.client = client
+        self.result_ttl = result_ttl
+        self.queue_key = f'{prefix}:queue'
+        self.lease_key = f'{prefix}:leases'
+        self.info_prefix = f'{prefix}:info:'
+        self.slot_prefix = f'{prefix}:slots:'
+        self.stats_key = f'{prefix}:stats'
+        self._submit = client.register_script(SUBMIT_SCRIPT)
+        self._claim = client.register_script(CLAIM_SCRIPT)
+        self._heartbeat = client.register_script(HEARTBEAT_SCRIPT)
+        self._release = client.register_script(RELEASE_SCRIPT)
+        self._reap = client.register_script(REAP_SCRIPT)
+        self._update = client.register_script(UPDATE_SCRIPT)
+        self._cancel = client.register_script(CANCEL_SCRIPT)
+
+    def info_key(self, task_uuid):
+        return self.info_prefix + task_uuid
+
+    async def submit(self, task_uuid, info, max_pending=0):
+        size = await self._submit(keys=[self.queue_key, self.info_key(task_uuid)],
+                                  args=[task_uuid, max_pending, *flatten(dict(info, attempts=0, worker=None))])
+        if size < 0:
+            raise TaskQueueFullError(f"等待执行的任务已达上限({max_pending})，请稍后重试")
+
+    async def claim(self, worker, lease, limits, scan=100):
+        """
+        领取任务
+        :param worker: 执行节点
+        :param lease: 租约时长(秒)
+        :param limits: (全局, 单个项目, 单个环境)同时执行的最大任务数，0表示不限制
+        :param scan: 最多检查队列中的任务数
+        :return:
+        """
+        now = time.time()
+        return await self._claim(keys=[self.queue_key, self.lease_key], args=[
+            now, now + lease, json.dumps(worker), self.info_prefix, self.slot_prefix, *limits, scan])
+
+    async def heartbeat(self, task_uuid, worker, lease):
+        return bool(await self._heartbeat(keys=[self.lease_key], args=[
+            task_uuid, json.dumps(worker), self.info_prefix, time.time() + lease, self.slot_prefix]))
+
+    async def reap(self, max_attempts, error):
+        """
+        处理租约过期的任务
+        :param max_attempts: 最大执行次数
+        :param error: 超过最大执行次数时记录的错误信息
+        :return: 重新入队的任务uuid
+        """
+        return await self._reap(keys=[self.queue_key, self.lease_key], args=[
+            time.time(), max_attempts, self.info_prefix,
+            json.dumps(TaskStatus.PENDING), json.dumps(TaskStatus.FAILED), json.dumps(error, ensure_ascii=False),
+            json.dumps(datetime.now().isoformat()), self.result_ttl, self.slot_prefix,
+        ])
+
+    async def get(self, task_uuid):
+        data = await self.client.hgetall(self.info_key(task_uuid))
+        return decode_info(data) if data else None
+
+    async def update(self, task_uuid, **fields):
+        await self._update(keys=[self.info_key(task_uuid)], args=flatten(fields))
+
+    async def finish(self, task_uuid, **fields):
+        await self._release(keys=[self.lease_key, self.queue_key], args=[
+            task_uuid, self.info_prefix, self.slot_prefix, 0, self.result_ttl, *flatten(fields)])
+
+    async def requeue(self, task_uuid, **fields):
+        """进程退出时把执行中的任务放回队列头部"""
+        await self._release(keys=[self.lease_key, self.queue_key], args=[
+            task_uuid, self.info_prefix, self.slot_prefix, 1, self.result_ttl, *flatten(dict(fields, worker=None))])
+
+    async def cancel_pending(self, task_uuid, **fields):
+        """
+        取消等待中的任务
+        :param task_uuid: 任务uuid
+        :param fields: 任务结束时更新的字段
+        :return: 任务已被领取或已结束时返回False
+        """
+        return bool(await self._cancel(keys=[self.queue_key], args=[
+            task_uuid, self.info_prefix, self.result_ttl, *flatten(fields)]))
+
+    async def cancel_requested(self, task_uuid):
+        """执行中的任务是否已被请求取消"""
+        value = await self.client.hget(self.info_key(task_uuid), 'cancel_requested')
+        return bool(value and json.loads(value))
+
+    async def active(self):
+        """等待中和执行中的任务"""
+        pending = await self.client.lrange(self.queue_key, 0, -1)
+        running = await self.client.zrange(self.lease_key, 0, -1)
+        uuids = list(dict.fromkeys(running + pending[::-1]))
+        async with self.client.pipeline(transaction=False) as pipe:
+            for task_uuid in uuids:
+                pipe.hgetall(self.info_key(task_uuid))
+            rows = await pipe.execute()
+        return {task_uuid: decode_info(data) for task_uuid, data in zip(uuids, rows) if data}
+
+    async def pending(self):
+        """等待中的任务uuid，按执行顺序排列"""
+        return (await self.client.lrange(self.queue_key, 0, -1))[::-1]
+
+    async def record_duration(self, seconds):
+        """按指数移动平均记录任务的执行时间"""
+        average = await self.average_duration()
+        average = seconds if average is None else average * 0.8 + seconds * 0.2
+        await self.client.hset(self.stats_key, 'average_seconds', average)
+
+    async def average_duration(self):
+        value = await self.client.hget(self.stats_key, 'average_seconds')
+        return float(value) if value is not None else None
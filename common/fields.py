@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : fields.py
+"""
+自定义的模型字段
+"""
+import base64
+import gzip
+import json
+
+from tortoise import fields
+
+from common.settings import COMPRESS_CONFIG
+
+# 压缩后的数据保存为{"__gzip__": "base64编码的压缩数据"}，仍然是合法的json，数据库字段类型不变
+GZIP_KEY = '__gzip__'
+
+
+class CompressedJSONField(fields.JSONField):
+    """序列化后超过阈值时使用gzip压缩保存的JSON字段，读取时自动解压，兼容未压缩的数据"""
+
+    def __init__(self, threshold=None, **kwargs):
+        """
+        :param threshold: 压缩阈值(字节)，默认使用COMPRESS_CONFIG中的配置，0表示不压缩
+        """
+        super().__init__(**kwargs)
+        self.threshold = COMPRESS_CONFIG['threshold'] if threshold is None else threshold
+
+    def to_db_value(self, value, instance):
+        value = super().to_db_value(value, instance)
+        if value is None or not self.threshold or len(value) < self.threshold:
+            return value
+        data = gzip.compress(value.encode('utf-8'), compresslevel=COMPRESS_CONFIG['level'])
+        return json.dumps({GZIP_KEY: base64.b64encode(data).decode('ascii')})
+
+    def to_python_value(self, value):
+        value = super().to_python_value(value)
+        if isinstance(value, dict) and len(value) == 1 and GZIP_KEY in value:
+            value = self.decoder(gzip.decompress(base64.b64decode(value[GZIP_KEY])))
+        return value
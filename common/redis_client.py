@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : redis_client.py
+from redis import asyncio as aioredis
+
+from common.settings import REDIS_CONFIG
+
+# 进程内共享的异步redis客户端，连接在首次使用时创建
+redis_client = aioredis.Redis(**REDIS_CONFIG, decode_responses=True)
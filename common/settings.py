@@ -85,6 +85,140 @@ REDIS_CONFIG = {
     "password": os.getenv('REDIS_PASSWORD', 'ufo123')
 }
 
+# ==========================测试任务队列配置 ==========================
+TASK_QUEUE_CONFIG = {
+    # 任务队列和状态的存储: redis(多实例共享、重启不丢失) / memory(单进程，仅用于本地调试)
+    "backend": os.getenv('TASK_QUEUE_BACKEND', 'redis'),
+    # redis中键名的前缀
+    "prefix": os.getenv('TASK_QUEUE_PREFIX', 'fa_api:task'),
+    # 每个进程同时执行的最大任务数
+    "concurrency": int(os.getenv('TASK_WORKER_CONCURRENCY', 4)),
+    # 所有进程同时执行的最大任务数，0表示不限制
+    "max_running": int(os.getenv('TASK_MAX_RUNNING', 8)),
+    # 单个项目同时执行的最大任务数，0表示不限制
+    "project_limit": int(os.getenv('TASK_PROJECT_LIMIT', 4)),
+    # 单个测试环境同时执行的最大任务数，避免压垮被测系统，0表示不限制
+    "env_limit": int(os.getenv('TASK_ENV_LIMIT', 2)),
+    # 等待执行的最大任务数，超过后拒绝提交，0表示不限制
+    "max_pending": int(os.getenv('TASK_MAX_PENDING', 100)),
+    # 单个任务中同时执行的最大套件数，0表示不限制
+    "suite_concurrency": int(os.getenv('TASK_SUITE_CONCURRENCY', 4)),
+    # 任务租约时长(秒)，执行节点超过该时间没有心跳时任务重新入队
+    "lease": float(os.getenv('TASK_LEASE_SECONDS', 60)),
+    # 心跳间隔(秒)
+    "heartbeat": float(os.getenv('TASK_HEARTBEAT_SECONDS', 15)),
+    # 队列为空时拉取任务的间隔(秒)
+    "poll_interval": float(os.getenv('TASK_POLL_INTERVAL', 1)),
+    # 任务最多执行的次数，执行节点失联超过该次数后标记为失败
+    "max_attempts": int(os.getenv('TASK_MAX_ATTEMPTS', 3)),
+    # 结束的任务状态保留时间(秒)
+    "result_ttl": int(os.getenv('TASK_RESULT_TTL', 24 * 60 * 60)),
+    # 执行进度写入任务状态的最短间隔(秒)，进度事件实时推送不受影响
+    "progress_interval": float(os.getenv('TASK_PROGRESS_INTERVAL', 1)),
+    # 进度推送接口没有事件时发送心跳的间隔(秒)
+    "sse_ping": float(os.getenv('TASK_SSE_PING', 15)),
+}
+
+# ==========================用例执行HTTP配置 ==========================
+# 每个测试环境独立维护一个keep-alive连接池，环境变量中的pool_size可单独指定最大连接数
+HTTP_CONFIG = {
+    "max_connections": int(os.getenv('HTTP_MAX_CONNECTIONS', 100)),
+    "max_keepalive_connections": int(os.getenv('HTTP_MAX_KEEPALIVE', 20)),
+    "keepalive_expiry": float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30)),
+    # 建连失败的重试次数，环境变量中的max_retries可覆盖
+    "max_retries": int(os.getenv('HTTP_MAX_RETRIES', 1)),
+}
+
+# ==========================用例执行线程池配置 ==========================
+RUNNER_CONFIG = {
+    # 工作线程数，每个线程同一时间执行一个套件
+    "workers": int(os.getenv('RUNNER_WORKERS', 4)),
+    # 等待空闲线程的最大套件数，超过后拒绝执行
+    "queue_size": int(os.getenv('RUNNER_QUEUE_SIZE', 64)),
+    # 单个套件的最长执行时间(秒)
+    "suite_timeout": float(os.getenv('RUNNER_SUITE_TIMEOUT', 1800)),
+    # 并行模式下套件内同时执行的最大用例数
+    "case_concurrency": int(os.getenv('RUNNER_CASE_CONCURRENCY', 10)),
+    # 环境变量定时写入数据库的间隔(秒)，0表示只在套件结束时写入
+    "env_flush_interval": float(os.getenv('RUNNER_ENV_FLUSH_INTERVAL', 10)),
+}
+
+# ==========================用例脚本数据库连接池配置 ==========================
+DB_POOL_CONFIG = {
+    # 每个数据库配置的最大连接数
+    "max_size": int(os.getenv('DB_POOL_MAX_SIZE', 5)),
+    # 空闲超过该时间(秒)的连接会被关闭
+    "idle_timeout": float(os.getenv('DB_POOL_IDLE_TIMEOUT', 300)),
+    # 空闲超过该时间(秒)的连接取出时先检查是否可用
+    "health_check_interval": float(os.getenv('DB_POOL_HEALTH_CHECK', 30)),
+    # 连接池已满时等待的最长时间(秒)
+    "acquire_timeout": float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', 30)),
+}
+
+# ==========================用例响应体配置 ==========================
+# 环境变量或用例请求参数中的body_limit、max_body_size可覆盖
+RESPONSE_CONFIG = {
+    # 测试结果中保存完整响应体的上限(字节)，超过后只保存预览、大小和sha256
+    "body_limit": int(os.getenv('RESPONSE_BODY_LIMIT', 1024 * 1024)),
+    # 超过上限时保存的预览长度(字节)
+    "preview_size": int(os.getenv('RESPONSE_PREVIEW_SIZE', 64 * 1024)),
+    # 最多读取的响应体大小(字节)，超过部分直接丢弃，0表示不限制
+    "max_body_size": int(os.getenv('RESPONSE_MAX_BODY_SIZE', 100 * 1024 * 1024)),
+}
+
+# ==========================用例结果配置 ==========================
+RESULT_CONFIG = {
+    # 通过的用例不保存的字段，逗号分隔，例如requests_header,response_header
+    "success_exclude": tuple(f.strip() for f in os.getenv('RESULT_SUCCESS_EXCLUDE', '').split(',') if f.strip()),
+    # 任务执行时用例结果每攒够多少条写入一次数据库
+    "batch_size": int(os.getenv('RESULT_BATCH_SIZE', 100)),
+    # 用例结果定时写入数据库的间隔(秒)
+    "flush_interval": float(os.getenv('RESULT_FLUSH_INTERVAL', 2)),
+    # 是否在TestReport.info中额外归档完整的用例结果，默认只保存套件统计
+    "archive": os.getenv('RESULT_ARCHIVE', 'false').lower() == 'true',
+}
+
+# ==========================报告压缩配置 ==========================
+COMPRESS_CONFIG = {
+    # 报告、用例结果的json超过该大小(字节)时压缩保存，0表示不压缩
+    "threshold": int(os.getenv('REPORT_COMPRESS_THRESHOLD', 4096)),
+    # gzip压缩级别1-9
+    "level": int(os.getenv('REPORT_COMPRESS_LEVEL', 6)),
+    # 响应体超过该大小(字节)且请求头Accept-Encoding包含gzip时压缩返回
+    "response_minimum_size": int(os.getenv('RESPONSE_GZIP_MINIMUM_SIZE', 1024)),
+}
+
+# ==========================用例日志配置 ==========================
+CASE_LOG_CONFIG = {
+    # 记录的最低日志级别: DEBUG/INFO/WARN/ERROR/CRITICAL
+    "level": os.getenv('CASE_LOG_LEVEL', 'DEBUG').upper(),
+    # 单条日志的最大字符数，超过后截断
+    "max_message": int(os.getenv('CASE_LOG_MAX_MESSAGE', 4096)),
+    # 一条用例日志的最大字符数，超过后丢弃后续日志
+    "max_size": int(os.getenv('CASE_LOG_MAX_SIZE', 262144)),
+    # 是否同时输出到控制台，生产环境默认关闭
+    "echo": os.getenv('CASE_LOG_ECHO', 'false').lower() == 'true',
+}
+
+# 编译后脚本的缓存数量
+SCRIPT_CACHE_SIZE = int(os.getenv('SCRIPT_CACHE_SIZE', 512))
+# 编译后请求模板的缓存数量
+TEMPLATE_CACHE_SIZE = int(os.getenv('TEMPLATE_CACHE_SIZE', 1024))
+# 批量导入导出用例时每块的用例数
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 500))
+
+# ==========================套件执行计划缓存配置 ==========================
+PLAN_CACHE_CONFIG = {
+    # 最多缓存的套件数，0表示不缓存
+    "max_size": int(os.getenv('PLAN_CACHE_SIZE', 256)),
+    # 计划的最长有效时间(秒)，0表示不过期
+    "ttl": float(os.getenv('PLAN_CACHE_TTL', 300)),
+    # 失效版本号的共享方式: redis(多个进程部署时其他进程的修改立即生效) / memory(单进程)
+    "backend": os.getenv('PLAN_CACHE_BACKEND', 'redis'),
+    # redis中共享版本号的键名
+    "version_key": os.getenv('PLAN_CACHE_VERSION_KEY', 'fa_api:plan:version'),
+}
+
 
 # ==========================腾讯存储配置 ==========================
 TENCENT_CONFIG={
@@ -2,6 +2,7 @@ import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from starlette.staticfiles import StaticFiles
 from tortoise.contrib.fastapi import register_tortoise
 from common import settings
@@ -13,7 +14,11 @@ from apps.projects.api import file_router
 from apps.Interface.api import router as interface_router
 from apps.Suite.api import router as suite_router
 from apps.TestTask.api import router as task_router
+from apps.TestTask.task_manager import task_manager
 from apps.Crontab.api import router as cron_router, scheduler, init_scheduler
+from BackEngine.core.httpclient import http_pool
+from BackEngine.core.executor import runner_executor
+from BackEngine.core.dbclient import db_pools
 
 
 @asynccontextmanager
@@ -22,11 +27,19 @@ async def lifespan(app: FastAPI):
     if not scheduler.running:
         await init_scheduler()
         print("Scheduler started")
+    # 启动测试任务的执行节点，继续执行队列中的任务
+    task_manager.start()
     yield
+    # 执行中的任务放回队列，由其他节点或重启后继续执行
+    await task_manager.stop()
     # 关闭时调用
     if scheduler.running:
         scheduler.shutdown()
         print("Scheduler stopped")
+    # 关闭用例执行线程池、请求连接池和脚本数据库连接池
+    await runner_executor.shutdown()
+    await http_pool.aclose()
+    db_pools.close_all()
 
 
 app = FastAPI(title='FastApi学习项目', summary='这个是学习项目的接口文档', version='0.0.1',
@@ -62,6 +75,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 报告等大数据量接口按请求头Accept-Encoding压缩返回
+app.add_middleware(GZipMiddleware, minimum_size=settings.COMPRESS_CONFIG['response_minimum_size'])
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : conftest.py
+import asyncio
+import logging
+import os
+import sys
+
+import pytest
+from tortoise import Tortoise
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.settings import INSTALLED_APPS  # noqa: E402
+
+
+class QueryCounter(logging.Handler):
+    """统计tortoise执行的sql语句数"""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.count = 0
+
+    def emit(self, record):
+        if record.getMessage().lstrip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE')):
+            self.count += 1
+
+
+@pytest.fixture
+def run_db():
+    """在内存sqlite数据库中执行协程函数"""
+    def run(func):
+        async def main():
+            await Tortoise.init(db_url='sqlite://:memory:', modules={'models': INSTALLED_APPS})
+            await Tortoise.generate_schemas()
+            try:
+                return await func()
+            finally:
+                await Tortoise.close_connections()
+        return asyncio.run(main())
+    return run
+
+
+@pytest.fixture
+def queries():
+    """sql语句计数器，count清零后开始统计"""
+    logger = logging.getLogger('tortoise.db_client')
+    level = logger.level
+    counter = QueryCounter()
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(counter)
+    yield counter
+    logger.removeHandler(counter)
+    logger.setLevel(level)
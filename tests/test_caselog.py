@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : test_caselog.py
+from BackEngine.core.caselog import CaseLogBuffer, CaseLogHandel
+
+
+class Unformattable:
+    def __str__(self):
+        raise AssertionError('日志已满时不应格式化参数')
+
+
+def make_log(max_message=100, max_size=1000):
+    log = CaseLogHandel()
+    log._log_buffer = CaseLogBuffer(max_message, max_size)
+    return log
+
+
+def test_short_message_unchanged():
+    log = make_log()
+    log.info_log('提取结果：', {'a': [1, 2]}, 3)
+    assert log.log_data == [('INFO', "【INFO】｜ 提取结果：{'a': [1, 2]}3")]
+
+
+def test_large_arguments_cut_before_join():
+    log = make_log(max_message=100)
+    body = 'x' * 10 * 1024 * 1024
+    log.debug_log('数据源：', body)
+    log.debug_log('数据源：', {'items': list(range(100000))})
+    for level, message in log.log_data:
+        assert message.endswith('...[已截断，超过100字符]')
+        assert len(message) == 100
+
+
+def test_stop_formatting_when_full():
+    log = make_log(max_message=100, max_size=150)
+    log.info_log('a' * 100)
+    log.info_log('b' * 100)
+    log.info_log(Unformattable())
+    assert len(log._log_buffer.records) == 1
+    assert log._log_buffer.dropped == 2
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : test_httpclient.py
+import httpx
+import pytest
+
+from BackEngine.core.httpclient import build_timeout
+
+
+def test_build_timeout():
+    assert build_timeout(None) == httpx.Timeout(None)
+    assert build_timeout(3) == httpx.Timeout(3, connect=5)
+    assert build_timeout([2, 10]) == httpx.Timeout(10, connect=2)
+    assert build_timeout((2, None)) == httpx.Timeout(None, connect=2)
+
+
+@pytest.mark.parametrize('value', ['30', [1, 2, 3], {"connect": 1}])
+def test_build_timeout_invalid(value):
+    with pytest.raises(ValueError):
+        build_timeout(value)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : test_task_queries.py
+"""任务列表、修改任务套件的查询次数不随任务数、套件数增加"""
+from apps.projects.models import Project
+from apps.Suite.models import Suite
+from apps.TestTask import api
+from apps.TestTask import models as task_models
+from apps.TestTask.schemas import UpdateTaskForm
+from apps.users.models import Users
+
+
+async def create_project():
+    user = await Users.create(username='u', password='p', nickname='n')
+    return await Project.create(name='p', leader=user)
+
+
+def test_get_tasks_query_count(run_db, queries):
+    async def main():
+        project = await create_project()
+        suites = [await Suite.create(project=project, name=f's{i}') for i in range(3)]
+        counts = {}
+        for total in (5, 50):
+            while await task_models.TestTask.filter(project=project).count() < total:
+                task = await task_models.TestTask.create(project=project, name='t')
+                await task.suite.add(*suites)
+            queries.count = 0
+            tasks = await api.get_tasks(project=project.id)
+            counts[total] = queries.count
+            assert len(tasks) == total
+            assert all(task['flow'] == [suite.id for suite in suites] for task in tasks)
+        return counts
+
+    assert run_db(main) == {5: 2, 50: 2}
+
+
+def test_add_icase_query_count(run_db, queries):
+    async def main():
+        project = await create_project()
+        suites = [await Suite.create(project=project, name=f's{i}') for i in range(22)]
+        counts = {}
+        for total in (3, 21):
+            task = await task_models.TestTask.create(project=project, name='t')
+            await task.suite.add(suites[-1])
+            flow = [suite.id for suite in suites[:total]]
+            queries.count = 0
+            await api.add_icase(UpdateTaskForm(id=task.id, name='t', flow=flow))
+            counts[total] = queries.count
+            assert sorted(await task.suite.all().values_list('id', flat=True)) == flow
+        return counts
+
+    assert run_db(main) == {3: 7, 21: 7}
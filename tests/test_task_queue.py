@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# @Author : John
+# @Time : 2026/10/18
+# @File : test_task_queue.py
+"""任务队列的槽位、租约、失效回收和取消，redis存储使用fakeredis执行lua脚本"""
+import asyncio
+
+import fakeredis
+import pytest
+
+from apps.TestTask.task_queue import MemoryTaskStore, RedisTaskStore, TaskStatus
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def store(request):
+    if request.param == 'memory':
+        return MemoryTaskStore(result_ttl=60)
+    return RedisTaskStore(fakeredis.aioredis.FakeRedis(decode_responses=True), prefix='test', result_ttl=60)
+
+
+async def submit(store, task_uuid, project_id=1, env_id=1):
+    await store.submit(task_uuid, {"task_id": 1, "project_id": project_id, "env_id": env_id,
+                                   "status": TaskStatus.PENDING, "record_id": None})
+
+
+async def claim_all(store, limits):
+    claimed = []
+    while True:
+        task_uuid = await store.claim('w1', 60, limits)
+        if task_uuid is None:
+            return claimed
+        claimed.append(task_uuid)
+
+
+def test_claim_global_limit(store):
+    async def main():
+        for i in range(3):
+            await submit(store, f't{i}', project_id=i, env_id=i)
+        assert await claim_all(store, (2, 0, 0)) == ['t0', 't1']
+        await store.finish('t0', status=TaskStatus.COMPLETED)
+        assert await claim_all(store, (2, 0, 0)) == ['t2']
+
+    asyncio.run(main())
+
+
+def test_claim_project_limit_skips_ahead(store):
+    async def main():
+        await submit(store, 't0', project_id=1, env_id=1)
+        await submit(store, 't1', project_id=1, env_id=2)
+        await submit(store, 't2', project_id=2, env_id=3)
+        # 项目1的槽位已满时，后面其他项目的任务先执行
+        assert await claim_all(store, (0, 1, 0)) == ['t0', 't2']
+        assert await store.pending() == ['t1']
+        await store.finish('t0', status=TaskStatus.COMPLETED)
+        assert await claim_all(store, (0, 1, 0)) == ['t1']
+
+    asyncio.run(main())
+
+
+def test_claim_env_limit(store):
+    async def main():
+        await submit(store, 't0', project_id=1, env_id=1)
+        await submit(store, 't1', project_id=2, env_id=1)
+        await submit(store, 't2', project_id=3, env_id=2)
+        assert await claim_all(store, (0, 0, 1)) == ['t0', 't2']
+        await store.requeue('t0', status=TaskStatus.PENDING)
+        assert await store.pending() == ['t0', 't1']
+        assert await claim_all(store, (0, 0, 1)) == ['t0']
+
+    asyncio.run(main())
+
+
+def test_heartbeat_from_other_worker(store):
+    async def main():
+        await submit(store, 't0')
+        assert await store.claim('w1', 60, (0, 0, 0)) == 't0'
+        assert await store.heartbeat('t0', 'w1', 60) is True
+        assert await store.heartbeat('t0', 'w2', 60) is False
+
+    asyncio.run(main())
+
+
+def test_reap_expired_lease_requeues_with_record(store):
+    async def main():
+        await submit(store, 't0')
+        # 租约已经过期
+        assert await store.claim('w1', -1, (1, 1, 1)) == 't0'
+        await store.update('t0', status=TaskStatus.RUNNING, record_id=7)
+        assert await store.reap(3, 'lost') == ['t0']
+        info = await store.get('t0')
+        assert info['status'] == TaskStatus.PENDING
+        assert info['record_id'] == 7
+        assert info['worker'] is None
+        assert await store.pending() == ['t0']
+        # 槽位随租约释放，失联的节点不能再续期
+        assert await store.heartbeat('t0', 'w1', 60) is False
+        assert await store.claim('w2', 60, (1, 1, 1)) == 't0'
+        assert (await store.get('t0'))['attempts'] == 2
+
+    asyncio.run(main())
+
+
+def test_reap_fails_after_max_attempts(store):
+    async def main():
+        await submit(store, 't0')
+        await store.claim('w1', -1, (0, 0, 0))
+        assert await store.reap(1, 'lost') == []
+        info = await store.get('t0')
+        assert info['status'] == TaskStatus.FAILED
+        assert info['error'] == 'lost'
+        assert await store.pending() == []
+
+    asyncio.run(main())
+
+
+def test_cancel_pending(store):
+    async def main():
+        await submit(store, 't0')
+        await submit(store, 't1')
+        assert await store.claim('w1', 60, (0, 0, 0)) == 't0'
+        assert await store.cancel_pending('t1', status=TaskStatus.CANCELLED) is True
+        assert await store.pending() == []
+        assert (await store.get('t1'))['status'] == TaskStatus.CANCELLED
+        assert await store.claim('w1', 60, (0, 0, 0)) is None
+        # 已被领取的任务由执行节点中断
+        assert await store.cancel_pending('t0', status=TaskStatus.CANCELLED) is False
+
+    asyncio.run(main())